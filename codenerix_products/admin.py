@@ -27,6 +27,7 @@ from .models import GroupValueFeature, GroupValueAttribute, GroupValueFeatureSpe
 from .models import OptionValueFeature, OptionValueAttribute, OptionValueFeatureSpecial
 from .models import MODELS, MODELS_BRANDS, MODELS_PRODUCTS, MODELS_SLUG, MODELS_SLIDERS, MODELS_PRODUCTS_FINAL
 from .models import ProductFinalOption
+from .models import get_text_model
 
 admin.site.register(TypeTax)
 admin.site.register(Feature)
@@ -52,9 +53,7 @@ admin.site.register(OptionValueFeatureSpecial)
 admin.site.register(ProductFinalOption)
 
 for info in MODELS + MODELS_BRANDS + MODELS_PRODUCTS + MODELS_SLIDERS + MODELS_SLUG + MODELS_PRODUCTS_FINAL:
-    model = info[1]
+    model_relate = info[-1]
     for lang in settings.LANGUAGES:
         lang_code = lang[0]
-        query = "from .models import {}Text{}\n".format(model, lang_code.upper())
-        query += "admin.site.register({}Text{})\n".format(model, lang_code.upper())
-        exec(query)
+        admin.site.register(get_text_model(model_relate, lang_code))
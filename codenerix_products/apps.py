@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MyAppConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'codenerix_products'
+
+    def ready(self):
+        from codenerix_products import signals  # noqa
+        from codenerix_products.texts import install_texts_accessors
+        install_texts_accessors()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+
+from codenerix_products.caches import JournalTable
+from codenerix_products.models import Feature, Category, Subcategory, Product, ProductFinal, RECALCULATE_BATCH_SIZE
+from codenerix_products.search import rank_order, tokenize
+
+
+# number of ranked candidates checked at once against the filters of each selector (the next checks take twice as many)
+AUTOCOMPLETE_CANDIDATES = getattr(settings, 'CDNX_PRODUCTS_AUTOCOMPLETE_CANDIDATES', 1000)
+# searches with more candidates are not fully ranked, their candidates are read word by word
+AUTOCOMPLETE_BROAD = AUTOCOMPLETE_CANDIDATES * 16
+
+
+class AutocompleteIndex(object):
+    """
+    In-memory prefix index of a model: every word of the given fields points to the pks having it
+    fields: lookups of the model, '{}' is replaced by each language of LANGUAGES_DATABASES
+    senders: {model name: lookup from the model of the index to it}, the names ending in 'Text' are the text models of each language
+    and their lookup goes to the entity of the text, 'pk' is the model of the index itself
+    """
+
+    def __init__(self, name, model, fields, senders):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.senders = senders
+        self.table = JournalTable('autocomplete_{}'.format(name), self.build, self.apply)
+
+    def get_fields(self):
+        fields = []
+        for field in self.fields:
+            if '{}' in field:
+                fields += [field.format(lang_code.lower()) for lang_code in settings.LANGUAGES_DATABASES]
+            else:
+                fields.append(field)
+        return fields
+
+    def collect(self, pks=None):
+        """
+        {pk: set of words} of the model
+        """
+        queryset = self.model.objects.all()
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        documents = {}
+        for info in queryset.values_list('pk', *self.get_fields()).iterator():
+            # las relaciones multiples repiten el pk
+            document = documents.setdefault(info[0], set())
+            for value in info[1:]:
+                if value:
+                    document.update(tokenize(value))
+        return documents
+
+    def build(self):
+        """
+        Return the sorted list of words, the index {word: set of pks} and the words of each pk
+        """
+        documents = self.collect()
+        index = {}
+        for pk, document in documents.items():
+            for word in document:
+                index.setdefault(word, set()).add(pk)
+        return (sorted(index), index, documents)
+
+    def apply(self, data, pks):
+        """
+        New index with the given pks read again, the current one is not modified
+        """
+        tokens, index, documents = data
+        index = dict(index)
+        documents = dict(documents)
+        # los conjuntos se copian antes de tocarlos, los lectores siguen usando el indice anterior
+        copied = set()
+        # la lista ordenada de palabras solo se rehace si aparecen o desaparecen palabras
+        resort = False
+        for pk in pks:
+            for word in documents.pop(pk, ()):
+                if word not in copied:
+                    index[word] = set(index[word])
+                    copied.add(word)
+                index[word].discard(pk)
+                if not index[word]:
+                    del index[word]
+                    resort = True
+        for pk, document in self.collect(pks).items():
+            documents[pk] = document
+            for word in document:
+                if word not in index:
+                    index[word] = set()
+                    resort = True
+                elif word not in copied:
+                    index[word] = set(index[word])
+                copied.add(word)
+                index[word].add(pk)
+        if resort:
+            tokens = sorted(index)
+        return (tokens, index, documents)
+
+    def changed(self, lookup, pk, deleted=False):
+        """
+        Read again the pks of the model related to the saved or deleted instance (pk) of a sender
+        """
+        if lookup == 'pk':
+            self.update([pk])
+        elif deleted:
+            # las relaciones puestas a NULL por el borrado no envian señales
+            self.table.invalidate()
+        else:
+            self.update(list(self.model.objects.filter(**{lookup: pk}).values_list('pk', flat=True)))
+
+    def update(self, pks):
+        if len(pks) > RECALCULATE_BATCH_SIZE:
+            self.table.invalidate()
+        else:
+            self.table.update(pks)
+
+    def prefixed(self, tokens, word):
+        """
+        Words of the index beginning with word, the word itself first
+        """
+        position = bisect_left(tokens, word)
+        while position < len(tokens) and tokens[position].startswith(word):
+            yield tokens[position]
+            position += 1
+
+    def size(self, tokens, index, word):
+        """
+        Number of pks of the words beginning with word, counted up to AUTOCOMPLETE_BROAD
+        """
+        size = 0
+        for token in self.prefixed(tokens, word):
+            size += len(index[token])
+            if size > AUTOCOMPLETE_BROAD:
+                break
+        return size
+
+    def candidates(self, search):
+        """
+        Iterator over the pks having every word of the search as the beginning of some word, the most relevant first
+        (more words of the search complete, then fewer words), None if there is nothing to search
+        """
+        words = set(tokenize(search))
+        if not words:
+            return None
+
+        tokens, index, documents = self.table.get()
+        # la palabra con menos pks guia la busqueda, el resto se comprueba en las palabras de cada pk
+        sizes = dict([(word, self.size(tokens, index, word)) for word in words])
+        driver = min(words, key=lambda word: (sizes[word], -len(word)))
+        rest = words - set([driver])
+
+        def complete(pk):
+            return all([any([token.startswith(word) for token in documents[pk]]) for word in rest])
+
+        if sizes[driver] > AUTOCOMPLETE_BROAD:
+            # busqueda amplia (primeras pulsaciones): se recorren las palabras de la guia en orden, la exacta primero,
+            # sin unir ni ordenar todos sus pks
+            return (pk for pk in self.ranked(self.prefixed(tokens, driver), index, documents) if complete(pk))
+
+        result = set()
+        for token in self.prefixed(tokens, driver):
+            result |= index[token]
+        result = [pk for pk in result if complete(pk)]
+        return iter(sorted(result, key=lambda pk: (-len(words & documents[pk]), len(documents[pk]), pk)))
+
+    def ranked(self, tokens, index, documents):
+        """
+        Pks of the given words in their order, the ones with fewer words first within each word
+        """
+        seen = set()
+        for token in tokens:
+            found = index[token] - seen
+            seen |= found
+            for pk in sorted(found, key=lambda pk: (len(documents[pk]), pk)):
+                yield pk
+
+    def filter(self, queryset, search, limit=None):
+        """
+        Limit the queryset, with the filters of the selector already applied, to its best limit
+        (LIMIT_FOREIGNKEY by default) candidates of the search, ordered by relevance
+        """
+        candidates = self.candidates(search)
+        if candidates is None:
+            return queryset
+        if limit is None:
+            limit = settings.LIMIT_FOREIGNKEY
+
+        found = []
+        size = AUTOCOMPLETE_CANDIDATES
+        while len(found) < limit:
+            chunk = list(islice(candidates, size))
+            if not chunk:
+                break
+            valid = set(queryset.filter(pk__in=chunk).order_by().values_list('pk', flat=True))
+            found += [pk for pk in chunk if pk in valid]
+            size = min(size * 2, AUTOCOMPLETE_BROAD)
+        found = found[:limit]
+        return queryset.filter(pk__in=found).order_by(rank_order('pk', found, limit=limit))
+
+
+FEATURES = AutocompleteIndex(
+    'features', Feature,
+    ['family__code', 'category__code', '{}__description', 'family__{}__name', 'category__{}__name'],
+    {'Feature': 'pk', 'FeatureText': 'pk', 'Family': 'family', 'FamilyText': 'family', 'Category': 'category', 'CategoryText': 'category'},
+)
+CATEGORIES = AutocompleteIndex(
+    'categories', Category,
+    ['code', '{}__name'],
+    {'Category': 'pk', 'CategoryText': 'pk'},
+)
+SUBCATEGORIES = AutocompleteIndex(
+    'subcategories', Subcategory,
+    ['code', '{}__name'],
+    {'Subcategory': 'pk', 'SubcategoryText': 'pk'},
+)
+PRODUCTS = AutocompleteIndex(
+    'products', Product,
+    ['model', '{}__name', '{}__description_short', 'family__{}__name', 'category__{}__name', 'subcategory__{}__name'],
+    {'Product': 'pk', 'ProductTextText': 'pk', 'FamilyText': 'family', 'CategoryText': 'category', 'SubcategoryText': 'subcategory'},
+)
+PRODUCTS_FINAL = AutocompleteIndex(
+    'products_final', ProductFinal,
+    ['product__code', 'product__family__code', 'product__category__code', 'product__{}__description_short', 'product__family__{}__name', 'product__category__{}__name'],
+    {
+        'ProductFinal': 'pk', 'Product': 'product', 'ProductTextText': 'product',
+        'Family': 'product__family', 'FamilyText': 'product__family', 'Category': 'product__category', 'CategoryText': 'product__category',
+    },
+)
+PRODUCTS_FINAL_EAN13 = AutocompleteIndex(
+    'products_final_ean13', ProductFinal,
+    ['ean13', 'code', 'product__code'],
+    {'ProductFinal': 'pk', 'Product': 'product'},
+)
+
+AUTOCOMPLETE_INDEXES = [FEATURES, CATEGORIES, SUBCATEGORIES, PRODUCTS, PRODUCTS_FINAL, PRODUCTS_FINAL_EAN13]
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.encoding import smart_str
+
+
+# cache shared by all the processes, it keeps the generation of each table (and the data of the shared ones)
+CACHE_ALIAS = getattr(settings, 'CDNX_PRODUCTS_CACHE', 'default')
+# seconds a process trusts its tables without asking the shared cache for a new generation
+LOCAL_TABLE_CHECK_INTERVAL = getattr(settings, 'CDNX_PRODUCTS_LOCAL_TABLE_CHECK_INTERVAL', 5)
+# seconds the incremental changes of a table (JournalTable) are kept for the other processes, after them they rebuild the whole table
+JOURNAL_TIMEOUT = getattr(settings, 'CDNX_PRODUCTS_JOURNAL_TIMEOUT', 3600)
+
+
+class LocalTable(object):
+    """
+    Data built once per process and kept in memory
+    builder: function without arguments returning the data
+    shared: keep a copy of each generation in the shared cache, a process only builds the table if nobody did it before
+    The table is rebuilt lazily after invalidate() in this process, or when other process publishes a new generation
+    """
+
+    def __init__(self, name, builder, check_interval=LOCAL_TABLE_CHECK_INTERVAL, shared=False):
+        self.name = name
+        self.builder = builder
+        self.check_interval = check_interval
+        self.shared = shared
+        self.key = 'cdnx_products:{}:generation'.format(name)
+        self._lock = threading.Lock()
+        self._data = None
+        self._generation = None
+        self._checked = 0
+        # changes on each local invalidation, a build started before it is not kept
+        self._epoch = 0
+
+    def _shared_generation(self):
+        try:
+            return caches[CACHE_ALIAS].get(self.key, 0)
+        except Exception:
+            # without a shared cache the table only follows the local invalidations
+            return self._generation
+
+    def _publish(self):
+        self._epoch += 1
+        self._data = None
+        try:
+            cache = caches[CACHE_ALIAS]
+            try:
+                cache.incr(self.key)
+            except ValueError:
+                cache.add(self.key, 1, None)
+        except Exception:
+            pass
+
+    def _shared_data(self, generation, data=None):
+        key = 'cdnx_products:{}:{}'.format(self.name, generation)
+        try:
+            if data is None:
+                return caches[CACHE_ALIAS].get(key)
+            caches[CACHE_ALIAS].set(key, data)
+        except Exception:
+            return None
+
+    def get(self, refresh=False):
+        data = self._data
+        now = time.time()
+        if data is not None and not refresh and now < self._checked + self.check_interval:
+            return data
+
+        generation = self._shared_generation()
+        with self._lock:
+            if refresh or self._data is None or self._generation != generation:
+                epoch = self._epoch
+                # after a local invalidation the change may not be committed yet, the shared copy is skipped
+                shared = self.shared and not refresh and self._generation != generation
+                data = shared and self._shared_data(generation) or None
+                if data is None:
+                    data = self.builder()
+                    if shared:
+                        self._shared_data(generation, data)
+                if epoch == self._epoch:
+                    # atomic swap, readers see the old table or the new one
+                    self._data = data
+                    self._generation = generation
+                    self._checked = now
+                return data
+            self._checked = now
+            return self._data
+
+    def invalidate(self):
+        """
+        Forget the table in this process now and tell the other processes once the transaction is committed
+        """
+        self._epoch += 1
+        self._data = None
+        transaction.on_commit(self._publish)
+
+
+class JournalTable(LocalTable):
+    """
+    LocalTable updated incrementally: update() publishes the changed pks in a journal (CDNX_PRODUCTS_CACHE)
+    and every process recomputes only them. invalidate() still rebuilds the whole table.
+    applier: function (data, pks) returning new data with the given pks recomputed, the current data must not be modified
+    journal_timeout: seconds the changes are kept in the journal, a process that missed them rebuilds the whole table
+    """
+
+    def __init__(self, name, builder, applier, journal_timeout=JOURNAL_TIMEOUT, check_interval=LOCAL_TABLE_CHECK_INTERVAL):
+        super(JournalTable, self).__init__(name, self._build, check_interval=check_interval)
+        self.data_builder = builder
+        self.applier = applier
+        self.journal_timeout = journal_timeout
+        self.journal_key = 'cdnx_products:{}:journal'.format(name)
+        self._journal_checked = 0
+
+    def _journal_sequence(self):
+        try:
+            return caches[CACHE_ALIAS].get(self.journal_key, 0)
+        except Exception:
+            return None
+
+    def _build(self):
+        # los cambios publicados durante la construccion se vuelven a aplicar despues
+        return (self._journal_sequence(), self.data_builder())
+
+    def get(self, refresh=False):
+        entry = super(JournalTable, self).get(refresh)
+        now = time.time()
+        if refresh or now < self._journal_checked + self.check_interval:
+            return entry[1]
+        self._journal_checked = now
+
+        sequence = self._journal_sequence()
+        if sequence is None or entry[0] is None or sequence == entry[0]:
+            return entry[1]
+        if sequence < entry[0]:
+            # el diario se ha perdido (cache reiniciada)
+            return super(JournalTable, self).get(refresh=True)[1]
+
+        keys = ['{}:{}'.format(self.journal_key, position) for position in range(entry[0] + 1, sequence + 1)]
+        try:
+            changes = caches[CACHE_ALIAS].get_many(keys)
+        except Exception:
+            changes = {}
+        if len(changes) != len(keys):
+            # cambios caducados o cache no disponible, se reconstruye todo
+            return super(JournalTable, self).get(refresh=True)[1]
+
+        pks = set()
+        for changed in changes.values():
+            pks.update(changed)
+        with self._lock:
+            if self._data is not entry:
+                return (self._data or entry)[1]
+            entry = (sequence, self.applier(entry[1], pks))
+            self._data = entry
+        return entry[1]
+
+    def _publish_changes(self, pks):
+        try:
+            cache = caches[CACHE_ALIAS]
+            try:
+                sequence = cache.incr(self.journal_key)
+            except ValueError:
+                cache.add(self.journal_key, 0, None)
+                sequence = cache.incr(self.journal_key)
+            cache.set('{}:{}'.format(self.journal_key, sequence), pks, self.journal_timeout)
+        except Exception:
+            # sin cache compartida solo se puede reconstruir
+            self._epoch += 1
+            self._data = None
+        self._journal_checked = 0
+
+    def update(self, pks):
+        """
+        Recompute the given pks in every process once the current transaction is committed
+        """
+        pks = list(pks)
+        if pks:
+            transaction.on_commit(lambda: self._publish_changes(pks))
+
+
+class GenerationCache(object):
+    """
+    Results kept in the shared cache and invalidated all at once by moving to a new generation
+    timeout: seconds a result is fresh
+    stale_timeout: seconds after its expiration an old result (expired or from an older generation) can still be served while one process rebuilds it,
+    with 0 an old result is never served: the other processes wait for the rebuild or build it themselves
+    lock_timeout: seconds a rebuild keeps the lock, after them other process may try again
+    lock_wait: seconds a process without any result to serve waits for the one rebuilding it before building it too
+    """
+
+    def __init__(self, name, timeout, stale_timeout, lock_timeout=30, lock_wait=2):
+        self.name = name
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.key = 'cdnx_products:{}:generation'.format(name)
+
+    def _publish(self):
+        try:
+            cache = caches[CACHE_ALIAS]
+            try:
+                cache.incr(self.key)
+            except ValueError:
+                cache.add(self.key, 1, None)
+        except Exception:
+            pass
+
+    def get(self, key, builder):
+        """
+        Result of builder() for the key, a tuple of values (model instances are replaced by their pk)
+        """
+        if not self.timeout:
+            return builder()
+
+        key = 'cdnx_products:{}:{}'.format(self.name, ':'.join([smart_str(getattr(value, 'pk', value)) for value in key]))
+        now = time.time()
+        try:
+            cache = caches[CACHE_ALIAS]
+            generation = cache.get(self.key)
+            if generation is None:
+                cache.add(self.key, 1, None)
+                generation = cache.get(self.key, 1)
+            # entrada: (generacion, caducidad, resultado)
+            entry = cache.get(key)
+        except Exception:
+            return builder()
+
+        if entry is not None and entry[0] == generation and now < entry[1]:
+            return entry[2]
+
+        # solo un proceso reconstruye, el resto sirve el resultado antiguo mientras tanto si stale_timeout lo permite
+        lock = '{}:lock'.format(key)
+        locked = cache.add(lock, 1, self.lock_timeout)
+        if not locked:
+            if entry is not None and self.stale_timeout and now < entry[1] + self.stale_timeout:
+                return entry[2]
+            # sin resultado que se pueda servir (arranque, o stale_timeout=0) se espera al proceso que lo construye
+            deadline = now + self.lock_wait
+            while time.time() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None and entry[0] == generation and time.time() < entry[1]:
+                    return entry[2]
+
+        try:
+            result = builder()
+            cache.set(key, (generation, now + self.timeout, result), self.timeout + self.stale_timeout)
+        finally:
+            if locked:
+                cache.delete(lock)
+        return result
+
+    def invalidate(self):
+        """
+        Move to a new generation once the transaction is committed
+        """
+        transaction.on_commit(self._publish)
@@ -33,3 +33,11 @@ class ProductUniqueQuantityExceeded(Exception):
 
 class ProductUniqueNotProductFinal(Exception):
     pass
+
+
+class ProductPriceMismatch(Exception):
+    pass
+
+
+class ProductUniqueStockUnavailable(IOError):
+    pass
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Exists, OuterRef
+from django.utils.encoding import smart_str
+
+from codenerix_products.caches import JournalTable
+from codenerix_products.models import ProductFinal, ProductFinalAttribute, ProductFeature, ProductImage, ProductFinalImage
+
+
+# width of the price buckets of the facet counts
+FACET_PRICE_BUCKET = getattr(settings, 'CDNX_PRODUCTS_FACET_PRICE_BUCKET', 10)
+# seconds the changes published by a process are kept for the other ones, after them they rebuild the whole index
+FACET_JOURNAL_TIMEOUT = getattr(settings, 'CDNX_PRODUCTS_FACET_JOURNAL_TIMEOUT', 3600)
+
+# facetas con recuento (y seleccion) y claves que solo delimitan el ambito del listado
+FACETS_COUNTED = ('brand', 'subcategory', 'feature', 'attribute', 'price')
+
+
+def price_bucket(price):
+    return int(Decimal(price) // Decimal(FACET_PRICE_BUCKET))
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def bitset(pks):
+    """
+    Bitset (python int) with the bit of each pk set
+    """
+    pks = list(pks)
+    if not pks:
+        return 0
+    data = bytearray(max(pks) // 8 + 1)
+    for pk in pks:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(bytes(data), 'little')
+
+
+def members(bits):
+    """
+    Pks of the bits set in a bitset
+    """
+    pks = []
+    for index, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        if byte:
+            pks += [index * 8 + bit for bit in range(8) if byte >> bit & 1]
+    return pks
+
+
+def collect(product_finals=None):
+    """
+    Facet keys and price of the products final (all of them by default) with 3 queries
+    ('brand', pk), ('family', pk), ('category', pk), ('subcategory', pk), ('feature', pk, value), ('attribute', pk, value), ('price', bucket), ('image',)
+    """
+    queryset = ProductFinal.objects.all()
+    if product_finals is not None:
+        queryset = queryset.filter(pk__in=product_finals)
+
+    products = {}
+    by_product = {}
+    for pk, product, brand, family, category, subcategory, price, image_final, image_product in queryset.annotate(
+        image_final=Exists(ProductFinalImage.objects.filter(product_final=OuterRef('pk'), principal=True)),
+        image_product=Exists(ProductImage.objects.filter(product=OuterRef('product'), principal=True)),
+    ).values_list('pk', 'product_id', 'product__brand_id', 'product__family_id', 'product__category_id', 'product__subcategory_id', 'price', 'image_final', 'image_product'):
+        keys = [('family', family), ('category', category), ('price', price_bucket(price))]
+        if brand:
+            keys.append(('brand', brand))
+        if subcategory:
+            keys.append(('subcategory', subcategory))
+        if image_final or image_product:
+            keys.append(('image', ))
+        products[pk] = (keys, price)
+        by_product.setdefault(product, []).append(pk)
+
+    for pk, attribute, value in ProductFinalAttribute.objects.filter(product__in=queryset).values_list('product_id', 'attribute_id', 'value'):
+        if attribute:
+            products[pk][0].append(('attribute', attribute, smart_str(value)))
+
+    for product, feature, value in ProductFeature.objects.filter(product__products_final__in=queryset).values_list('product_id', 'feature_id', 'value').distinct():
+        for pk in by_product.get(product, []):
+            products[pk][0].append(('feature', feature, smart_str(value)))
+
+    return products
+
+
+class FacetIndex(JournalTable):
+    """
+    Bitsets of the products final of each facet value, kept in memory by every process
+    The changes are applied incrementally: update() publishes the changed products final in the journal of the table (CDNX_PRODUCTS_CACHE)
+    and every process recomputes only their bits. invalidate() rebuilds the whole index.
+    """
+
+    def __init__(self, name='facets'):
+        super(FacetIndex, self).__init__(name, self.build, self.apply, journal_timeout=FACET_JOURNAL_TIMEOUT)
+
+    def build(self):
+        products = collect()
+        members = {}
+        for pk, (keys, price) in products.items():
+            for key in keys:
+                members.setdefault(key, []).append(pk)
+        return {
+            'all': bitset(products),
+            'bits': {key: bitset(pks) for key, pks in members.items()},
+            'products': products,
+        }
+
+    def apply(self, data, product_finals):
+        """
+        New index with the bits of the given products final recomputed, the current one is not modified
+        """
+        products = collect(product_finals)
+        bits = dict(data['bits'])
+        everything = data['all']
+        known = dict(data['products'])
+        for pk in product_finals:
+            mask = ~(1 << pk)
+            everything &= mask
+            for key in known.pop(pk, ((), None))[0]:
+                bits[key] &= mask
+        for pk, (keys, price) in products.items():
+            bit = 1 << pk
+            everything |= bit
+            for key in keys:
+                bits[key] = bits.get(key, 0) | bit
+            known[pk] = (keys, price)
+        return {'all': everything, 'bits': bits, 'products': known}
+
+    def update(self, product_finals):
+        """
+        Recompute the bits of the given products final (pks or queryset) once the current transaction is committed
+        """
+        if isinstance(product_finals, models.QuerySet):
+            product_finals = product_finals.order_by().values_list('pk', flat=True).distinct()
+        super(FacetIndex, self).update(product_finals)
+
+
+FACETS = FacetIndex()
+
+
+def selection_groups(selection):
+    """
+    {group: [keys]} of a selection {'brand': [pks], 'subcategory': [pks], 'feature': {pk: [values]}, 'attribute': {pk: [values]}}
+    """
+    groups = {}
+    for facet in ('brand', 'subcategory'):
+        if selection.get(facet):
+            groups[(facet, )] = [(facet, int(pk)) for pk in selection[facet]]
+    for facet in ('feature', 'attribute'):
+        for pk, values in (selection.get(facet) or {}).items():
+            if pk and values:
+                groups[(facet, int(pk))] = [(facet, int(pk), smart_str(value)) for value in values]
+    return groups
+
+
+def price_mask(data, price_from=None, price_to=None):
+    """
+    Bitset of the products final with a price in the range (None if there is no range)
+    """
+    if price_from is None and price_to is None:
+        return None
+    low = Decimal('-Infinity') if price_from is None else Decimal(str(price_from))
+    high = Decimal('Infinity') if price_to is None else Decimal(str(price_to))
+    mask = 0
+    for key, bits in data['bits'].items():
+        if key[0] == 'price':
+            start = Decimal(key[1] * FACET_PRICE_BUCKET)
+            if low <= start and start + FACET_PRICE_BUCKET <= high:
+                mask |= bits
+            elif start <= high and low < start + FACET_PRICE_BUCKET:
+                # tramo en el borde del rango, se comprueba producto a producto
+                mask |= bitset([pk for pk in members(bits) if low <= data['products'][pk][1] <= high])
+    return mask
+
+
+def get_masks(data, scope=(), selection=None, price_from=None, price_to=None, product_finals=None):
+    """
+    Base bitset (scope keys ANDed, products final and price range) and the OR bitset of each selected group
+    """
+    base = data['all']
+    for key in scope:
+        base &= data['bits'].get(key, 0)
+    if product_finals is not None:
+        base &= bitset(product_finals)
+
+    masks = {}
+    for group, keys in selection_groups(selection or {}).items():
+        mask = 0
+        for key in keys:
+            mask |= data['bits'].get(key, 0)
+        masks[group] = mask
+    prices = price_mask(data, price_from, price_to)
+    if prices is not None:
+        masks[('price', )] = prices
+    return base, masks
+
+
+def get_counts(scope=(), selection=None, price_from=None, price_to=None, product_finals=None):
+    """
+    Number of products final of each facet value with the selection of the other facets applied (the own one is ignored so its values can be added)
+    {'brand': {pk: count}, 'subcategory': {pk: count}, 'feature': {pk: {value: count}}, 'attribute': {pk: {value: count}}, 'price': {bucket start: count}}
+    """
+    data = FACETS.get()
+    base, masks = get_masks(data, scope, selection, price_from, price_to, product_finals)
+
+    others = {}
+    counts = {'brand': {}, 'subcategory': {}, 'feature': {}, 'attribute': {}, 'price': {}}
+    for key, bits in data['bits'].items():
+        if key[0] not in FACETS_COUNTED:
+            continue
+        group = key[:2] if key[0] in ('feature', 'attribute') else key[:1]
+        if group not in others:
+            mask = base
+            for selected, selected_mask in masks.items():
+                if selected != group:
+                    mask &= selected_mask
+            others[group] = mask
+        count = popcount(others[group] & bits)
+        if count:
+            if key[0] in ('feature', 'attribute'):
+                counts[key[0]].setdefault(key[1], {})[key[2]] = count
+            elif key[0] == 'price':
+                counts['price'][key[1] * FACET_PRICE_BUCKET] = count
+            else:
+                counts[key[0]][key[1]] = count
+    return counts
@@ -35,6 +35,7 @@ from .models import ProductRelationSold, ProductImage, ProductDocument, ProductF
 from .models import GroupValueFeature, GroupValueAttribute, GroupValueFeatureSpecial, OptionValueFeature, OptionValueAttribute, OptionValueFeatureSpecial
 from .models import MODELS, MODELS_SLUG, MODELS_BRANDS, MODELS_PRODUCTS, MODELS_PRODUCTS_FINAL, MODELS_SLIDERS, TYPE_VALUES, TYPE_VALUE_LIST, TYPE_VALUE_BOOLEAN, TYPE_VALUE_FREE
 from .models import ProductFinalOption
+from .models import get_text_model
 
 
 class TypeTaxForm(GenModelForm):
@@ -1109,232 +1110,148 @@ class ProductFinalOptionFormWithoutProduct(GenModelForm):
         return g
 
 
-# MODELS
-query = ""
-forms_dyn = []
-for info in MODELS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        exec("from codenerix_products.models import {}Text{}\n".format(model, lang_code))
+# formularios de texto de cada idioma
+# grupos: [(titulo, columnas, [(campo, columnas, se copia al resto de idiomas desde el primero)])]
+TEXT_FORM_GROUPS = [
+    (_('Details'), 12, [('description', 12, True)]),
+]
+
+TEXT_FORM_GROUPS_BRANDS = [
+    (_('Details'), 12, [
+        ('name', 4, True),
+        ('slug', 4, True),
+        ('public', 4, False),
+        ('description_short', 6, True),
+        ('description_long', 6, True),
+    ]),
+    (_('SEO'), 12, [
+        ('meta_title', 4, True),
+        ('meta_description', 4, True),
+        ('meta_keywords', 4, True),
+    ]),
+]
+
+TEXT_FORM_GROUPS_PRODUCTS = [
+    (_('Details'), 12, [
+        ('name', 4, True),
+        ('slug', 4, True),
+        ('public', 4, False),
+        ('description_short', 6, True),
+        ('description_long', 6, True),
+    ]),
+    (_('SEO'), 12, [
+        ('meta_title', 4, True),
+        ('meta_description', 4, True),
+        ('meta_keywords', 4, True),
+        ('tags', 4, True),
+    ]),
+]
+
+TEXT_FORM_GROUPS_PRODUCTS_FINAL = [
+    (_('Details'), 12, [
+        ('name', 4, True),
+        ('slug', 4, True),
+        ('public', 4, False),
+        ('description_short', 6, True),
+        ('description_long', 6, True),
+        ('description_sample', 12, True),
+    ]),
+    (_('SEO'), 12, [
+        ('meta_title', 4, True),
+        ('meta_description', 4, True),
+        ('meta_keywords', 4, True),
+        ('tags', 4, True),
+    ]),
+]
+
+TEXT_FORM_GROUPS_SLIDERS = [
+    (_('Details'), 12, [
+        ('title', 12, True),
+        ('description', 12, True),
+    ]),
+]
+
+TEXT_FORM_GROUPS_SLUG = [
+    (_('Details'), 12, [
+        ('name', 12, True),
+        ('slug', 12, True),
+        ('description', 12, True),
+    ]),
+    (_('SEO'), 12, [
+        ('meta_title', 4, True),
+        ('meta_description', 4, True),
+        ('meta_keywords', 4, True),
+    ]),
+]
+
+# formularios de texto: {(nombre del modelo, idioma): formulario}
+TEXT_FORMS = {}
+
+
+def text_form_groups(model_source, lang_code, groups, event='ng-blur', label=None):
+    """
+    __groups__ of a text form, in the first language the fields refresh the same field of the rest of languages
+    """
+    first = lang_code == settings.LANGUAGES_DATABASES[0]
+    languages = "'{}'".format("','".join(settings.LANGUAGES_DATABASES))
+    result = []
+    for title, columns, fields in groups:
+        group = [title, columns]
+        for field, size, refresh in fields:
+            info = [field, size]
+            if label is not None or (first and refresh):
+                info += [None, None, None, None, label]
+            if first and refresh:
+                info.append(["{}=refresh_lang_field('{}', '{}TextForm', [{}])".format(event, field, model_source, languages)])
+            group.append(info)
+        result.append(tuple(group))
+    return result
+
+
+def make_text_form(model_source, model_relate, lang_code, groups, event='ng-blur', label=None):
+    """
+    Build the form {model_source}TextForm{lang_code} of the text model of model_relate in the language
+    The class is published in this module with its usual name and registered in TEXT_FORMS
+    """
+    name = '{}TextForm{}'.format(model_source, lang_code)
 
+    def __groups__(self):
+        return text_form_groups(model_source, lang_code, groups, event, label)
+
+    attrs = {
+        '__module__': __name__,
+        '__qualname__': name,
+        'Meta': type('Meta', (), {'model': get_text_model(model_relate, lang_code), 'exclude': []}),
+        '__groups__': __groups__,
+    }
+    form = type(name, (GenModelForm, ), attrs)
+    globals()[name] = form
+    TEXT_FORMS[(model_relate, lang_code.upper())] = form
+    return form
+
+
+def get_text_form(model, lang_code):
+    """
+    Form of the text model of a model (class or name) in the language
+    """
+    if not isinstance(model, str):
+        model = model.__name__
+    return TEXT_FORMS[(model, lang_code.upper())]
+
+
+for lang_code in settings.LANGUAGES_DATABASES:
+    for field, model in MODELS:
         if model in ['ProductImage', 'ProductFinalImage']:
             label = _('Title and alternative text of the image')
         else:
             label = _('Description')
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,"""
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['description', 12, None, None, None, None, '{label}', ["ng-change=refresh_lang_field('description', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['description', 12, None, None, None, None, '{label}'],
-            )]\n"""
-        exec(query.format(model=model, lang=lang_code, label=label, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
-
-
-# MODELS BRANDS
-for info in MODELS_BRANDS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        exec(query)
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,
-                """
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['name', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('name', '{model}TextForm', [{languages}])"]],
-                ['slug', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('slug', '{model}TextForm', [{languages}])"]],
-                ['public', 4],
-                ['description_short', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_short', '{model}TextForm', [{languages}])"]],
-                ['description_long', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_long', '{model}TextForm', [{languages}])"]],
-            ), (_('SEO'),12,
-                ['meta_title', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_title', '{model}TextForm', [{languages}])"]],
-                ['meta_description', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_description', '{model}TextForm', [{languages}])"]],
-                ['meta_keywords', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_keywords', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['name', 4],
-                ['slug', 4],
-                ['public', 4],
-                ['description_short', 6],
-                ['description_long', 6],
-            ), (_('SEO'),12,
-                ['meta_title', 4],
-                ['meta_description', 4],
-                ['meta_keywords', 4],
-            )]\n"""
-        exec(query.format(model=model, lang=lang_code, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
-
-
-# MODELS PRODUCTS
-for info in MODELS_PRODUCTS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        exec(query)
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,
-                """
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['name', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('name', '{model}TextForm', [{languages}])"]],
-                ['slug', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('slug', '{model}TextForm', [{languages}])"]],
-                ['public', 4],
-                ['description_short', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_short', '{model}TextForm', [{languages}])"]],
-                ['description_long', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_long', '{model}TextForm', [{languages}])"]],
-            ), (_('SEO'),12,
-                ['meta_title', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_title', '{model}TextForm', [{languages}])"]],
-                ['meta_description', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_description', '{model}TextForm', [{languages}])"]],
-                ['meta_keywords', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_keywords', '{model}TextForm', [{languages}])"]],
-                ['tags', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('tags', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['name', 4],
-                ['slug', 4],
-                ['public', 4],
-                ['description_short', 6],
-                ['description_long', 6],
-            ), (_('SEO'),12,
-                ['meta_title', 4],
-                ['meta_description', 4],
-                ['meta_keywords', 4],
-                ['tags', 4],
-            )]\n"""
-        exec(query.format(model=model, lang=lang_code, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
-
-
-# MODELS PRODUCTS
-for info in MODELS_PRODUCTS_FINAL:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        exec(query)
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,
-                """
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['name', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('name', '{model}TextForm', [{languages}])"]],
-                ['slug', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('slug', '{model}TextForm', [{languages}])"]],
-                ['public', 4],
-                ['description_short', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_short', '{model}TextForm', [{languages}])"]],
-                ['description_long', 6, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_long', '{model}TextForm', [{languages}])"]],
-                ['description_sample', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('description_sample', '{model}TextForm', [{languages}])"]],
-            ), (_('SEO'),12,
-                ['meta_title', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_title', '{model}TextForm', [{languages}])"]],
-                ['meta_description', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_description', '{model}TextForm', [{languages}])"]],
-                ['meta_keywords', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_keywords', '{model}TextForm', [{languages}])"]],
-                ['tags', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_keywords', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['name', 4],
-                ['slug', 4],
-                ['public', 4],
-                ['description_short', 6],
-                ['description_long', 6],
-                ['description_sample', 12],
-            ), (_('SEO'),12,
-                ['meta_title', 4],
-                ['meta_description', 4],
-                ['meta_keywords', 4],
-                ['tags', 4],
-            )]\n"""
-        exec(query.format(model=model, lang=lang_code, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
-
-
-# MODELS SLIDERS
-query = ""
-forms_dyn = []
-for info in MODELS_SLIDERS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        exec(query)
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,"""
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['title', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('title', '{model}TextForm', [{languages}])"]],
-                ['description', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('description', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['title', 12],
-                ['description', 12],
-            )]\n"""
-        exec(query.format(model=model, lang=lang_code, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
-
-# MODELS SLUG
-query = ""
-forms_dyn = []
-for info in MODELS_SLUG:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        exec(query)
-        query = """
-class {model}TextForm{lang}(GenModelForm):\n
-    class Meta:\n
-        model={model}Text{lang}\n
-        exclude = []\n
-    def __groups__(self):\n
-        return [(_('Details'),12,"""
-        if lang_code == settings.LANGUAGES_DATABASES[0]:
-            query += """
-                ['name', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('name', '{model}TextForm', [{languages}])"]],
-                ['slug', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('slug', '{model}TextForm', [{languages}])"]],
-                ['description', 12, None, None, None, None, None, ["ng-blur=refresh_lang_field('description', '{model}TextForm', [{languages}])"]],
-            ), (_('SEO'),12,
-                ['meta_title', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_title', '{model}TextForm', [{languages}])"]],
-                ['meta_description', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_description', '{model}TextForm', [{languages}])"]],
-                ['meta_keywords', 4, None, None, None, None, None, ["ng-blur=refresh_lang_field('meta_keywords', '{model}TextForm', [{languages}])"]],
-            )]\n"""
-        else:
-            query += """
-                ['name', 12],
-                ['slug', 12],
-                ['description', 12],
-            ), (_('SEO'),12,
-                ['meta_title', 4],
-                ['meta_description', 4],
-                ['meta_keywords', 4],
-            )]\n"""
-
-        exec(query.format(model=model, lang=lang_code, languages="'{}'".format("','".join(settings.LANGUAGES_DATABASES))))
+        make_text_form(model, model, lang_code, TEXT_FORM_GROUPS, event='ng-change', label=label)
+    for groups, infos in (
+        (TEXT_FORM_GROUPS_BRANDS, MODELS_BRANDS),
+        (TEXT_FORM_GROUPS_PRODUCTS, MODELS_PRODUCTS),
+        (TEXT_FORM_GROUPS_PRODUCTS_FINAL, MODELS_PRODUCTS_FINAL),
+        (TEXT_FORM_GROUPS_SLIDERS, MODELS_SLIDERS),
+        (TEXT_FORM_GROUPS_SLUG, MODELS_SLUG),
+    ):
+        for info in infos:
+            make_text_form(info[1], info[-1], lang_code, groups)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from codenerix_products.models import ProductFinal, RECALCULATE_BATCH_SIZE, CURRENCY_DECIMAL_PLACES
+from codenerix_products.pricing import numpy, calculate_prices_vectorized, to_cents
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Compare the stored prices of the products final with freshly calculated ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECALCULATE_BATCH_SIZE, help="Products final compared on each round")
+        parser.add_argument('--verify', action='store_true', default=False, help="Check the vectorised kernel against the Decimal reference implementation")
+        parser.add_argument('--fix', action='store_true', default=False, help="Flag the products final with wrong prices as stale (see reprice_products)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # precios calculados en centimos {pk: (price, price_base)}
+        calculated = {}
+        if numpy is not None:
+            result = calculate_prices_vectorized(verify=options['verify'], batch_size=batch_size)
+            scale = 10 ** CURRENCY_DECIMAL_PLACES
+            prices = numpy.rint(result['price_total'] * scale).astype(numpy.int64).tolist()
+            prices_base = numpy.rint(result['price_base'] * scale).astype(numpy.int64).tolist()
+            calculated = dict(zip(result['pk'].tolist(), zip(prices, prices_base)))
+        else:
+            # sin numpy se usa la implementacion de referencia
+            if options['verify']:
+                self.stdout.write("numpy is not installed, the vectorised kernel can not be verified")
+            pks = list(ProductFinal.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(pks), batch_size):
+                for pk, info in ProductFinal.objects.calculate_prices(pks[start:start + batch_size]).items():
+                    calculated[pk] = (to_cents(info['price_total']), to_cents(info['price_base']))
+
+        wrong = []
+        for pk, price, price_base in ProductFinal.objects.values_list('pk', 'price', 'price_base').iterator():
+            if pk in calculated and (to_cents(price), to_cents(price_base)) != calculated[pk]:
+                wrong.append(pk)
+
+        self.stdout.write("{} products final checked, {} with wrong prices".format(len(calculated), len(wrong)))
+        if wrong:
+            self.stdout.write("Wrong: {}".format(", ".join([str(pk) for pk in wrong[:50]])))
+            if options['fix']:
+                for start in range(0, len(wrong), batch_size):
+                    ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(pk__in=wrong[start:start + batch_size]))
+                self.stdout.write("Flagged as stale, run reprice_products to fix them")
@@ -6,7 +6,7 @@ from django.conf import settings
 from django.db import connection, transaction
 
 from codenerix_products.models import (
-    MODELS,
+    get_text_model,
     GroupValueAttribute,
     Attribute,
     OptionValueAttribute,
@@ -18,15 +18,6 @@ from codenerix_products.models import (
     OptionValueFeatureSpecial,
 )
 
-for info in MODELS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        cad = "from codenerix_products.models import {}Text{}\n".format(
-            model, lang_code
-        )
-        exec(cad)
-
 
 class Command(BaseCommand, Debugger):
     def migrate(self, model_group, table_source, model_option):
@@ -68,9 +59,7 @@ class Command(BaseCommand, Debugger):
                 values = []
 
                 for lang_code in settings.LANGUAGES_DATABASES:
-                    model_lang = globals()[
-                        "{}Text{}".format(model_str, lang_code)
-                    ]
+                    model_lang = get_text_model(model_str, lang_code)
                     text_lang.append(
                         (lang_code, model_lang._meta.db_table, model_lang)
                     )
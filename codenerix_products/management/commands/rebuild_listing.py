@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from codenerix_products.models import ProductFinal, ProductFinalListing, RECALCULATE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Rebuild the storefront listing (ProductFinalListing) from the products final"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECALCULATE_BATCH_SIZE, help="Products final rebuilt on each round")
+        parser.add_argument('pks', nargs='*', type=int, help="Products final to rebuild (all of them by default)")
+
+    def handle(self, *args, **options):
+        if options['pks']:
+            product_finals = options['pks']
+        else:
+            # las filas de productos finales que ya no existen se borran por cascada
+            product_finals = ProductFinal.objects.all()
+        written = ProductFinalListing.objects.refresh(product_finals, batch_size=options['batch_size'])
+        self.stdout.write("{} listing rows written".format(written))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from codenerix_products.models import ProductFinalStock
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Recalculate the stock projection of the products final (ProductFinalStock) from their products unique"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pks', nargs='*', type=int, help="Products final to recalculate (all of them by default)")
+
+    def handle(self, *args, **options):
+        written = ProductFinalStock.objects.rebuild(options['pks'] or None)
+        self.stdout.write("{} products final recalculated".format(written))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from codenerix_products.models import ProductFinal, RECALCULATE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Recalculate the stored prices of the products final flagged as stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECALCULATE_BATCH_SIZE, help="Products final repriced on each round")
+        parser.add_argument('--all', action='store_true', default=False, help="Reprice every product final, not only the stale ones")
+        parser.add_argument('--loop', action='store_true', default=False, help="Keep running and drain the stale products final as they appear")
+        parser.add_argument('--sleep', type=float, default=10.0, help="Seconds to wait between rounds when looping")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['all']:
+            updated = ProductFinal.objects.recalculate_many(ProductFinal.objects.all(), batch_size=batch_size)
+            self.stdout.write("Repriced {} products final".format(updated))
+            return
+
+        while True:
+            updated = self.drain(batch_size)
+            if updated:
+                self.stdout.write("Repriced {} products final".format(updated))
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+    def drain(self, batch_size):
+        updated = 0
+        while True:
+            pks = list(ProductFinal.objects.filter(price_stale=True).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            ProductFinal.objects.recalculate_many(ProductFinal.objects.filter(pk__in=pks), batch_size=batch_size)
+            updated += len(pks)
+        return updated
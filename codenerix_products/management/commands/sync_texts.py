@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from codenerix_products.models import RECALCULATE_BATCH_SIZE, get_text_model
+from codenerix_products.texts import TEXT_ENTITIES, rebuild_texts, create_texts_indexes
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Rebuild the texts column of the entities from the tables of each language (after loading fixtures or adding a language)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECALCULATE_BATCH_SIZE, help="Entities rebuilt on each round")
+        parser.add_argument('--indexes', action='store_true', default=False, help="Create the missing expression indexes over the texts column too")
+        parser.add_argument('models', nargs='*', help="Models to rebuild (all of them by default)")
+
+    def handle(self, *args, **options):
+        for model_name, model_source in TEXT_ENTITIES:
+            if options['models'] and model_name not in options['models']:
+                continue
+            model = apps.get_model('codenerix_products', model_name)
+            text_models = [get_text_model(model, lang_code) for lang_code in settings.LANGUAGES_DATABASES]
+            written = rebuild_texts(model, text_models, batch_size=options['batch_size'])
+            self.stdout.write("{}: {} rows written".format(model_name, written))
+
+        if options['indexes']:
+            with connection.schema_editor() as schema_editor:
+                created = create_texts_indexes(apps, schema_editor, missing=True)
+            self.stdout.write("{} indexes created".format(len(created)))
@@ -0,0 +1,29 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from codenerix_products.autocomplete import AUTOCOMPLETE_INDEXES, AUTOCOMPLETE_CANDIDATES
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Time the autocomplete indexes of the selectors over the current catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=50, help="Times each search is repeated")
+        parser.add_argument('searches', nargs='+', help="Searches to time")
+
+    def handle(self, *args, **options):
+        for index in AUTOCOMPLETE_INDEXES:
+            start = time.perf_counter()
+            tokens, postings, documents = index.table.get(refresh=True)
+            self.stdout.write("{}: {} pks, {} words, built in {:.0f} ms".format(index.name, len(documents), len(tokens), (time.perf_counter() - start) * 1000))
+            for search in options['searches']:
+                start = time.perf_counter()
+                for position in range(options['rounds']):
+                    # los candidatos que filter() comprueba en su primera consulta
+                    found = list(islice(index.candidates(search) or [], AUTOCOMPLETE_CANDIDATES))
+                elapsed = (time.perf_counter() - start) * 1000 / options['rounds']
+                self.stdout.write("    '{}': {} candidates in {:.2f} ms".format(search, len(found), elapsed))
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+from codenerix_products.models import TEXT_MODELS
+from codenerix_products.forms import TEXT_FORMS
+
+
+# modulos cuyo tiempo de importacion se mide
+IMPORT_MODULES = ('codenerix_products.models', 'codenerix_products.forms')
+
+
+class Command(BaseCommand):
+
+    # Show this when the user types help
+    help = "Time the import of the models and forms of codenerix_products (text models and forms included) in new processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=5, help="Processes started")
+
+    def handle(self, *args, **options):
+        self.stdout.write("{} text models, {} text forms".format(len(TEXT_MODELS), len(TEXT_FORMS)))
+        # los modulos ya estan importados en este proceso, cada ronda los importa en un interprete nuevo
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([path for path in sys.path if path]))
+        code = "import django; django.setup(); {}".format("; ".join(["import {}".format(module) for module in IMPORT_MODULES]))
+        times = dict((module, []) for module in IMPORT_MODULES)
+        for position in range(options['rounds']):
+            output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True, check=True).stderr
+            # import time: self [us] | cumulative | imported package
+            for line in output.splitlines():
+                columns = line.split('|')
+                if len(columns) == 3 and columns[2].strip() in times:
+                    times[columns[2].strip()].append(int(columns[1]) / 1000.0)
+        for module in IMPORT_MODULES:
+            if times[module]:
+                self.stdout.write("{}: {:.0f} ms (min {:.0f} ms) over {} rounds".format(module, sum(times[module]) / len(times[module]), min(times[module]), len(times[module])))
+            else:
+                self.stdout.write("{}: not imported".format(module))
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0013_alter_attribute_public_alter_brand_outstanding_and_more'),
+    ]
+
+    operations = [
+        # existing rows start as stale so the first run of reprice_products validates their stored prices
+        migrations.AddField(
+            model_name='productfinal',
+            name='price_stale',
+            field=models.BooleanField(blank=True, db_index=True, default=True, editable=False, verbose_name='Price stale'),
+        ),
+        migrations.AlterField(
+            model_name='productfinal',
+            name='price_stale',
+            field=models.BooleanField(blank=True, db_index=True, default=False, editable=False, verbose_name='Price stale'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0014_productfinal_price_stale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFinalListing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('lang', models.CharField(db_index=True, max_length=10, verbose_name='Language')),
+                ('name', models.CharField(blank=True, max_length=500, null=True, verbose_name='Name')),
+                ('slug', models.CharField(blank=True, db_index=True, max_length=250, null=True, verbose_name='Slug')),
+                ('code', models.CharField(blank=True, max_length=250, null=True, verbose_name='Code')),
+                ('public', models.BooleanField(blank=True, default=True, verbose_name='Public')),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Price')),
+                ('offer', models.BooleanField(blank=True, default=False, verbose_name='Offer')),
+                ('outstanding', models.BooleanField(blank=True, default=False, verbose_name='Outstanding')),
+                ('most_sold', models.BooleanField(blank=True, default=False, verbose_name='Most sold')),
+                ('sample', models.BooleanField(blank=True, default=False, verbose_name='Sample')),
+                ('reviews_value', models.FloatField(default=0, verbose_name='Reviews')),
+                ('reviews_count', models.IntegerField(default=0, verbose_name='Reviews count')),
+                ('image', models.CharField(blank=True, max_length=200, null=True, verbose_name='Image')),
+                ('product_created', models.DateTimeField(db_index=True, verbose_name='Created')),
+                ('with_stock', models.BooleanField(blank=True, default=True, verbose_name='With stock')),
+                ('family_slug', models.CharField(blank=True, db_index=True, max_length=250, null=True, verbose_name='Family')),
+                ('category_slug', models.CharField(blank=True, db_index=True, max_length=250, null=True, verbose_name='Category')),
+                ('subcategory_slug', models.CharField(blank=True, db_index=True, max_length=250, null=True, verbose_name='Subcategory')),
+                ('brand_slug', models.CharField(blank=True, db_index=True, max_length=250, null=True, verbose_name='Brand')),
+                ('facets', models.JSONField(blank=True, default=dict, verbose_name='Facets')),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='codenerix_products.brand', verbose_name='Brand')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='codenerix_products.category', verbose_name='Category')),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='codenerix_products.family', verbose_name='Family')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='codenerix_products.product', verbose_name='Product')),
+                ('product_final', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listings', to='codenerix_products.productfinal', verbose_name='Product final')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='codenerix_products.subcategory', verbose_name='Subcategory')),
+            ],
+            options={
+                'default_permissions': ('add', 'change', 'delete', 'view', 'list'),
+                'abstract': False,
+                'unique_together': {('product_final', 'lang')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+SEARCH_INDEX = 'products_listing_search'
+
+
+def search_index(schema_editor):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    # same expression used by codenerix_products.search.PostgresSearchBackend
+    return GinIndex(SearchVector('search_text', config='simple'), name=SEARCH_INDEX)
+
+
+def add_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('codenerix_products', 'ProductFinalListing'), search_index(schema_editor))
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('codenerix_products', 'ProductFinalListing'), search_index(schema_editor))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0015_productfinallisting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productfinallisting',
+            name='search_text',
+            field=models.TextField(blank=True, null=True, verbose_name='Search text'),
+        ),
+        # only PostgreSQL has GIN indexes, the other databases use the in-memory index of PythonSearchBackend
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
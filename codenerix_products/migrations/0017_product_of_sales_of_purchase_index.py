@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0016_productfinallisting_search_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='of_sales',
+            field=models.BooleanField(blank=True, db_index=True, default=True, verbose_name='Sales'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='of_purchase',
+            field=models.BooleanField(blank=True, db_index=True, default=True, verbose_name='Purchase'),
+        ),
+    ]
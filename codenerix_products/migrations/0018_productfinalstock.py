@@ -0,0 +1,58 @@
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def populate(apps, schema_editor):
+    ProductFinal = apps.get_model('codenerix_products', 'ProductFinal')
+    ProductUnique = apps.get_model('codenerix_products', 'ProductUnique')
+    ProductFinalStock = apps.get_model('codenerix_products', 'ProductFinalStock')
+    totals = {
+        info['product_final_id']: info
+        for info in ProductUnique.objects.values('product_final_id').annotate(
+            original=Sum('stock_original'),
+            real=Sum('stock_real'),
+            locked=Sum('stock_locked'),
+        ).order_by()
+    }
+    rows = []
+    for pk in ProductFinal.objects.values_list('pk', flat=True).iterator():
+        info = totals.get(pk, {})
+        real = info.get('real') or 0
+        locked = info.get('locked') or 0
+        rows.append(ProductFinalStock(
+            product_final_id=pk,
+            stock_original=info.get('original') or 0,
+            stock_real=real,
+            stock_locked=locked,
+            stock_available=real - locked,
+        ))
+    ProductFinalStock.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0017_product_of_sales_of_purchase_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFinalStock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('stock_original', models.FloatField(default=0, editable=False, verbose_name='Stock original')),
+                ('stock_real', models.FloatField(default=0, editable=False, verbose_name='Stock real')),
+                ('stock_locked', models.FloatField(default=0, editable=False, verbose_name='Stock locked')),
+                ('stock_available', models.FloatField(db_index=True, default=0, editable=False, verbose_name='Stock available')),
+                ('product_final', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='codenerix_products.productfinal', verbose_name='Product final')),
+            ],
+            options={
+                'default_permissions': ('add', 'change', 'delete', 'view', 'list'),
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0018_productfinalstock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productunique',
+            index=models.Index(fields=['product_final', 'caducity'], name='products_unique_fefo'),
+        ),
+        migrations.AddIndex(
+            model_name='productunique',
+            index=models.Index(condition=models.Q(stock_real__gt=0), fields=['caducity'], name='products_unique_caducity'),
+        ),
+    ]
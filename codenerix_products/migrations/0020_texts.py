@@ -0,0 +1,191 @@
+from django.db import migrations, models
+from django.db.models.fields.json import KeyTransform
+
+
+# copia fija de texts.py a la fecha de esta migracion: los cambios posteriores del codigo o de los ajustes no la alteran
+# idiomas de los modelos de texto del historial de migraciones (0001_initial)
+LANGUAGES = ['EN', 'ES']
+# (modelo, prefijo de sus modelos de texto)
+TEXT_ENTITIES = [
+    ('Family', 'Family'),
+    ('Category', 'Category'),
+    ('Subcategory', 'Subcategory'),
+    ('ProductFinalOption', 'ProductFinalOption'),
+    ('Feature', 'Feature'),
+    ('Attribute', 'Attribute'),
+    ('FeatureSpecial', 'FeatureSpecial'),
+    ('ProductImage', 'ProductImage'),
+    ('ProductFinalImage', 'ProductFinalImage'),
+    ('ProductDocument', 'ProductDocument'),
+    ('OptionValueFeature', 'OptionValueFeature'),
+    ('OptionValueAttribute', 'OptionValueAttribute'),
+    ('OptionValueFeatureSpecial', 'OptionValueFeatureSpecial'),
+    ('Product', 'ProductText'),
+    ('Brand', 'Brand'),
+    ('ProductFinal', 'ProductFinal'),
+    ('FlagshipProduct', 'FlagshipProduct'),
+]
+# (modelo, nombre del indice) de los indices de expresion sobre el slug y el nombre de cada idioma
+TEXTS_INDEXES = [
+    (model_name, '{}_{}_{}'.format(prefix, lang.lower(), key), lang.lower(), key)
+    for model_name, prefix in [
+        ('Family', 'prod_family'),
+        ('Category', 'prod_category'),
+        ('Subcategory', 'prod_subcat'),
+        ('ProductFinalOption', 'prod_pfoption'),
+        ('Brand', 'prod_brand'),
+        ('Product', 'prod_product'),
+        ('ProductFinal', 'prod_pfinal'),
+    ]
+    for lang in LANGUAGES
+    for key in ('slug', 'name')
+]
+TEXTS_INDEXES_VENDORS = ('postgresql', 'sqlite')
+TEXTS_VALUE_TYPES = (str, int, float, bool, type(None))
+BATCH_SIZE = 1000
+
+
+def get_text_field(text_model):
+    for field in text_model._meta.local_fields:
+        if field.one_to_one:
+            return field
+
+
+def get_text_values(text):
+    values = {}
+    for field in text._meta.concrete_fields:
+        value = getattr(text, field.attname)
+        if isinstance(value, TEXTS_VALUE_TYPES):
+            values[field.attname] = value
+    return values
+
+
+def populate(apps, schema_editor):
+    for model_name, model_source in TEXT_ENTITIES:
+        model = apps.get_model('codenerix_products', model_name)
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        for position in range(0, len(pks), BATCH_SIZE):
+            batch = pks[position:position + BATCH_SIZE]
+            texts = {pk: {} for pk in batch}
+            for lang in LANGUAGES:
+                text_model = apps.get_model('codenerix_products', '{}Text{}'.format(model_source, lang))
+                field = get_text_field(text_model)
+                for text in text_model.objects.filter(**{'{}__in'.format(field.attname): batch}).iterator():
+                    texts[getattr(text, field.attname)][field.remote_field.related_name] = get_text_values(text)
+            model.objects.bulk_update([model(pk=pk, texts=value) for pk, value in texts.items()], ['texts'])
+
+
+def get_indexes(apps):
+    for model_name, name, lang, key in TEXTS_INDEXES:
+        index = models.Index(KeyTransform(key, KeyTransform(lang, 'texts')), name=name)
+        yield apps.get_model('codenerix_products', model_name), index
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in TEXTS_INDEXES_VENDORS:
+        for model, index in get_indexes(apps):
+            schema_editor.add_index(model, index)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in TEXTS_INDEXES_VENDORS:
+        for model, index in get_indexes(apps):
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_products', '0019_productunique_caducity_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attribute',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='family',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='featurespecial',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='flagshipproduct',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='optionvalueattribute',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='optionvaluefeature',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='optionvaluefeaturespecial',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='productdocument',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='productfinal',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='productfinalimage',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='productfinaloption',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='texts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Texts'),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+        # indices de expresion del slug y el nombre de cada idioma (solo en las bases de datos que los admiten, ver texts.py)
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
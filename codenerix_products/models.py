@@ -19,6 +19,7 @@
 # limitations under the License.
 
 import copy
+import datetime
 
 from operator import or_
 try:
@@ -31,8 +32,9 @@ from functools import reduce
 from decimal import Decimal
 
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models, transaction, IntegrityError
-from django.db.models import F, Q
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import F, Q, Sum
+from django.dispatch import Signal
 from django.utils import timezone
 from django.utils.encoding import smart_str
 from django.utils.translation import gettext_lazy as _
@@ -47,12 +49,40 @@ from codenerix_extensions.helpers import get_language_database
 from codenerix_extensions.files.models import GenImageFile, GenDocumentFile, GenImageFileNull
 from codenerix_storages.models import StorageBox
 
+from codenerix_products.caches import LocalTable, GenerationCache
 from codenerix_products.exceptions import ProductUniqueAlreadyExists, ProductUniqueQuantityExceeded, ProductUniqueNotProductFinal, ProductFinalAttributeOnlyOne
+from codenerix_products.exceptions import ProductUniqueStockUnavailable
 
 
 CURRENCY_MAX_DIGITS = getattr(settings, 'CDNX_INVOICING_CURRENCY_MAX_DIGITS', 10)
 CURRENCY_DECIMAL_PLACES = getattr(settings, 'CDNX_INVOICING_CURRENCY_DECIMAL_PLACES', 2)
 
+# number of products final repriced (and written back) on each round of a bulk recalculation
+RECALCULATE_BATCH_SIZE = getattr(settings, 'CDNX_PRODUCTS_RECALCULATE_BATCH_SIZE', 1000)
+
+# how the storefront helpers get the prices of the products
+PRICE_MODE_BATCH = 'batch'      # stored price when fresh, one pricing pass for the stale ones
+PRICE_MODE_STORED = 'stored'    # stored price column
+PRICE_MODE_LEGACY = 'legacy'    # calculate_price() row by row
+PRICE_MODE = getattr(settings, 'CDNX_PRODUCTS_PRICE_MODE', PRICE_MODE_BATCH)
+
+# keep the option descriptions in the Django cache too, so each process doesn't have to build them
+OPTION_DESCRIPTIONS_SHARED = getattr(settings, 'CDNX_PRODUCTS_OPTION_DESCRIPTIONS_SHARED', False)
+
+# storefront helpers (recommended, outstanding, flagship): seconds a result is fresh (0 disables the cache) and seconds it can be served stale while it is rebuilt
+STOREFRONT_CACHE_TIMEOUT = getattr(settings, 'CDNX_PRODUCTS_STOREFRONT_CACHE_TIMEOUT', 300)
+STOREFRONT_CACHE_STALE_TIMEOUT = getattr(settings, 'CDNX_PRODUCTS_STOREFRONT_CACHE_STALE_TIMEOUT', 3600)
+STOREFRONT_CACHE = GenerationCache('storefront', STOREFRONT_CACHE_TIMEOUT, STOREFRONT_CACHE_STALE_TIMEOUT)
+
+# salable boxes of each POS: seconds they are kept, the changes of the boxes and storage zones invalidate them before (0 disables the cache)
+SALABLE_BOXES_TIMEOUT = getattr(settings, 'CDNX_PRODUCTS_SALABLE_BOXES_TIMEOUT', 60)
+SALABLE_BOXES = GenerationCache('salable_boxes', SALABLE_BOXES_TIMEOUT, 0)
+
+# where the texts of each language (product.es) are read from: the table of each language or the texts column of the entity (a copy of those tables kept by signals, see texts.py)
+TEXT_STORAGE_TABLES = 'tables'
+TEXT_STORAGE_JSON = 'json'
+TEXT_STORAGE = getattr(settings, 'CDNX_PRODUCTS_TEXT_STORAGE', TEXT_STORAGE_TABLES)
+
 PRODUCT_UNIQUE_VALUE_LENGTH = 80
 
 TYPE_PRICE_PERCENTAGE = 'P'
@@ -82,6 +112,22 @@ TYPE_ORIENTAZION = (
 
 # Model Mixins
 
+class TextsMixin(object):
+    """
+    Entity with the texts column (texts.py), written only by mirror_text() and rebuild_texts()
+    An ordinary save() of an existing entity leaves the column out, so an instance loaded before one of its texts changed doesn't write its old copy back
+    """
+
+    def save(self, *args, **kwargs):
+        if not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert') and not self._state.adding:
+            # como hace Django con los campos diferidos, solo se escriben los cargados
+            deferred = self.get_deferred_fields()
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'texts' and field.attname not in deferred]
+            if update_fields:
+                kwargs['update_fields'] = update_fields
+        return super(TextsMixin, self).save(*args, **kwargs)
+
+
 class CustomQueryMixin(object):
 
     @classmethod
@@ -146,9 +192,7 @@ class TypeTax(CodenerixModel):
             obj = TypeTax.objects.get(pk=self.pk)
             if obj.tax != self.tax:
                 result = super(TypeTax, self).save(*args, **kwargs)
-                for product in self.products.all():
-                    for pf in product.products_final.all():
-                        pf.recalculate()
+                ProductFinal.objects.recalculate_many(ProductFinal.objects.filter(product__tax=self))
             else:
                 result = super(TypeTax, self).save(*args, **kwargs)
         else:
@@ -157,7 +201,7 @@ class TypeTax(CodenerixModel):
 
 
 # atributos
-class GenAttr(CodenerixModel, GenImageFileNull):  # META: Abstract class
+class GenAttr(TextsMixin, CodenerixModel, GenImageFileNull):  # META: Abstract class
     """
     type_value:
         * libre (no hay validación extra)
@@ -176,6 +220,7 @@ class GenAttr(CodenerixModel, GenImageFileNull):  # META: Abstract class
     type_price = models.CharField(_("Type price"), max_length=2, choices=TYPE_PRICES, blank=False, null=False, default=TYPE_PRICE_PERCENTAGE)
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __fields__(self, info):
         fields = []
@@ -248,7 +293,14 @@ class GenTextSlug(GenSEOText):  # META: Abstract class
 
     def save(self, *args, **kwards):
         self.slug = nameunify(self.slug, True)
-        return super(GenTextSlug, self).save(*args, **kwards)
+        result = super(GenTextSlug, self).save(*args, **kwards)
+        invalidate_slug_index(self)
+        return result
+
+    def delete(self, *args, **kwards):
+        result = super(GenTextSlug, self).delete(*args, **kwards)
+        invalidate_slug_index(self)
+        return result
 
 
 class GenTextTitle(CodenerixModel):  # META: Abstract class
@@ -289,7 +341,14 @@ class GenProductBrandText(GenSEOText):  # META: Abstract class
 
     def save(self, *args, **kwards):
         self.slug = nameunify(self.slug, True)
-        return super(GenProductBrandText, self).save(*args, **kwards)
+        result = super(GenProductBrandText, self).save(*args, **kwards)
+        invalidate_slug_index(self)
+        return result
+
+    def delete(self, *args, **kwards):
+        result = super(GenProductBrandText, self).delete(*args, **kwards)
+        invalidate_slug_index(self)
+        return result
 
 
 class GenProductText(GenProductBrandText):  # META: Abstract class
@@ -314,13 +373,26 @@ class GenProductFinalText(GenProductText):  # META: Abstract class
 # #####################################
 
 
+def get_taxonomy_name(instance, kind):
+    """
+    Name of a family, category or subcategory in the main language, taken from the taxonomy tree (taxonomy.py) when it is there
+    """
+    from codenerix_products.taxonomy import get_node
+    lang = settings.LANGUAGES_DATABASES[0].lower()
+    node = get_node(lang, kind, instance.pk) if instance.pk else None
+    if node is not None and node['name'] is not None:
+        return node['name']
+    return getattr(instance, lang).name
+
+
 # familias
-class Family(CodenerixModel, GenImageFileNull):
+class Family(TextsMixin, CodenerixModel, GenImageFileNull):
     code = models.CharField(_("Code"), max_length=250, blank=True, null=True, unique=True)
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
     show_menu = models.BooleanField(_("Show menu"), blank=True, null=False, default=True)
     icon = ImageAngularField(_("Icon"), upload_to=upload_path, max_length=200, blank=True, null=True, help_text=_(u'Se aconseja que sea una imagen superior a 200px transparente y en formato png o svg'))
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __fields__(self, info):
         fields = []
@@ -333,9 +405,9 @@ class Family(CodenerixModel, GenImageFileNull):
 
     def __str__(self):
         if self.code:
-            return u"{} ({})".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name), smart_str(self.code))
+            return u"{} ({})".format(smart_str(get_taxonomy_name(self, 'family')), smart_str(self.code))
         else:
-            return u"{}".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name))
+            return u"{}".format(smart_str(get_taxonomy_name(self, 'family')))
 
     def __unicode__(self):
         return self.__str__()
@@ -356,7 +428,7 @@ class Family(CodenerixModel, GenImageFileNull):
 
 
 # categorias
-class Category(CodenerixModel):
+class Category(TextsMixin, CodenerixModel):
     code = models.CharField(_("Code"), max_length=250, blank=True, null=True, unique=True)
     family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='categories', verbose_name=_("Family"))
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
@@ -365,12 +437,13 @@ class Category(CodenerixModel):
     image = ImageAngularField(_("Image"), upload_to=upload_path, max_length=200, blank=True, null=True, help_text=_(u'Se aconseja un tamaño comprendido entre 1200px y 2000px'))
     icon = ImageAngularField(_("Icon"), upload_to=upload_path, max_length=200, blank=True, null=True, help_text=_(u'Se aconseja que sea una imagen superior a 200px transparente y en formato png o svg'))
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __str__(self):
         if self.code:
-            return u"{} ({})".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name), smart_str(self.code))
+            return u"{} ({})".format(smart_str(get_taxonomy_name(self, 'category')), smart_str(self.code))
         else:
-            return u"{}".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name))
+            return u"{}".format(smart_str(get_taxonomy_name(self, 'category')))
 
     def __unicode__(self):
         return self.__str__()
@@ -403,7 +476,7 @@ class Category(CodenerixModel):
 
 
 # subcategorias
-class Subcategory(CodenerixModel):
+class Subcategory(TextsMixin, CodenerixModel):
     code = models.CharField(_("Code"), max_length=250, blank=True, null=True, unique=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='subcategory', verbose_name=_("Category"))
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
@@ -413,12 +486,13 @@ class Subcategory(CodenerixModel):
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
     image = ImageAngularField(_("Image"), upload_to=upload_path, max_length=200, blank=True, null=True, help_text=_(u'Se aconseja un tamaño comprendido entre 1200px y 2000px'))
     icon = ImageAngularField(_("Icon"), upload_to=upload_path, max_length=200, blank=True, null=True, help_text=_(u'Se aconseja que sea una imagen superior a 200px transparente y en formato png o svg'))
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __str__(self):
         if self.code:
-            return u"{} ({})".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name), smart_str(self.code))
+            return u"{} ({})".format(smart_str(get_taxonomy_name(self, 'subcategory')), smart_str(self.code))
         else:
-            return u"{}".format(smart_str(getattr(self, settings.LANGUAGES_DATABASES[0].lower()).name))
+            return u"{}".format(smart_str(get_taxonomy_name(self, 'subcategory')))
 
     def __unicode__(self):
         return self.__str__()
@@ -514,10 +588,12 @@ class GroupValueFeatureSpecial(GroupValues):
 
 
 # opciones de los grupos de valores
-class OptionValues(CodenerixModel):  # META: Abstract class
+class OptionValues(TextsMixin, CodenerixModel):  # META: Abstract class
     class Meta(CodenerixModel.Meta):
         abstract = True
 
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
+
     def __fields__(self, info):
         fields = []
         for lang_code in settings.LANGUAGES_DATABASES:
@@ -550,6 +626,36 @@ class OptionValueFeatureSpecial(OptionValues):
     group = models.ForeignKey(GroupValueFeatureSpecial, on_delete=models.CASCADE, related_name='options_value_feature_special', verbose_name=_("Options value"))
 
 
+# descripciones de las opciones por idioma {(group pk, option pk, lang): description}
+# se invalidan con las señales de guardado y borrado de las opciones y de sus textos
+def option_descriptions_builder(model):
+    def builder():
+        langs = [lang_code.lower() for lang_code in settings.LANGUAGES_DATABASES]
+        descriptions = {}
+        for info in model.objects.values_list('group_id', 'pk', *['{}__description'.format(lang) for lang in langs]):
+            for lang, description in zip(langs, info[2:]):
+                if description is not None:
+                    descriptions[(info[0], info[1], lang)] = description
+        return descriptions
+    return builder
+
+
+OPTION_DESCRIPTIONS = dict(
+    (model, LocalTable('option_descriptions_{}'.format(model.__name__.lower()), option_descriptions_builder(model), shared=OPTION_DESCRIPTIONS_SHARED))
+    for model in (OptionValueFeature, OptionValueAttribute, OptionValueFeatureSpecial)
+)
+
+
+def get_option_description(model, group, pk, lang=None):
+    """
+    Description of an option (OptionValueFeature, OptionValueAttribute or OptionValueFeatureSpecial) in the language given
+    or the active one, None if it doesn't exist
+    """
+    if lang is None:
+        lang = get_language_database()
+    return OPTION_DESCRIPTIONS[model].get().get((group, pk, lang))
+
+
 # caracteristicas (comunes a todos los productos (resolución, RAM))
 class Feature(GenAttr):
     family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='features', verbose_name=_("Family"), blank=True, null=True)
@@ -561,8 +667,7 @@ class Feature(GenAttr):
             obj = Feature.objects.get(pk=self.pk)
             if obj.price != self.price:
                 result = super(Feature, self).save(*args, **kwargs)
-                for pf in ProductFinal.objects.filter(product__product_features__feature=self):
-                    pf.recalculate()
+                ProductFinal.objects.recalculate_many(ProductFinal.objects.filter(product__product_features__feature=self))
             else:
                 result = super(Feature, self).save(*args, **kwargs)
         else:
@@ -592,8 +697,7 @@ class Attribute(GenAttr):
             obj = Attribute.objects.get(pk=self.pk)
             if obj.price != self.price:
                 result = super(Attribute, self).save(*args, **kwargs)
-                for pf in ProductFinal.objects.filter(products_final_attr__attribute=self):
-                    pf.recalculate()
+                ProductFinal.objects.recalculate_many(ProductFinal.objects.filter(products_final_attr__attribute=self))
             else:
                 result = super(Attribute, self).save(*args, **kwargs)
         else:
@@ -624,8 +728,7 @@ class FeatureSpecial(GenAttr):
             obj = FeatureSpecial.objects.get(pk=self.pk)
             if obj.price != self.price:
                 result = super(FeatureSpecial, self).save(*args, **kwargs)
-                for pf in ProductFinal.objects.filter(product__feature_special=self):
-                    pf.recalculate()
+                ProductFinal.objects.recalculate_many(ProductFinal.objects.filter(product__feature_special=self))
             else:
                 result = super(FeatureSpecial, self).save(*args, **kwargs)
         else:
@@ -640,10 +743,11 @@ class FeatureSpecial(GenAttr):
 
 
 # Marcas
-class Brand(CodenerixModel, GenImageFileNull):
+class Brand(TextsMixin, CodenerixModel, GenImageFileNull):
     outstanding = models.BooleanField(_("Outstanding"), blank=True, null=False, default=True)
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
     show_menu = models.BooleanField(_("Show menu"), blank=True, null=False, default=True)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         name_res = _("Missing brand name")
@@ -692,9 +796,9 @@ class GenProduct(CodenerixModel):  # META: Abstract class
     code = models.CharField(_("Code"), max_length=250, blank=False, null=False, unique=True)
     price_base = models.DecimalField(_("Price base"), blank=False, null=False, max_digits=CURRENCY_MAX_DIGITS, decimal_places=CURRENCY_DECIMAL_PLACES, default=0)
     # producto para la venta
-    of_sales = models.BooleanField(_("Sales"), blank=True, null=False, default=True)
+    of_sales = models.BooleanField(_("Sales"), blank=True, null=False, default=True, db_index=True)
     # producto para la compra
-    of_purchase = models.BooleanField(_("Purchase"), blank=True, null=False, default=True)
+    of_purchase = models.BooleanField(_("Purchase"), blank=True, null=False, default=True, db_index=True)
     # es necesario que el producto tenga stock para su venta
     force_stock = models.BooleanField(_("Force stock"), blank=True, null=False, default=True)
     url_video = models.CharField(_("Url Video"), max_length=250, blank=True, null=True)
@@ -746,7 +850,8 @@ class GenProduct(CodenerixModel):  # META: Abstract class
 
 
 # productos
-class Product(CustomQueryMixin, GenProduct):
+class Product(TextsMixin, CustomQueryMixin, GenProduct):
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def lock_delete(self):
         if self.products_final.exists():
@@ -769,8 +874,7 @@ class Product(CustomQueryMixin, GenProduct):
             obj = Product.objects.get(pk=self.pk)
             if obj.price_base != self.price_base or obj.tax != self.tax:
                 result = super(Product, self).save(*args, **kwargs)
-                for pf in self.products_final.all():
-                    pf.recalculate()
+                ProductFinal.objects.recalculate_many(self.products_final.all())
             else:
                 result = super(Product, self).save(*args, **kwargs)
         else:
@@ -778,7 +882,6 @@ class Product(CustomQueryMixin, GenProduct):
         return result
 
     def pass_to_productfinal(self, ean13=None):
-        get_class = lambda x: globals()[x]
 
         try:
             with transaction.atomic():
@@ -793,8 +896,7 @@ class Product(CustomQueryMixin, GenProduct):
                 for lang_code in settings.LANGUAGES_DATABASES:
                     lang = getattr(self, lang_code.lower(), None)
                     if lang:
-                        model_name = "{}Text{}".format('ProductFinal', lang_code)
-                        model = get_class(model_name)
+                        model = get_text_model(ProductFinal, lang_code)
                         pft = model()
                         pft.product = pf
                         pft.meta_title = getattr(lang, 'meta_title', None)
@@ -918,13 +1020,14 @@ class ProductRelationSold(CodenerixModel):
 
 
 # imagenes de productos
-class ProductImage(CodenerixModel, GenImageFile):
+class ProductImage(TextsMixin, CodenerixModel, GenImageFile):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='products_image', verbose_name=_("Product"))
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
     principal = models.BooleanField(_("Principal"), blank=False, null=False, default=False)
     flagship_product = models.BooleanField(_("Flagship product"), default=False)
     outstanding = models.BooleanField(_("Outstanding"), default=False)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         return u"{} ({})".format(smart_str(self.product), smart_str(self.order))
@@ -964,9 +1067,10 @@ class ProductImage(CodenerixModel, GenImageFile):
 
 
 # documentos de productos
-class ProductDocument(CodenerixModel, GenDocumentFile):
+class ProductDocument(TextsMixin, CodenerixModel, GenDocumentFile):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='products_document', verbose_name=_("Product"))
     public = models.BooleanField(_("Public"), blank=False, null=False, default=False)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         return u"{}".format(smart_str(self.product))
@@ -981,12 +1085,218 @@ class ProductDocument(CodenerixModel, GenDocumentFile):
         return fields
 
 
+# calculo de precios
+# attributes where ProductFinal.objects.with_pricing_data() leaves the prefetched modifiers
+PRICING_ATTRIBUTES = 'pricing_attributes'
+PRICING_FEATURES = 'pricing_features'
+
+# tablas de reglas de precio compiladas
+PRICING_RULE_ATTRIBUTE = 'attribute'
+PRICING_RULE_FEATURE = 'feature'
+PRICING_RULE_FEATURE_SPECIAL = 'feature_special'
+
+
+def compile_price_rule(type_price, price):
+    """
+    Convert the price of an attribute, feature or feature special into a rule (type_price, price, percentage)
+    with its Decimal values already calculated
+    """
+    return (type_price, Decimal(price), Decimal(price / 100.0))
+
+
+def build_pricing_rules():
+    """
+    Compile the rules of all the attributes, features and features special: {kind: {pk: rule}}
+    """
+    rules = {}
+    for kind, model in ((PRICING_RULE_ATTRIBUTE, Attribute), (PRICING_RULE_FEATURE, Feature), (PRICING_RULE_FEATURE_SPECIAL, FeatureSpecial)):
+        rules[kind] = dict(
+            (pk, compile_price_rule(type_price, price))
+            for pk, type_price, price in model.objects.values_list('pk', 'type_price', 'price')
+        )
+    return rules
+
+
+# se invalida con las señales de guardado y borrado de Attribute, Feature y FeatureSpecial
+PRICING_RULES = LocalTable('pricing_rules', build_pricing_rules)
+
+
+def get_pricing_rules(attributes=(), features=(), features_special=()):
+    """
+    Return the compiled pricing rules, they are rebuilt when some of the given pks is still unknown
+    """
+    rules = PRICING_RULES.get()
+    for kind, pks in ((PRICING_RULE_ATTRIBUTE, attributes), (PRICING_RULE_FEATURE, features), (PRICING_RULE_FEATURE_SPECIAL, features_special)):
+        if any(pk not in rules[kind] for pk in pks):
+            return PRICING_RULES.get(refresh=True)
+    return rules
+
+
+def get_price_modifiers(rules, attributes=(), features=(), feature_special=None):
+    """
+    List of rules of a product final ordered by priority (attributes, features and feature special)
+    """
+    modifiers = []
+    for kind, pks in ((PRICING_RULE_ATTRIBUTE, attributes), (PRICING_RULE_FEATURE, features), (PRICING_RULE_FEATURE_SPECIAL, [feature_special] if feature_special is not None else [])):
+        for pk in pks:
+            rule = rules[kind].get(pk)
+            if rule is not None:
+                modifiers.append(rule)
+    return modifiers
+
+
+def apply_price_modifiers(price, tax, modifiers):
+    """
+    Apply the modifiers of a product final over its price base
+    modifiers: compiled rules ordered by priority (attributes, features and feature special),
+               the first TYPE_PRICE_FINAL found stops the calculation
+    """
+    price_base = price
+    for type_price, value, percentage in modifiers:
+        if type_price == TYPE_PRICE_FINAL:
+            price = value
+            break
+        elif type_price == TYPE_PRICE_INCREASE:
+            price += value
+        elif type_price == TYPE_PRICE_PERCENTAGE:
+            price += price_base * percentage
+
+    result = {}
+    result['price_base'] = price
+    result['tax'] = price * Decimal(tax) / 100
+    result['price_total'] = price + result['tax']
+    return result
+
+
+class ProductFinalQuerySet(models.QuerySet):
+
+    def with_pricing_data(self):
+        """
+        Preload everything calculate_price() needs, ordered by priority
+        """
+        return self.select_related(
+            'product__tax',
+        ).prefetch_related(
+            models.Prefetch(
+                'products_final_attr',
+                queryset=ProductFinalAttribute.objects.filter(attribute__isnull=False).order_by('-updated'),
+                to_attr=PRICING_ATTRIBUTES
+            ),
+            models.Prefetch(
+                'product__product_features',
+                queryset=ProductFeature.objects.order_by('-updated'),
+                to_attr=PRICING_FEATURES
+            ),
+        )
+
+
+class ProductFinalManager(models.Manager.from_queryset(ProductFinalQuerySet)):
+
+    def calculate_prices(self, pks):
+        """
+        Calculate the prices of the given products final with 3 queries
+        Return a dictionary {pk: {'price_base', 'tax', 'price_total'}}, products without tax are skipped
+        """
+        pks = list(pks)
+        if not pks:
+            return {}
+
+        products_final = list(self.get_queryset().filter(pk__in=pks).values_list(
+            'pk',
+            'product_id',
+            'price_base_local',
+            'product__price_base',
+            'product__tax__tax',
+            'product__feature_special_id',
+        ))
+
+        # atributos (ordenados por prioridad)
+        attributes = {}
+        for product_final_id, attribute_id in ProductFinalAttribute.objects.filter(
+            product_id__in=pks,
+            attribute__isnull=False
+        ).order_by('product_id', '-updated').values_list('product_id', 'attribute_id'):
+            attributes.setdefault(product_final_id, []).append(attribute_id)
+
+        # caracteristicas (ordenadas por prioridad)
+        features = {}
+        for product_id, feature_id in ProductFeature.objects.filter(
+            product_id__in=set([info[1] for info in products_final])
+        ).order_by('product_id', '-updated').values_list('product_id', 'feature_id'):
+            features.setdefault(product_id, []).append(feature_id)
+
+        rules = get_pricing_rules(
+            attributes=set([pk for pks in attributes.values() for pk in pks]),
+            features=set([pk for pks in features.values() for pk in pks]),
+            features_special=set([info[5] for info in products_final if info[5] is not None]),
+        )
+
+        result = {}
+        for pk, product_id, price_base_local, price_base, tax, feature_special_id in products_final:
+            if tax is None:
+                continue
+            modifiers = get_price_modifiers(rules, attributes.get(pk, []), features.get(product_id, []), feature_special_id)
+            if price_base_local is not None:
+                price_base = price_base_local
+            result[pk] = apply_price_modifiers(price_base, tax, modifiers)
+        return result
+
+    def recalculate_many(self, queryset=None, batch_size=RECALCULATE_BATCH_SIZE):
+        """
+        Recalculate and store price and price_base of all the products final in the queryset and mark them as fresh
+        Each batch costs 3 queries to read plus the bulk update of the rows that really changed
+        Return the number of products final updated
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        pks = list(queryset.order_by().values_list('pk', flat=True).distinct())
+
+        quantize = Decimal(1).scaleb(-CURRENCY_DECIMAL_PLACES)
+        updated = 0
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            with transaction.atomic():
+                # the rows stay locked until the batch is written, a concurrent mark_price_stale() waits for us
+                current = list(self.get_queryset().select_for_update().filter(pk__in=batch).values_list('pk', 'price', 'price_base', 'price_stale'))
+                prices = self.calculate_prices(batch)
+                changes = []
+                for pk, price, price_base, price_stale in current:
+                    if pk in prices:
+                        new_price = prices[pk]['price_total'].quantize(quantize)
+                        new_price_base = prices[pk]['price_base'].quantize(quantize)
+                    else:
+                        # without tax there is nothing to calculate, keep the stored prices
+                        new_price = price
+                        new_price_base = price_base
+                    if (price, price_base, price_stale) != (new_price, new_price_base, False):
+                        changes.append(self.model(pk=pk, price=new_price, price_base=new_price_base, price_stale=False))
+                if changes:
+                    self.bulk_update(changes, ['price', 'price_base', 'price_stale'])
+                    # bulk_update() doesn't send signals, the listing is updated here
+                    ProductFinalListing.objects.refresh_prices([change.pk for change in changes])
+                    STOREFRONT_CACHE.invalidate()
+                    from codenerix_products.facets import FACETS
+                    FACETS.update([change.pk for change in changes])
+                    updated += len(changes)
+        return updated
+
+    def mark_price_stale(self, queryset=None):
+        """
+        Flag the prices of the products final in the queryset as stale, the reprice_products command will recalculate them
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        return queryset.filter(price_stale=False).update(price_stale=True)
+
+
 # producto final (1 producto muchos atributos) (pulgadas, RAM)
-class ProductFinal(CustomQueryMixin, CodenerixModel):
+class ProductFinal(TextsMixin, CustomQueryMixin, CodenerixModel):
     """
     el stock se relaciona con esta clase
     definición de productos individuales
     """
+    objects = ProductFinalManager()
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=False, null=False, related_name='products_final', verbose_name=_('Product'))
     # productos relacionados
     related = models.ManyToManyField("ProductFinal", blank=True, related_name='productsrelated', symmetrical=False)
@@ -1009,6 +1319,9 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
 
     packing_cost = models.DecimalField(_("Packing cost"), blank=True, null=True, max_digits=CURRENCY_MAX_DIGITS, decimal_places=CURRENCY_DECIMAL_PLACES, help_text=_('If it is empty, packing cost is equal to packing cost of product'))
     weight = models.FloatField(_("Weight"), blank=True, null=True, help_text=_('If it is empty, weight is equal to weight of product'))
+    # price and price_base must be recalculated (some input changed without going through save())
+    price_stale = models.BooleanField(_("Price stale"), blank=True, null=False, default=False, editable=False, db_index=True)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __str__(self):
         lang = get_language_database()
@@ -1084,9 +1397,10 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
 
     def recalculate(self, commit=True):
         prices = self.calculate_price()
-        if self.price != prices['price_total'] or self.price_base != prices['price_base']:
+        if self.price != prices['price_total'] or self.price_base != prices['price_base'] or self.price_stale:
             self.price = prices['price_total']
             self.price_base = prices['price_base']
+            self.price_stale = False
             if commit:
                 self.save()
 
@@ -1108,46 +1422,29 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
         else:
             price = self.price_base_local
         tax = self.product.tax.tax
-        price_base = price
 
         # atributos
-        update = True
-        for attr in self.products_final_attr.all().order_by('-updated'):
-            if update:
-                if attr.attribute.type_price == TYPE_PRICE_FINAL:
-                    price = Decimal(attr.attribute.price)
-                    update = False
-                elif attr.attribute.type_price == TYPE_PRICE_INCREASE:
-                    price += Decimal(attr.attribute.price)
-                elif attr.attribute.type_price == TYPE_PRICE_PERCENTAGE:
-                    price += price_base * Decimal(attr.attribute.price / 100.0)
+        attributes = getattr(self, PRICING_ATTRIBUTES, None)
+        if self.pk is None:
+            # producto final sin guardar (save() calcula el precio antes de insertarlo), todavia no tiene atributos
+            attributes = []
+        elif attributes is None:
+            attributes = list(self.products_final_attr.filter(attribute__isnull=False).order_by('-updated').values_list('attribute_id', flat=True))
+        else:
+            attributes = [attr.attribute_id for attr in attributes]
 
         # caracteristicas
-        if update:
-            for feature in self.product.product_features.all().order_by('-updated'):
-                if update:
-                    if feature.feature.type_price == TYPE_PRICE_FINAL:
-                        price = Decimal(feature.feature.price)
-                        update = False
-                    elif feature.feature.type_price == TYPE_PRICE_INCREASE:
-                        price += Decimal(feature.feature.price)
-                    elif feature.feature.type_price == TYPE_PRICE_PERCENTAGE:
-                        price += price_base * Decimal(feature.feature.price / 100.0)
+        features = getattr(self.product, PRICING_FEATURES, None)
+        if features is None:
+            features = list(self.product.product_features.order_by('-updated').values_list('feature_id', flat=True))
+        else:
+            features = [feature.feature_id for feature in features]
 
         # caracteristicas especiales
-        if update and self.product.feature_special:
-            if self.product.feature_special.type_price == TYPE_PRICE_FINAL:
-                price = Decimal(self.product.feature_special.price)
-            elif self.product.feature_special.type_price == TYPE_PRICE_INCREASE:
-                price += Decimal(self.product.feature_special.price)
-            elif self.product.feature_special.type_price == TYPE_PRICE_PERCENTAGE:
-                price += price_base * Decimal(self.product.feature_special.price / 100.0)
+        feature_special = self.product.feature_special_id
 
-        result = {}
-        result['price_base'] = price
-        result['tax'] = price * Decimal(tax) / 100
-        result['price_total'] = price + result['tax']
-        return result
+        rules = get_pricing_rules(attributes, features, [feature_special] if feature_special is not None else [])
+        return apply_price_modifiers(price, tax, get_price_modifiers(rules, attributes, features, feature_special))
 
     def is_pack(self):
         return self.productfinals_option.exists()
@@ -1158,10 +1455,17 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
 
     @classmethod
     def get_recommended_products(cls, lang, family=None, category=None, subcategory=None):
+        return STOREFRONT_CACHE.get(
+            ('recommended', lang, family, category, subcategory),
+            lambda: cls._get_recommended_products(lang, family, category, subcategory)
+        )
+
+    @classmethod
+    def _get_recommended_products(cls, lang, family=None, category=None, subcategory=None):
         products = []
         query = Q(most_sold=True) | Q(product__products_image__principal=True)
         if family is not None:
-            query &= Q(product__family=category)
+            query &= Q(product__family=family)
         if category is not None:
             query &= Q(product__category=category)
         if subcategory is not None:
@@ -1190,7 +1494,14 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
         return products
 
     @classmethod
-    def get_outstanding_products(cls, lang, family=None, category=None, subcategory=None, limit=16):
+    def get_outstanding_products(cls, lang, family=None, category=None, subcategory=None, limit=16, price_mode=None):
+        return STOREFRONT_CACHE.get(
+            ('outstanding', lang, family, category, subcategory, limit, price_mode),
+            lambda: cls._get_outstanding_products(lang, family, category, subcategory, limit, price_mode)
+        )
+
+    @classmethod
+    def _get_outstanding_products(cls, lang, family=None, category=None, subcategory=None, limit=16, price_mode=None):
         products = []
         query = Q(outstanding=True) & (Q(product__products_image__principal=True) | Q(productfinals_image__principal=True))
         if family is not None:
@@ -1208,6 +1519,7 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
             "created",
             "offer",
             "pk",
+            "price",
             "sample",
             "code",
             "product__tax__tax",
@@ -1226,10 +1538,8 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
             category_name=F("product__category__{}__name".format(lang))
         )[:limit]
 
-        for product in qset:
-            prices = cls.objects.get(pk=product['pk']).calculate_price()
+        for product in cls.set_prices(list(qset), price_mode):
             product['pop_annotations'] = True
-            product['price'] = prices['price_total']
             product['new'] = 1 if (timezone.now() - product['created']).days <= settings.CDNX_PRODUCTS_NOVELTY_DAYS else 0
             if product['image_productfinal']:
                 product['image'] = product['image_productfinal']
@@ -1240,7 +1550,7 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
         return products
 
     @classmethod
-    def get_products(cls, lang, family=None, category=None, subcategory=None, brand=None):
+    def get_products(cls, lang, family=None, category=None, subcategory=None, brand=None, price_mode=None):
         products = []
         query = Q(product__products_image__principal=True)
 
@@ -1259,6 +1569,7 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
             "created",
             "offer",
             "pk",
+            "price",
             "product__tax__tax",
             "product__{}__name".format(lang),
             "product__model",
@@ -1271,15 +1582,26 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
             name="product__{}__name".format(lang),
             pop_annotations=True
         ):
-            prices = cls.objects.get(pk=product['pk']).calculate_price()
-            product['price'] = prices['price_total']
-            product['new'] = 1 if (timezone.now() - product['created']).days <= settings.CDNX_PRODUCTS_NOVELTY_DAYS else 0
             products.append(product)
 
+        for product in cls.set_prices(products, price_mode):
+            product['new'] = 1 if (timezone.now() - product['created']).days <= settings.CDNX_PRODUCTS_NOVELTY_DAYS else 0
+
         return products
 
     @classmethod
-    def find_product(cls, query, lang, onlypublic=False):
+    def find_product(cls, query, lang, onlypublic=False, price_mode=None):
+        """
+        query: Q object(s) or text, the text is looked up with the search backend (search.py) and the best ranked product is returned
+        """
+        ranking = None
+        if isinstance(query, str):
+            # los candidatos mejor puntuados, el primero que pase el resto de filtros
+            from codenerix_products.search import search_product_finals, rank_order, SEARCH_LIMIT
+            pks = search_product_finals(query, lang, limit=SEARCH_LIMIT)
+            query = Q(pk__in=pks)
+            ranking = rank_order('pk', pks)
+
         product = cls.query_or(
             query,
             "pk",
@@ -1366,34 +1688,90 @@ class ProductFinal(CustomQueryMixin, CodenerixModel):
         )
         if onlypublic:
             product = product.exclude(product__model=False)
+        if ranking is not None:
+            product = product.order_by(ranking, 'pk')
         product = product.first()
 
         if product:
-            product_final = cls.objects.get(pk=product['pk'])
-            prices = product_final.calculate_price()
-            product['price'] = prices['price_total']
+            cls.set_prices([product], price_mode)
 
         return product
 
+    @classmethod
+    def set_prices(cls, products, price_mode=None):
+        """
+        Fill 'price' (price with tax) of rows coming from values() querysets, the pk of the product final is taken from 'pk'
+        price_mode: PRICE_MODE_BATCH, PRICE_MODE_STORED or PRICE_MODE_LEGACY (default CDNX_PRODUCTS_PRICE_MODE)
+        """
+        if price_mode is None:
+            price_mode = PRICE_MODE
+
+        if price_mode == PRICE_MODE_BATCH:
+            # stored prices are fresh unless they were flagged as stale
+            stale = cls.objects.filter(
+                pk__in=set([product['pk'] for product in products]),
+                price_stale=True
+            ).values_list('pk', flat=True)
+            prices = cls.objects.calculate_prices(stale)
+            for product in products:
+                if product['pk'] in prices:
+                    product['price'] = prices[product['pk']]['price_total']
+        elif price_mode == PRICE_MODE_LEGACY:
+            for product in products:
+                product['price'] = cls.objects.get(pk=product['pk']).calculate_price()['price_total']
+        elif price_mode != PRICE_MODE_STORED:
+            raise ValueError("Unknown price mode '{}'".format(price_mode))
+
+        return products
+
     def get_value_product_unique(self, pos):
         """
         Return all products unique relationship with POS's Storage (only salable zones)
         """
         qs = ProductUnique.objects.filter(
-            box__box_structure__zone__storage__in=pos.storage_stock.filter(storage_zones__salable=True),
+            box__in=ProductFinal.get_salable_boxes(pos),
             product_final=self
         )
         return qs
 
+    @classmethod
+    def get_salable_boxes(cls, pos):
+        """
+        Pks of the boxes of the POS's Storages with salable zones, cached per POS (SALABLE_BOXES)
+        """
+        return SALABLE_BOXES.get(
+            ('pos', pos.pk),
+            lambda: list(StorageBox.objects.filter(
+                box_structure__zone__storage__in=pos.storage_stock.filter(storage_zones__salable=True)
+            ).values_list('pk', flat=True).distinct())
+        )
+
+    @classmethod
+    def get_salable_stock(cls, pos, product_finals):
+        """
+        Available stock (real - locked) of many products final in the salable boxes of the POS with one query
+        Return {product final pk: quantity}
+        """
+        stock = {getattr(product_final, 'pk', product_final): 0 for product_final in product_finals}
+        for product_final_id, quantity in ProductUnique.objects.filter(
+            product_final_id__in=list(stock),
+            box_id__in=cls.get_salable_boxes(pos),
+        ).values('product_final_id').annotate(
+            quantity=Sum(F('stock_real') - F('stock_locked'))
+        ).order_by().values_list('product_final_id', 'quantity'):
+            stock[product_final_id] = quantity or 0
+        return stock
+
 
 # imagenes de productos
-class ProductFinalImage(CodenerixModel, GenImageFile):
+class ProductFinalImage(TextsMixin, CodenerixModel, GenImageFile):
     product_final = models.ForeignKey(ProductFinal, on_delete=models.CASCADE, related_name='productfinals_image', verbose_name=_("Product Final"))
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
     principal = models.BooleanField(_("Principal"), blank=False, null=False, default=False)
     flagship_product = models.BooleanField(_("Flagship product"), default=False)
     outstanding = models.BooleanField(_("Outstanding"), default=False)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         return u"{} ({})".format(smart_str(self.product_final), smart_str(self.order))
@@ -1443,23 +1821,30 @@ class ProductFinalAttribute(CodenerixModel):
 
     value = models.CharField(_("Value"), max_length=80)
 
-    def __unicode__(self, show_attribute=True):
+    def resolve_value(self, lang=None):
+        """
+        Value shown for the attribute, the descriptions of the options come from OPTION_DESCRIPTIONS
+        """
         value = ''
         if self.attribute.type_value == TYPE_VALUE_BOOLEAN:
             value = bool(self.value) and _('True') or _('False')
         elif self.attribute.type_value == TYPE_VALUE_FREE:
             value = self.value
         elif self.attribute.type_value == TYPE_VALUE_LIST:
-            lang = get_language_database()
-            field = '{}__description'.format(lang)
-            ov = OptionValueAttribute.objects.filter(
-                group=self.attribute.list_value,
-                pk=int(self.value)
-            ).values(
-                field
-            ).first()
-            if ov:
-                value = ov[field]
+            value = get_option_description(OptionValueAttribute, self.attribute.list_value_id, int(self.value), lang) or ''
+        return value
+
+    @classmethod
+    def get_values(cls, queryset, lang=None):
+        """
+        Resolve the value shown of every product final attribute in the queryset with 1 query
+        (the queryset should select_related('attribute'))
+        Return a list of (product final attribute, value)
+        """
+        return [(pfa, pfa.resolve_value(lang)) for pfa in queryset]
+
+    def __unicode__(self, show_attribute=True):
+        value = self.resolve_value()
         if show_attribute:
             return u"{}: {}".format(smart_str(self.attribute), smart_str(value))
         else:
@@ -1516,8 +1901,183 @@ class ProductFeature(CodenerixModel):
         return fields
 
 
+# operaciones atomicas de stock de los productos unicos: condicion de la fila y cambios (original, real, bloqueado)
+# disponible = real - bloqueado
+PRODUCT_UNIQUE_STOCK_RESERVE = 'reserve'    # bloquea unidades disponibles
+PRODUCT_UNIQUE_STOCK_RELEASE = 'release'    # libera unidades bloqueadas
+PRODUCT_UNIQUE_STOCK_CONSUME = 'consume'    # saca unidades bloqueadas (o disponibles con locked=False)
+
+
+def product_unique_stock_operation(operation, quantity, locked=True):
+    if operation == PRODUCT_UNIQUE_STOCK_RESERVE:
+        return Q(stock_real__gte=F('stock_locked') + quantity), (0, 0, quantity)
+    elif operation == PRODUCT_UNIQUE_STOCK_RELEASE:
+        return Q(stock_locked__gte=quantity), (0, 0, -quantity)
+    elif operation == PRODUCT_UNIQUE_STOCK_CONSUME and locked:
+        return Q(stock_locked__gte=quantity, stock_real__gte=quantity), (0, -quantity, -quantity)
+    elif operation == PRODUCT_UNIQUE_STOCK_CONSUME:
+        return Q(stock_real__gte=F('stock_locked') + quantity), (0, -quantity, 0)
+    raise ValueError("Unknown stock operation '{}'".format(operation))
+
+
+class ProductUniqueManager(models.Manager):
+
+    def change_stock(self, operation, lines, locked=True, partial=False):
+        """
+        Apply a stock operation (reserve, release or consume) to many products unique, e.g. the lines of a cart
+        lines: [(product unique pk, quantity), ...]
+        Every line is a conditional UPDATE with F expressions (no row is read or locked from Python), the rows are updated in pk order so concurrent carts don't deadlock
+        Return the lines that could not be applied, when one fails none of them is applied unless partial is True
+        """
+        lines = list(lines)
+        product_finals = dict(self.filter(pk__in=[line[0] for line in lines]).values_list('pk', 'product_final_id'))
+        failed = set()
+        changes = {}
+        with transaction.atomic():
+            for position, (pk, quantity) in sorted(enumerate(lines), key=lambda line: line[1][0]):
+                condition, deltas = product_unique_stock_operation(operation, quantity, locked)
+                updated = self.filter(condition, pk=pk).update(
+                    stock_original=F('stock_original') + deltas[0],
+                    stock_real=F('stock_real') + deltas[1],
+                    stock_locked=F('stock_locked') + deltas[2],
+                )
+                if updated:
+                    total = changes.setdefault(product_finals[pk], [0, 0, 0])
+                    for index, delta in enumerate(deltas):
+                        total[index] += delta
+                else:
+                    failed.add(position)
+
+            if failed and not partial:
+                transaction.set_rollback(True)
+            else:
+                for product_final_id, deltas in changes.items():
+                    ProductFinalStock.objects.add_stock(product_final_id, *deltas)
+                # with_stock del listado de la tienda
+                ProductFinalListing.objects.schedule_refresh(list(changes))
+        return [line for position, line in enumerate(lines) if position in failed]
+
+    @transaction.atomic
+    def bulk_receive(self, rows, batch_size=RECALCULATE_BATCH_SIZE):
+        """
+        Receive many products unique at once (goods receipt)
+        rows: [(product final, box, value, caducity, quantity), ...], product final and box as instances or pks
+        The unique special features are checked for the whole batch with one query (plus the duplicates inside the batch)
+        Return the products unique created and the errors {row index: message}, the wrong rows are skipped
+        """
+        rows = list(rows)
+        product_finals = {}
+        for pk, product_id, feature_special_unique in ProductFinal.objects.filter(
+            pk__in=set([getattr(row[0], 'pk', row[0]) for row in rows])
+        ).values_list('pk', 'product_id', 'product__feature_special__unique'):
+            product_finals[pk] = (product_id, feature_special_unique)
+
+        # valores ya usados de los productos con caracteristica especial unica, en 1 consulta
+        unique_products = set([info[0] for info in product_finals.values() if info[1]])
+        used = set()
+        if unique_products:
+            used = set(self.filter(
+                product_final__product_id__in=unique_products,
+                value__in=set([row[2] for row in rows]),
+            ).values_list('product_final__product_id', 'value'))
+
+        errors = {}
+        lines = []
+        for index, (product_final, box, value, caducity, quantity) in enumerate(rows):
+            info = product_finals.get(getattr(product_final, 'pk', product_final))
+            if info is None:
+                errors[index] = _("Product final not seleted")
+                continue
+            if info[1]:
+                if (info[0], value) in used:
+                    errors[index] = _('Ya existe un producto unico con el valor de la caracteristicas especial')
+                    continue
+                elif quantity > 1:
+                    errors[index] = _('Este producto unico solo se puede cargar en cantidades de uno, porque la caracteristica especian indica que debe el valor no se puede repetir')
+                    continue
+                used.add((info[0], value))
+            lines.append(self.model(
+                product_final_id=getattr(product_final, 'pk', product_final),
+                box_id=getattr(box, 'pk', box),
+                value=value,
+                caducity=caducity,
+                stock_original=quantity,
+                stock_real=quantity,
+                stock_locked=0,
+            ))
+
+        created = self.bulk_create(lines, batch_size=batch_size)
+
+        # bulk_create() no ejecuta save() ni envia señales: proyeccion de stock y listado de la tienda
+        totals = {}
+        for line in created:
+            totals[line.product_final_id] = totals.get(line.product_final_id, 0) + line.stock_original
+        for product_final_id, quantity in totals.items():
+            ProductFinalStock.objects.add_stock(product_final_id, quantity, quantity, 0)
+        ProductFinalListing.objects.schedule_refresh(list(totals))
+
+        return created, errors
+
+    def allocate_fefo(self, product_final, quantity, boxes=None, storages=None):
+        """
+        Lots of the product final to take the quantity from, first expired first out (without caducity at the end), with one query
+        boxes/storages: limit the lots to these boxes or storages
+        Return [(product unique, quantity to take), ...] and the quantity that could not be allocated
+        Nothing is locked, consume them with consume(lines, locked=False), it reports the lots taken meanwhile
+        """
+        queryset = self.filter(product_final=product_final).annotate(
+            available=F('stock_real') - F('stock_locked')
+        ).filter(available__gt=0)
+        if boxes is not None:
+            queryset = queryset.filter(box__in=boxes)
+        if storages is not None:
+            queryset = queryset.filter(box__box_structure__zone__storage__in=storages)
+
+        lots = []
+        pending = quantity
+        for product_unique in queryset.order_by(F('caducity').asc(nulls_last=True), 'pk').iterator():
+            if pending <= 0:
+                break
+            take = min(pending, product_unique.available)
+            lots.append((product_unique, take))
+            pending -= take
+        return lots, max(pending, 0)
+
+    def near_expiry(self, days=30, expired=False, storages=None):
+        """
+        Products unique with stock expiring in the next days (also the expired ones with expired=True), sorted by caducity
+        It is a range scan of the caducity index, paginate it for big catalogues
+        """
+        today = timezone.now().date()
+        queryset = self.filter(stock_real__gt=0, caducity__lte=today + datetime.timedelta(days=days))
+        if not expired:
+            queryset = queryset.filter(caducity__gte=today)
+        if storages is not None:
+            queryset = queryset.filter(box__box_structure__zone__storage__in=storages)
+        return queryset.select_related('product_final', 'box').order_by('caducity', 'pk')
+
+    def reserve(self, lines, partial=False):
+        return self.change_stock(PRODUCT_UNIQUE_STOCK_RESERVE, lines, partial=partial)
+
+    def release(self, lines, partial=False):
+        return self.change_stock(PRODUCT_UNIQUE_STOCK_RELEASE, lines, partial=partial)
+
+    def consume(self, lines, locked=True, partial=False):
+        return self.change_stock(PRODUCT_UNIQUE_STOCK_CONSUME, lines, locked=locked, partial=partial)
+
+
 # valor de las caracteristicas especiales del producto final (imei, fecha caducidad)
 class ProductUnique(CodenerixModel):
+    class Meta(CodenerixModel.Meta):
+        indexes = [
+            # FEFO: lotes de un producto final por caducidad
+            models.Index(fields=['product_final', 'caducity'], name='products_unique_fefo'),
+            # informe de caducidades, solo las filas con stock
+            models.Index(fields=['caducity'], name='products_unique_caducity', condition=Q(stock_real__gt=0)),
+        ]
+
+    objects = ProductUniqueManager()
+
     product_final = models.ForeignKey(ProductFinal, on_delete=models.CASCADE, blank=False, null=False, related_name='products_unique', verbose_name=_('Product final'))
     box = models.ForeignKey(StorageBox, on_delete=models.CASCADE, blank=False, null=False, related_name='products_unique', verbose_name=_('Box'))
     value = models.CharField(_("Value"), max_length=80, null=True, blank=True)
@@ -1544,53 +2104,69 @@ class ProductUnique(CodenerixModel):
         fields.append(('stock_locked', _("Stock locked")))
         return fields
 
+    def change_stock(self, operation, quantity, locked=True):
+        if ProductUnique.objects.change_stock(operation, [(self.pk, quantity)], locked=locked):
+            raise ProductUniqueStockUnavailable(_("Not enough stock in {}").format(self))
+        self.refresh_from_db(fields=['stock_original', 'stock_real', 'stock_locked'])
+
+    def reserve(self, quantity):
+        self.change_stock(PRODUCT_UNIQUE_STOCK_RESERVE, quantity)
+
+    def release(self, quantity):
+        self.change_stock(PRODUCT_UNIQUE_STOCK_RELEASE, quantity)
+
+    def consume(self, quantity, locked=True):
+        self.change_stock(PRODUCT_UNIQUE_STOCK_CONSUME, quantity, locked)
+
     def locked_stock(self, quantity):
-        self.stock_locked += quantity
-        self.save()
+        if quantity >= 0:
+            self.reserve(quantity)
+        else:
+            self.release(-quantity)
 
     @transaction.atomic
-    def duplicate(self, quantity, locked=False):
-        # Do we have enought stock?
-        if self.stock_real > quantity:
-            if locked:
-                # Do we have enought locked stock?
-                if self.stock_lock>=quantity:
-                    newlock = quantity
-                else:
-                    raise IOError("Not enought locked products to split")
-            else:
-                # Find available stock here
-                available = self.stock_real-self.stock_lock
-                # Do you have enought free stock?
-                if available>=quantity:
-                    newlock = 0
-                else:
-                    raise IOError("Not enought free products to split")
-
-            # Make a copy from the actual ProductUnique
-            new_line = copy.copy(self)
-            new_line.pk = None
-            # Complete stocks as calculated
-            new_line.stock_original = quantity
-            new_line.stock_real = quantity
-            new_line.stock_lock = newlock
-            new_line.save()
-            self.stock_original -= quantity
-            self.stock_real -= quantity
-            self.stock_lock -= newlock
-            self.save()
-
-            # Check PurchaseAlbaran and link them to the new product
-            for pal in self.line_albaran_purchases.all():
-                pal.product_unique.add(new_line)
-                pal.save()
-
-            # Return new ProductUnique
-            return new_line
-        elif self.stock_real == quantity:
-            raise IOError("No need to split, you are taking all units from here")
+    def split(self, quantity, locked=False):
+        """
+        Move some units to a new product unique in the same box, locked units (locked=True) or available ones
+        The units leave this row with one conditional UPDATE, the stock of the product final doesn't change
+        """
+        newlock = quantity if locked else 0
+        if locked:
+            condition = Q(stock_real__gt=quantity, stock_locked__gte=quantity)
         else:
-            raise IOError("Not enought products to split")
+            condition = Q(stock_real__gt=quantity, stock_real__gte=F('stock_locked') + quantity)
+        updated = ProductUnique.objects.filter(condition, pk=self.pk).update(
+            stock_original=F('stock_original') - quantity,
+            stock_real=F('stock_real') - quantity,
+            stock_locked=F('stock_locked') - newlock,
+        )
+        self.refresh_from_db(fields=['stock_original', 'stock_real', 'stock_locked'])
+        if not updated:
+            if self.stock_real == quantity:
+                raise ProductUniqueStockUnavailable("No need to split, you are taking all units from here")
+            elif locked:
+                raise ProductUniqueStockUnavailable("Not enought locked products to split")
+            else:
+                raise ProductUniqueStockUnavailable("Not enought free products to split")
+
+        # Make a copy from the actual ProductUnique (save() of the model would reset its stock)
+        new_line = copy.copy(self)
+        new_line.pk = None
+        new_line.stock_original = quantity
+        new_line.stock_real = quantity
+        new_line.stock_locked = newlock
+        super(ProductUnique, new_line).save()
+
+        # Check PurchaseAlbaran and link them to the new product
+        for pal in self.line_albaran_purchases.all():
+            pal.product_unique.add(new_line)
+            pal.save()
+
+        # Return new ProductUnique
+        return new_line
+
+    def duplicate(self, quantity, locked=False):
+        return self.split(quantity, locked)
 
     def save(self, *args, **kwargs):
         product_final = ProductFinal.objects.filter(pk=self.product_final_id).first()
@@ -1614,15 +2190,122 @@ class ProductUnique(CodenerixModel):
             self.stock_real = self.stock_original
             self.stock_locked = 0
 
-        return super(ProductUnique, self).save(*args, **kwargs)
+        with transaction.atomic():
+            # stock anterior para actualizar la proyeccion del producto final (ProductFinalStock)
+            previous = None
+            if self.pk is not None:
+                # fila bloqueada hasta el final de la transaccion, otro save() a la vez lee el stock ya guardado
+                previous = ProductUnique.objects.select_for_update().filter(pk=self.pk).values_list('product_final_id', 'stock_original', 'stock_real', 'stock_locked').first()
+            result = super(ProductUnique, self).save(*args, **kwargs)
+            if previous is None:
+                previous = (self.product_final_id, 0, 0, 0)
+            elif previous[0] != self.product_final_id:
+                ProductFinalStock.objects.add_stock(previous[0], -previous[1], -previous[2], -previous[3])
+                previous = (self.product_final_id, 0, 0, 0)
+            ProductFinalStock.objects.add_stock(
+                self.product_final_id,
+                self.stock_original - previous[1],
+                self.stock_real - previous[2],
+                self.stock_locked - previous[3],
+            )
+        return result
+
+
+class ProductFinalStockManager(models.Manager):
+
+    def add_stock(self, product_final_id, original=0, real=0, locked=0):
+        """
+        Add the differences to the projection of a product final with one UPDATE (F expressions), it must run in the transaction that changes the stock
+        and after the change: a product final without projection gets it calculated from its products unique, this change included
+        """
+        if original or real or locked:
+            changes = {
+                'stock_original': F('stock_original') + original,
+                'stock_real': F('stock_real') + real,
+                'stock_locked': F('stock_locked') + locked,
+                'stock_available': F('stock_available') + real - locked,
+            }
+            if not self.filter(product_final_id=product_final_id).update(**changes):
+                try:
+                    # rebuild() es atomico, un error solo deshace su punto de guardado
+                    self.rebuild([product_final_id])
+                except IntegrityError:
+                    # otra transaccion ha creado la fila a la vez, ya se puede sumar sobre ella
+                    self.filter(product_final_id=product_final_id).update(**changes)
+
+    @transaction.atomic
+    def rebuild(self, product_finals=None):
+        """
+        Recalculate the projection of the given products final (all of them by default) from their products unique
+        """
+        queryset = ProductFinal.objects.all()
+        if product_finals is not None:
+            queryset = queryset.filter(pk__in=product_finals)
+        pks = list(queryset.values_list('pk', flat=True))
+
+        totals = {}
+        for info in ProductUnique.objects.filter(product_final_id__in=pks).values('product_final_id').annotate(
+            original=Sum('stock_original'),
+            real=Sum('stock_real'),
+            locked=Sum('stock_locked'),
+        ).order_by():
+            totals[info['product_final_id']] = info
+
+        existing = dict(self.filter(product_final_id__in=pks).select_for_update().values_list('product_final_id', 'pk'))
+        create = []
+        update = []
+        for pk in pks:
+            info = totals.get(pk, {})
+            row = self.model(
+                product_final_id=pk,
+                stock_original=info.get('original') or 0,
+                stock_real=info.get('real') or 0,
+                stock_locked=info.get('locked') or 0,
+            )
+            row.stock_available = row.stock_real - row.stock_locked
+            if pk in existing:
+                row.pk = existing[pk]
+                update.append(row)
+            else:
+                create.append(row)
+        self.bulk_create(create)
+        self.bulk_update(update, ['stock_original', 'stock_real', 'stock_locked', 'stock_available'])
+        return len(pks)
+
+
+# stock de cada producto final, suma de sus productos unicos (proyeccion mantenida en la misma transaccion que los cambia)
+class ProductFinalStock(CodenerixModel):
+    objects = ProductFinalStockManager()
+
+    product_final = models.OneToOneField(ProductFinal, on_delete=models.CASCADE, blank=False, null=False, related_name='stock', verbose_name=_('Product final'))
+    stock_original = models.FloatField(_("Stock original"), null=False, blank=False, default=0, editable=False)
+    stock_real = models.FloatField(_("Stock real"), null=False, blank=False, default=0, editable=False)
+    stock_locked = models.FloatField(_("Stock locked"), null=False, blank=False, default=0, editable=False)
+    stock_available = models.FloatField(_("Stock available"), null=False, blank=False, default=0, editable=False, db_index=True)
+
+    def __str__(self):
+        return u"{} ({})".format(smart_str(self.product_final), self.stock_available)
+
+    def __unicode__(self):
+        return self.__str__()
+
+    def __fields__(self, info):
+        fields = []
+        fields.append(('product_final', _("Product final")))
+        fields.append(('stock_original', _("Stock original")))
+        fields.append(('stock_real', _("Stock real")))
+        fields.append(('stock_locked', _("Stock locked")))
+        fields.append(('stock_available', _("Stock available")))
+        return fields
 
 
 # producto estrella (solo un registro publico)
-class FlagshipProduct(CustomQueryMixin, CodenerixModel, GenImageFile):
+class FlagshipProduct(TextsMixin, CustomQueryMixin, CodenerixModel, GenImageFile):
     product_final = models.ForeignKey(ProductFinal, on_delete=models.CASCADE, blank=False, null=False, related_name='flagship_products', verbose_name=_('Flagship product'))
     public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
     view_video = models.BooleanField(_("View video"), blank=True, null=False, default=False)
     orientazion = models.CharField(_("Orientazion"), max_length=2, choices=TYPE_ORIENTAZION, blank=False, null=False, default='R')
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         return u"{}".format(smart_str(self.product_final))
@@ -1647,7 +2330,14 @@ class FlagshipProduct(CustomQueryMixin, CodenerixModel, GenImageFile):
         return super(FlagshipProduct, self).save(*args, **kwards)
 
     @classmethod
-    def get_flagship(cls, lang, apply_surcharge=False):
+    def get_flagship(cls, lang, apply_surcharge=False, price_mode=None):
+        return STOREFRONT_CACHE.get(
+            ('flagship', lang, apply_surcharge, price_mode),
+            lambda: cls._get_flagship(lang, apply_surcharge, price_mode)
+        )
+
+    @classmethod
+    def _get_flagship(cls, lang, apply_surcharge=False, price_mode=None):
         flagship = cls.query_or(
             Q(public=True),
             "image",
@@ -1670,18 +2360,17 @@ class FlagshipProduct(CustomQueryMixin, CodenerixModel, GenImageFile):
         ).first()
 
         if flagship:
-            product_final = ProductFinal.objects.get(pk=flagship['pk'])
-            prices = product_final.calculate_price(apply_surcharge)
-            flagship['price'] = prices['price_total']
+            ProductFinal.set_prices([flagship], price_mode)
 
         return flagship
 
 
-class ProductFinalOption(CodenerixModel):
+class ProductFinalOption(TextsMixin, CodenerixModel):
     product_final = models.ForeignKey(ProductFinal, on_delete=models.CASCADE, related_name='productfinals_option', verbose_name=_("Product Final"))
     products_pack = models.ManyToManyField(ProductFinal, related_name='productfinals_optionpack', symmetrical=False, blank=False)
     active = models.BooleanField(_("Active"), blank=False, null=False, default=True)
     order = models.SmallIntegerField(_("Order"), blank=True, null=True)
+    texts = models.JSONField(_("Texts"), blank=True, null=False, default=dict, editable=False)
 
     def __unicode__(self):
         lang = get_language_database()
@@ -1701,6 +2390,271 @@ class ProductFinalOption(CodenerixModel):
         return fields
 
 
+# listado de la tienda (modelo de lectura)
+# claves de las facetas: prefijo y pk ('a12' atributo 12, 'f3' caracteristica 3), las claves numericas no se pueden filtrar en JSON
+LISTING_FACET_ATTRIBUTE = 'a{}'
+LISTING_FACET_FEATURE = 'f{}'
+
+
+# se envia cuando cambian las filas del listado (indices de busqueda)
+listing_refreshed = Signal()
+
+
+class ProductFinalListingManager(models.Manager):
+
+    def build(self, pks):
+        """
+        Build (without saving) the rows of the given products final, one per language, with 6 queries
+        """
+        langs = [lang_code.lower() for lang_code in settings.LANGUAGES_DATABASES]
+        fields = [
+            'pk', 'product_id', 'code', 'product__code', 'price', 'offer', 'outstanding', 'most_sold', 'sample',
+            'reviews_value', 'reviews_count', 'created', 'product__public', 'product__force_stock',
+            'product__family_id', 'product__category_id', 'product__subcategory_id', 'product__brand_id',
+        ]
+        fields += ['product__model']
+        for lang in langs:
+            fields += [
+                '{}__name'.format(lang),
+                '{}__slug'.format(lang),
+                '{}__public'.format(lang),
+                'product__family__{}__slug'.format(lang),
+                'product__category__{}__slug'.format(lang),
+                'product__subcategory__{}__slug'.format(lang),
+                'product__brand__{}__slug'.format(lang),
+                # solo para el texto de busqueda
+                'product__{}__name'.format(lang),
+                'product__{}__slug'.format(lang),
+                'product__brand__{}__name'.format(lang),
+                'product__category__{}__name'.format(lang),
+                'product__subcategory__{}__name'.format(lang),
+            ]
+        products_final = list(ProductFinal.objects.filter(pk__in=pks).values(*fields))
+        if not products_final:
+            return []
+
+        # imagen principal (la del producto final y si no tiene la del producto)
+        images = {}
+        for product_id, image in ProductImage.objects.filter(
+            product_id__in=set([info['product_id'] for info in products_final]),
+            principal=True
+        ).order_by('-pk').values_list('product_id', 'image'):
+            images[('product', product_id)] = image
+        for product_final_id, image in ProductFinalImage.objects.filter(
+            product_final_id__in=pks,
+            principal=True
+        ).order_by('-pk').values_list('product_final_id', 'image'):
+            images[('product_final', product_final_id)] = image
+
+        # stock
+        with_stock = set(ProductFinalStock.objects.filter(product_final_id__in=pks, stock_available__gt=0).values_list('product_final_id', flat=True))
+
+        # atributos (nombre y facetas) y caracteristicas (facetas)
+        attributes = {}
+        for pfa in ProductFinalAttribute.objects.filter(product_id__in=pks, attribute__isnull=False).select_related('attribute').order_by('attribute__order', 'pk'):
+            attributes.setdefault(pfa.product_id, []).append(pfa)
+        features = {}
+        for product_id, feature_id, value in ProductFeature.objects.filter(
+            product_id__in=set([info['product_id'] for info in products_final])
+        ).values_list('product_id', 'feature_id', 'value'):
+            features.setdefault(product_id, {})[LISTING_FACET_FEATURE.format(feature_id)] = value
+
+        rows = []
+        for info in products_final:
+            pfas = attributes.get(info['pk'], [])
+            facets = dict([(LISTING_FACET_ATTRIBUTE.format(pfa.attribute_id), pfa.value) for pfa in pfas])
+            facets.update(features.get(info['product_id'], {}))
+            image = images.get(('product_final', info['pk']), images.get(('product', info['product_id'])))
+            for lang in langs:
+                name = info['{}__name'.format(lang)]
+                if name:
+                    name = ' '.join([name] + [smart_str(value) for value in [pfa.resolve_value(lang) for pfa in pfas] if value])
+                search_text = [name, info['{}__slug'.format(lang)], info['code'], info['product__code'], info['product__model']]
+                for field in ('product__{}__name', 'product__{}__slug', 'product__brand__{}__name', 'product__brand__{}__slug', 'product__category__{}__name', 'product__category__{}__slug', 'product__subcategory__{}__name', 'product__subcategory__{}__slug'):
+                    search_text.append(info[field.format(lang)])
+                rows.append(self.model(
+                    product_final_id=info['pk'],
+                    lang=lang,
+                    name=name,
+                    slug=info['{}__slug'.format(lang)],
+                    code=info['code'] or info['product__code'],
+                    public=bool(info['product__public'] and info['{}__public'.format(lang)]),
+                    price=info['price'],
+                    offer=info['offer'],
+                    outstanding=info['outstanding'],
+                    most_sold=info['most_sold'],
+                    sample=info['sample'],
+                    reviews_value=info['reviews_value'],
+                    reviews_count=info['reviews_count'],
+                    image=image,
+                    product_created=info['created'],
+                    with_stock=not info['product__force_stock'] or info['pk'] in with_stock,
+                    product_id=info['product_id'],
+                    family_id=info['product__family_id'],
+                    category_id=info['product__category_id'],
+                    subcategory_id=info['product__subcategory_id'],
+                    brand_id=info['product__brand_id'],
+                    family_slug=info['product__family__{}__slug'.format(lang)],
+                    category_slug=info['product__category__{}__slug'.format(lang)],
+                    subcategory_slug=info['product__subcategory__{}__slug'.format(lang)],
+                    brand_slug=info['product__brand__{}__slug'.format(lang)],
+                    facets=facets,
+                    search_text=' '.join([smart_str(text) for text in search_text if text]),
+                ))
+        return rows
+
+    def refresh(self, product_finals=None, batch_size=RECALCULATE_BATCH_SIZE):
+        """
+        Rebuild the rows of the given products final (queryset or list of pks, all of them if None)
+        Return the number of rows written
+        """
+        full = product_finals is None
+        if full:
+            product_finals = ProductFinal.objects.all()
+        if isinstance(product_finals, models.QuerySet):
+            pks = list(product_finals.order_by().values_list('pk', flat=True).distinct())
+        else:
+            pks = list(set(product_finals))
+
+        # upsert sobre (product_final, lang): dos refrescos simultaneos del mismo producto final no chocan con la restriccion unica
+        langs = [lang_code.lower() for lang_code in settings.LANGUAGES_DATABASES]
+        update_fields = [field.name for field in self.model._meta.concrete_fields if not field.primary_key and field.name not in ('product_final', 'lang', 'created')]
+        # Django < 4.1 no tiene upsert en bulk_create: se borran y se vuelven a insertar las filas del lote
+        features = connections[self.db].features
+        upsert = getattr(features, 'supports_update_conflicts', False)
+        if getattr(features, 'supports_update_conflicts_with_target', False):
+            unique_fields = ['product_final', 'lang']
+        else:
+            # MySQL resuelve el conflicto con cualquier indice unico
+            unique_fields = None
+
+        written = 0
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            with transaction.atomic():
+                rows = self.build(batch)
+                if upsert:
+                    # filas de idiomas que ya no estan en LANGUAGES_DATABASES
+                    self.filter(product_final_id__in=batch).exclude(lang__in=langs).delete()
+                    self.bulk_create(rows, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields)
+                else:
+                    self.filter(product_final_id__in=batch).delete()
+                    self.bulk_create(rows)
+            written += len(rows)
+        # pks: filas refrescadas, None si se ha reconstruido todo el listado
+        listing_refreshed.send(sender=self.model, pks=None if full else pks)
+        return written
+
+    def refresh_prices(self, pks):
+        """
+        Copy the stored price of the given products final to their rows with 3 queries
+        """
+        prices = dict(ProductFinal.objects.filter(pk__in=pks).values_list('pk', 'price'))
+        rows = [
+            self.model(pk=pk, price=prices[product_final_id])
+            for pk, product_final_id in self.filter(product_final_id__in=pks).values_list('pk', 'product_final_id')
+            if product_final_id in prices
+        ]
+        if rows:
+            self.bulk_update(rows, ['price'])
+
+    def schedule_refresh(self, product_finals):
+        """
+        Refresh the rows of the given products final once the current transaction is committed
+        """
+        if isinstance(product_finals, models.QuerySet):
+            pks = list(product_finals.order_by().values_list('pk', flat=True).distinct())
+        else:
+            pks = list(product_finals)
+        if pks:
+            transaction.on_commit(lambda: self.refresh(pks))
+
+
+# una fila por producto final e idioma con todo lo que muestra y filtra el listado de la tienda
+# se mantiene con señales (signals.py) y se reconstruye con el comando rebuild_listing
+class ProductFinalListing(CodenerixModel):
+    class Meta(CodenerixModel.Meta):
+        unique_together = (('product_final', 'lang'), )
+
+    objects = ProductFinalListingManager()
+
+    product_final = models.ForeignKey(ProductFinal, on_delete=models.CASCADE, blank=False, null=False, related_name='listings', verbose_name=_('Product final'))
+    lang = models.CharField(_("Language"), max_length=10, blank=False, null=False, db_index=True)
+    name = models.CharField(_("Name"), max_length=500, blank=True, null=True)
+    slug = models.CharField(_("Slug"), max_length=250, blank=True, null=True, db_index=True)
+    code = models.CharField(_("Code"), max_length=250, blank=True, null=True)
+    public = models.BooleanField(_("Public"), blank=True, null=False, default=True)
+    price = models.DecimalField(_("Price"), null=False, blank=False, max_digits=CURRENCY_MAX_DIGITS, decimal_places=CURRENCY_DECIMAL_PLACES, default=0)
+    offer = models.BooleanField(_("Offer"), blank=True, null=False, default=False)
+    outstanding = models.BooleanField(_("Outstanding"), blank=True, null=False, default=False)
+    most_sold = models.BooleanField(_("Most sold"), blank=True, null=False, default=False)
+    sample = models.BooleanField(_("Sample"), blank=True, null=False, default=False)
+    reviews_value = models.FloatField(_("Reviews"), null=False, blank=False, default=0)
+    reviews_count = models.IntegerField(_("Reviews count"), null=False, blank=False, default=0)
+    image = models.CharField(_("Image"), max_length=200, blank=True, null=True)
+    # fecha de alta del producto final (novedades)
+    product_created = models.DateTimeField(_("Created"), blank=False, null=False, db_index=True)
+    with_stock = models.BooleanField(_("With stock"), blank=True, null=False, default=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=False, null=False, related_name='+', verbose_name=_('Product'))
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, blank=False, null=False, related_name='+', verbose_name=_('Family'))
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, blank=False, null=False, related_name='+', verbose_name=_('Category'))
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE, blank=False, null=False, related_name='+', verbose_name=_('Subcategory'))
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, blank=True, null=True, related_name='+', verbose_name=_('Brand'))
+    family_slug = models.CharField(_("Family"), max_length=250, blank=True, null=True, db_index=True)
+    category_slug = models.CharField(_("Category"), max_length=250, blank=True, null=True, db_index=True)
+    subcategory_slug = models.CharField(_("Subcategory"), max_length=250, blank=True, null=True, db_index=True)
+    brand_slug = models.CharField(_("Brand"), max_length=250, blank=True, null=True, db_index=True)
+    # valores de atributos y caracteristicas {'a<pk>': value, 'f<pk>': value}
+    facets = models.JSONField(_("Facets"), blank=True, null=False, default=dict)
+    # nombres, slugs y codigos del producto final, producto, marca, categoria y subcategoria (ver search.py)
+    search_text = models.TextField(_("Search text"), blank=True, null=True)
+
+    def __unicode__(self):
+        return u"{} ({})".format(smart_str(self.name), self.lang)
+
+    def __str__(self):
+        return self.__unicode__()
+
+    def __fields__(self, info):
+        fields = []
+        fields.append(('product_final', _("Product final")))
+        fields.append(('lang', _("Language")))
+        fields.append(('name', _("Name")))
+        fields.append(('price', _("Price")))
+        fields.append(('with_stock', _("With stock")))
+        return fields
+
+
+# modelos de texto de cada idioma: {(nombre del modelo, idioma): modelo de texto}
+TEXT_MODELS = {}
+
+
+def make_text_model(base, field, model_source, model_relate, lang_code):
+    """
+    Build the text model of model_relate in the language: class {model_source}Text{lang_code}(base) with a OneToOneField named field
+    The class is published in this module with its usual name and registered in TEXT_MODELS
+    """
+    name = '{}Text{}'.format(model_source, lang_code)
+    attrs = {
+        '__module__': __name__,
+        '__qualname__': name,
+        field: models.OneToOneField(globals()[model_relate], on_delete=models.CASCADE, blank=False, null=False, related_name=lang_code.lower()),
+    }
+    text_model = type(name, (base, ), attrs)
+    globals()[name] = text_model
+    TEXT_MODELS[(model_relate, lang_code.upper())] = text_model
+    return text_model
+
+
+def get_text_model(model, lang_code):
+    """
+    Text model of a model (class or name) in the language, get_text_model(Product, 'ES') -> ProductTextTextES
+    """
+    if not isinstance(model, str):
+        model = model.__name__
+    return TEXT_MODELS[(model, lang_code.upper())]
+
+
 MODELS_SLUG = [
     ("family", "Family"),
     ("category", "Category"),
@@ -1708,14 +2662,6 @@ MODELS_SLUG = [
     ("product_final_option", "ProductFinalOption"),
 ]
 
-for info in MODELS_SLUG:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenTextSlug):\n".format(model, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model, lang_code.lower())
-        exec(query)
-
 MODELS = [
     ("feature", "Feature"),
     ("attribute", "Attribute"),
@@ -1728,62 +2674,99 @@ MODELS = [
     ("option_value", "OptionValueFeatureSpecial"),
 ]
 
-for info in MODELS:
-    field = info[0]
-    model = info[1]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenText):\n".format(model, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model, lang_code.lower())
-        exec(query)
-
-
 MODELS_PRODUCTS = [
     ('product', 'ProductText', 'Product'),
 ]
 
-for info in MODELS_PRODUCTS:
-    field = info[0]
-    model_source = info[1]
-    model_relate = info[2]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenProductText):\n".format(model_source, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model_relate, lang_code.lower())
-        exec(query)
-
 MODELS_BRANDS = [
     ('brand', 'Brand', 'Brand'),
 ]
 
-for info in MODELS_BRANDS:
-    field = info[0]
-    model_source = info[1]
-    model_relate = info[2]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenBrandText):\n".format(model_source, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model_relate, lang_code.lower())
-        exec(query)
-
 MODELS_PRODUCTS_FINAL = [
     ('product', 'ProductFinal', 'ProductFinal'),
 ]
 
-for info in MODELS_PRODUCTS_FINAL:
-    field = info[0]
-    model_source = info[1]
-    model_relate = info[2]
-    for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenProductFinalText):\n".format(model_source, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model_relate, lang_code.lower())
-        exec(query)
-
 MODELS_SLIDERS = [
     ('product', 'FlagshipProduct'),
 ]
 
-for info in MODELS_SLIDERS:
-    field = info[0]
-    model = info[1]
+# (clase base, modelos); los modelos de MODELS_PRODUCTS, MODELS_BRANDS y MODELS_PRODUCTS_FINAL tienen nombre propio
+for base, infos in (
+    (GenTextSlug, MODELS_SLUG),
+    (GenText, MODELS),
+    (GenProductText, MODELS_PRODUCTS),
+    (GenBrandText, MODELS_BRANDS),
+    (GenProductFinalText, MODELS_PRODUCTS_FINAL),
+    (GenTextTitle, MODELS_SLIDERS),
+):
+    for info in infos:
+        field = info[0]
+        model_source = info[1]
+        model_relate = info[-1]
+        for lang_code in settings.LANGUAGES_DATABASES:
+            make_text_model(base, field, model_source, model_relate, lang_code)
+
+
+# indice slug -> pk de los modelos con slug traducido, por tipo e idioma
+# (tipo, modelo, campo del texto que apunta al modelo)
+SLUG_INDEX_MODELS = [
+    ('family', 'Family', 'family'),
+    ('category', 'Category', 'category'),
+    ('subcategory', 'Subcategory', 'subcategory'),
+    ('brand', 'Brand', 'brand'),
+    ('product_final', 'ProductFinal', 'product'),
+]
+# tipos cuyos slugs ya estan en el arbol de taxonomy.py, no tienen tabla propia
+SLUG_INDEX_TAXONOMY = ['family', 'category', 'subcategory']
+
+
+def slug_index_builder(text_model, field):
+    def builder():
+        return dict(text_model.objects.values_list('slug', '{}_id'.format(field)))
+    return builder
+
+
+SLUG_INDEX = {}
+SLUG_INDEX_TEXT_MODELS = {}
+for kind, model, field in SLUG_INDEX_MODELS:
     for lang_code in settings.LANGUAGES_DATABASES:
-        query = "class {}Text{}(GenTextTitle):\n".format(model, lang_code)
-        query += "  {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model, lang_code.lower())
-        exec(query)
+        text_model = get_text_model(model, lang_code)
+        if kind in SLUG_INDEX_TAXONOMY:
+            table = None
+        else:
+            table = LocalTable('slug_index_{}_{}'.format(kind, lang_code.lower()), slug_index_builder(text_model, field))
+            SLUG_INDEX_TEXT_MODELS[text_model] = table
+        SLUG_INDEX[(kind, lang_code.lower())] = (text_model, field, table)
+
+
+def get_slug_pk(kind, lang, slug):
+    """
+    Pk of the family, category, subcategory, brand or product_final with the slug in the language, None if there is none
+    Families, categories and subcategories are taken from the taxonomy tree (taxonomy.py), brands and products final from their slug index
+    A slug missing in the tree or the index is looked up in the database, unknown slugs don't rebuild them
+    """
+    text_model, field, table = SLUG_INDEX[(kind, lang.lower())]
+    if table is None:
+        from codenerix_products.taxonomy import get_node_by_slug
+        node = get_node_by_slug(lang, kind, slug)
+        pk = node['pk'] if node is not None else None
+    else:
+        pk = table.get().get(slug)
+    if pk is None:
+        if TEXT_STORAGE == TEXT_STORAGE_JSON:
+            # indice de expresion sobre el slug de cada idioma en la columna texts
+            model = text_model._meta.get_field(field).related_model
+            pk = model.objects.filter(**{'texts__{}__slug'.format(lang.lower()): slug}).values_list('pk', flat=True).first()
+        else:
+            pk = text_model.objects.filter(slug=slug).values_list('{}_id'.format(field), flat=True).first()
+    return pk
+
+
+def invalidate_slug_index(text):
+    """
+    Rebuild the slug index of a text model (called from the save() and delete() of the texts with slug)
+    The texts of the taxonomy have no index, their tree is rebuilt by its signals
+    """
+    table = SLUG_INDEX_TEXT_MODELS.get(type(text))
+    if table is not None:
+        table.invalidate()
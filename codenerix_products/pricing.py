@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, only needed by the vectorised pricing kernel
+    numpy = None
+
+from codenerix_products.exceptions import ProductPriceMismatch
+from codenerix_products.models import (
+    CURRENCY_DECIMAL_PLACES,
+    RECALCULATE_BATCH_SIZE,
+    TYPE_PRICE_PERCENTAGE,
+    TYPE_PRICE_INCREASE,
+    TYPE_PRICE_FINAL,
+    PRICING_RULE_ATTRIBUTE,
+    PRICING_RULE_FEATURE,
+    PRICING_RULE_FEATURE_SPECIAL,
+    ProductFinal,
+    ProductFinalAttribute,
+    ProductFeature,
+    get_pricing_rules,
+)
+
+
+PRICE_FIELDS = ('price_base', 'tax', 'price_total')
+
+
+def calculate_prices_vectorized(queryset=None, verify=False, batch_size=RECALCULATE_BATCH_SIZE):
+    """
+    Calculate the prices of all the products final in the queryset column-wise with numpy (catalogue-wide repricing)
+    Return a dictionary of arrays {'pk', 'price_base', 'tax', 'price_total'} rounded to CURRENCY_DECIMAL_PLACES,
+    products without tax are skipped
+    verify: compare the result with the Decimal reference (ProductFinal.objects.calculate_prices()), raise ProductPriceMismatch
+            if some price differs in one cent
+    """
+    if numpy is None:
+        raise ImportError("numpy is required by the vectorised pricing kernel")
+
+    if queryset is None:
+        queryset = ProductFinal.objects.all()
+
+    products_final = list(queryset.filter(product__tax__isnull=False).order_by('pk').values_list(
+        'pk',
+        'product_id',
+        'price_base_local',
+        'product__price_base',
+        'product__tax__tax',
+        'product__feature_special_id',
+    ))
+    size = len(products_final)
+
+    # atributos y caracteristicas (ordenados por prioridad)
+    attributes = {}
+    for product_final_id, attribute_id in ProductFinalAttribute.objects.filter(
+        product__in=queryset,
+        attribute__isnull=False
+    ).order_by('product_id', '-updated').values_list('product_id', 'attribute_id'):
+        attributes.setdefault(product_final_id, []).append(attribute_id)
+    features = {}
+    for product_id, feature_id in ProductFeature.objects.filter(
+        product__in=queryset.values('product_id')
+    ).order_by('product_id', '-updated').values_list('product_id', 'feature_id'):
+        features.setdefault(product_id, []).append(feature_id)
+
+    rules = get_pricing_rules(
+        attributes=set([pk for pks in attributes.values() for pk in pks]),
+        features=set([pk for pks in features.values() for pk in pks]),
+        features_special=set([info[5] for info in products_final if info[5] is not None]),
+    )
+
+    # una fila por modificador, en orden de prioridad dentro de cada producto final
+    modifier_rows = []
+    modifier_types = []
+    modifier_values = []
+    modifier_percentages = []
+    for row, (pk, product_id, price_base_local, price_base, tax, feature_special_id) in enumerate(products_final):
+        modifiers = [rules[PRICING_RULE_ATTRIBUTE].get(attribute_id) for attribute_id in attributes.get(pk, [])]
+        modifiers += [rules[PRICING_RULE_FEATURE].get(feature_id) for feature_id in features.get(product_id, [])]
+        if feature_special_id is not None:
+            modifiers.append(rules[PRICING_RULE_FEATURE_SPECIAL].get(feature_special_id))
+        for modifier in modifiers:
+            if modifier is not None:
+                type_price, value, percentage = modifier
+                modifier_rows.append(row)
+                modifier_types.append(type_price)
+                modifier_values.append(float(value))
+                modifier_percentages.append(float(percentage))
+
+    pks = numpy.array([info[0] for info in products_final], dtype=numpy.int64)
+    base = numpy.array([float(info[2] if info[2] is not None else info[3]) for info in products_final], dtype=numpy.float64)
+    taxes = numpy.array([info[4] for info in products_final], dtype=numpy.float64)
+    rows = numpy.array(modifier_rows, dtype=numpy.int64)
+    types = numpy.array(modifier_types, dtype='U2')
+    values = numpy.array(modifier_values, dtype=numpy.float64)
+    percentages = numpy.array(modifier_percentages, dtype=numpy.float64)
+
+    # incrementos y porcentajes (siempre sobre el precio base)
+    increase = types == TYPE_PRICE_INCREASE
+    percentage = types == TYPE_PRICE_PERCENTAGE
+    price_base = base + numpy.bincount(rows[increase], weights=values[increase], minlength=size) + base * numpy.bincount(rows[percentage], weights=percentages[percentage], minlength=size)
+
+    # el primer precio final de cada producto final anula el resto de modificadores
+    final = numpy.flatnonzero(types == TYPE_PRICE_FINAL)
+    if final.size:
+        final_rows, first = numpy.unique(rows[final], return_index=True)
+        price_base[final_rows] = values[final[first]]
+
+    tax = price_base * taxes / 100
+    result = {
+        'pk': pks,
+        'price_base': numpy.round(price_base, CURRENCY_DECIMAL_PLACES),
+        'tax': numpy.round(tax, CURRENCY_DECIMAL_PLACES),
+        'price_total': numpy.round(price_base + tax, CURRENCY_DECIMAL_PLACES),
+    }
+
+    if verify:
+        verify_prices(result, batch_size=batch_size)
+
+    return result
+
+
+def to_cents(value):
+    """
+    Integer amount of the smallest currency unit of a Decimal
+    """
+    return int(value.quantize(Decimal(1).scaleb(-CURRENCY_DECIMAL_PLACES)).scaleb(CURRENCY_DECIMAL_PLACES))
+
+
+def verify_prices(result, batch_size=RECALCULATE_BATCH_SIZE):
+    """
+    Compare the arrays of calculate_prices_vectorized() with the Decimal reference implementation
+    """
+    cents = dict(
+        (field, numpy.rint(result[field] * 10 ** CURRENCY_DECIMAL_PLACES).astype(numpy.int64))
+        for field in PRICE_FIELDS
+    )
+    mismatches = []
+    for start in range(0, len(result['pk']), batch_size):
+        batch = result['pk'][start:start + batch_size].tolist()
+        reference = ProductFinal.objects.calculate_prices(batch)
+        for row, pk in enumerate(batch, start):
+            for field in PRICE_FIELDS:
+                expected = to_cents(reference[pk][field])
+                if expected != cents[field][row]:
+                    mismatches.append((pk, field, expected, int(cents[field][row])))
+
+    if mismatches:
+        raise ProductPriceMismatch("{} prices differ from the reference implementation: {}".format(
+            len(mismatches),
+            ", ".join(["{} {} (expected {} got {} cents)".format(*info) for info in mismatches[:10]]),
+        ))
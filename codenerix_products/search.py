@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import operator
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.encoding import smart_str
+from django.utils.module_loading import import_string
+
+from codenerix_products.caches import JournalTable
+from codenerix_products.models import ProductFinal, ProductFinalListing, RECALCULATE_BATCH_SIZE
+
+
+# dotted path of the search backend, by default PostgresSearchBackend on PostgreSQL and PythonSearchBackend elsewhere
+SEARCH_BACKEND = getattr(settings, 'CDNX_PRODUCTS_SEARCH_BACKEND', None)
+# maximum number of products final returned by a search that asks for a limited number of results (find_product), the storefront listings are not capped
+SEARCH_LIMIT = getattr(settings, 'CDNX_PRODUCTS_SEARCH_LIMIT', 1000)
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Words of the text in lower case and without accents
+    """
+    text = unicodedata.normalize('NFKD', smart_str(text).lower())
+    return WORD.findall(''.join([char for char in text if not unicodedata.combining(char)]))
+
+
+class SearchBackend(object):
+    """
+    Search over the search_text of the storefront listing (ProductFinalListing)
+    """
+
+    def search(self, query, lang, limit=SEARCH_LIMIT):
+        """
+        Return the pks of the products final matching every word of the query (as a prefix), best ranked first
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """
+        The listing changed
+        """
+        pass
+
+    def update(self, pks):
+        """
+        The rows of the given products final changed
+        """
+        self.invalidate()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Full text search with a GIN index over to_tsvector(search_text) (migration 0016)
+    """
+    config = 'simple'
+
+    def search(self, query, lang, limit=SEARCH_LIMIT):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        words = WORD.findall(smart_str(query).lower())
+        if not words:
+            return []
+        # cada palabra como prefijo y todas obligatorias
+        search_query = SearchQuery(' & '.join(['{}:*'.format(word) for word in words]), config=self.config, search_type='raw')
+        # misma expresion que el indice para que se use
+        vector = SearchVector('search_text', config=self.config)
+        return list(ProductFinalListing.objects.annotate(
+            search=vector
+        ).filter(
+            lang=lang,
+            search=search_query
+        ).annotate(
+            rank=SearchRank(vector, search_query)
+        ).order_by('-rank', 'product_final_id').values_list('product_final_id', flat=True)[:limit])
+
+
+class PythonSearchBackend(SearchBackend):
+    """
+    Inverted index kept in memory, one per language (SQLite, tests...)
+    The refreshed rows of the listing are applied incrementally, a full refresh rebuilds the index
+    """
+
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, lang):
+        if lang not in self.tables:
+            self.tables[lang] = JournalTable(
+                'search_index_{}'.format(lang),
+                lambda lang=lang: self.build(lang),
+                lambda data, pks, lang=lang: self.apply(lang, data, pks),
+            )
+        return self.tables[lang]
+
+    def collect(self, lang, pks=None):
+        """
+        {product final pk: {token: occurrences}} of the listing rows of the language
+        """
+        queryset = ProductFinalListing.objects.filter(lang=lang)
+        if pks is not None:
+            queryset = queryset.filter(product_final_id__in=pks)
+        documents = {}
+        for pk, text in queryset.values_list('product_final_id', 'search_text').iterator():
+            document = documents.setdefault(pk, {})
+            for token in tokenize(text or ''):
+                document[token] = document.get(token, 0) + 1
+        return documents
+
+    def build(self, lang):
+        """
+        Return the sorted list of tokens, the index {token: {product final pk: occurrences}} and the tokens of each product final
+        """
+        documents = self.collect(lang)
+        index = {}
+        for pk, document in documents.items():
+            for token, occurrences in document.items():
+                index.setdefault(token, {})[pk] = occurrences
+        return (sorted(index), index, documents)
+
+    def apply(self, lang, data, pks):
+        """
+        New index with the given products final read again, the current one is not modified
+        """
+        tokens, index, documents = data
+        index = dict(index)
+        documents = dict(documents)
+        # los postings se copian antes de tocarlos, los lectores siguen usando el indice anterior
+        copied = set()
+        # la lista ordenada de tokens solo se rehace si aparecen o desaparecen tokens
+        resort = False
+        for pk in pks:
+            for token in documents.pop(pk, {}):
+                if token not in copied:
+                    index[token] = dict(index[token])
+                    copied.add(token)
+                index[token].pop(pk, None)
+                if not index[token]:
+                    del index[token]
+                    resort = True
+        for pk, document in self.collect(lang, pks).items():
+            documents[pk] = document
+            for token, occurrences in document.items():
+                if token not in index:
+                    index[token] = {}
+                    resort = True
+                elif token not in copied:
+                    index[token] = dict(index[token])
+                copied.add(token)
+                index[token][pk] = occurrences
+        if resort:
+            tokens = sorted(index)
+        return (tokens, index, documents)
+
+    def search(self, query, lang, limit=SEARCH_LIMIT):
+        words = tokenize(query)
+        if not words:
+            return []
+
+        tokens, index, documents = self.table(lang).get()
+        scores = None
+        for word in words:
+            # todos los tokens que empiezan por la palabra, la coincidencia exacta puntua el doble
+            matches = {}
+            position = bisect_left(tokens, word)
+            while position < len(tokens) and tokens[position].startswith(word):
+                weight = 2 if tokens[position] == word else 1
+                for pk, occurrences in index[tokens[position]].items():
+                    matches[pk] = matches.get(pk, 0) + occurrences * weight
+                position += 1
+
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict([(pk, scores[pk] + score) for pk, score in matches.items() if pk in scores])
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
+
+    def invalidate(self):
+        for lang_code in settings.LANGUAGES_DATABASES:
+            self.table(lang_code.lower()).invalidate()
+
+    def update(self, pks):
+        if len(pks) > RECALCULATE_BATCH_SIZE:
+            self.invalidate()
+        else:
+            for lang_code in settings.LANGUAGES_DATABASES:
+                self.table(lang_code.lower()).update(pks)
+
+
+BACKENDS = {}
+
+
+def get_search_backend():
+    """
+    Search backend configured in CDNX_PRODUCTS_SEARCH_BACKEND or the best one for the database
+    """
+    if 'backend' not in BACKENDS:
+        if SEARCH_BACKEND:
+            BACKENDS['backend'] = import_string(SEARCH_BACKEND)()
+        elif connection.vendor == 'postgresql':
+            BACKENDS['backend'] = PostgresSearchBackend()
+        else:
+            BACKENDS['backend'] = PythonSearchBackend()
+    return BACKENDS['backend']
+
+
+def rank_order(field, pks, limit=SEARCH_LIMIT):
+    """
+    Expression to order a queryset by the position of its field in pks (the ranking of a search)
+    Only the first limit pks are ranked, the rest go after them (a broad search doesn't build a huge CASE)
+    """
+    pks = pks[:limit]
+    return Case(*[When(**{field: pk, 'then': Value(position)}) for position, pk in enumerate(pks)], default=Value(len(pks)), output_field=IntegerField())
+
+
+def icontains_search(query, lang):
+    """
+    Pks of the products final with every word of the query inside some of their texts, the search used before the listing existed
+    """
+    lookups = [
+        "{}__name__icontains".format(lang),
+        "{}__slug__icontains".format(lang),
+        "code__icontains",
+        "product__code__icontains",
+        "product__model__icontains",
+        "product__{}__name__icontains".format(lang),
+        "product__{}__slug__icontains".format(lang),
+        "product__brand__{}__name__icontains".format(lang),
+        "product__brand__{}__slug__icontains".format(lang),
+        "product__category__{}__name__icontains".format(lang),
+        "product__category__{}__slug__icontains".format(lang),
+        "product__subcategory__{}__name__icontains".format(lang),
+        "product__subcategory__{}__slug__icontains".format(lang),
+    ]
+    words = smart_str(query).split()
+    condition = None
+    for lookup in lookups:
+        condition_and = reduce(operator.and_, [Q(**{lookup: word}) for word in words])
+        condition = condition_and if condition is None else condition | condition_and
+    return list(ProductFinal.objects.filter(condition).order_by('pk').values_list('pk', flat=True).distinct())
+
+
+def search_product_finals(query, lang, limit=None):
+    """
+    Pks of the products final matching the query, best ranked first (all of them by default)
+    Until the listing of the language is built (rebuild_listing) the texts are searched directly
+    """
+    lang = lang.lower()
+    if not smart_str(query).split():
+        return []
+    if not ProductFinalListing.objects.filter(lang=lang).exists():
+        return icontains_search(query, lang)[:limit]
+    return get_search_backend().search(query, lang, limit=limit)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from codenerix_products import models
+from codenerix_products.models import TypeTax, Feature, Attribute, FeatureSpecial, Product, ProductFinal, ProductFinalAttribute, ProductFeature, PRICING_RULES, OPTION_DESCRIPTIONS, STOREFRONT_CACHE, SALABLE_BOXES
+from codenerix_products.models import ProductImage, ProductFinalImage, ProductUnique, ProductFinalListing, OptionValueAttribute, FlagshipProduct, ProductFinalStock, listing_refreshed
+from codenerix_products.search import get_search_backend
+from codenerix_products.autocomplete import AUTOCOMPLETE_INDEXES
+from codenerix_products import taxonomy
+from codenerix_products.facets import FACETS
+from codenerix_products import texts
+
+
+# marcado de precios obsoletos
+# los cambios que no recalculan el precio en save() dejan el producto final marcado y reprice_products lo recalcula
+@receiver(post_save, sender=ProductFinalAttribute)
+@receiver(post_delete, sender=ProductFinalAttribute)
+def product_final_attribute_changed(sender, instance, **kwargs):
+    ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def product_feature_changed(sender, instance, **kwargs):
+    ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(product_id=instance.product_id))
+
+
+# carga de fixtures (raw), save() no se ejecuta
+@receiver(post_save, sender=ProductFinal)
+def product_final_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def product_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(product=instance))
+
+
+@receiver(post_save, sender=TypeTax)
+def type_tax_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(product__tax=instance))
+
+
+@receiver(post_save, sender=Feature)
+def feature_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(product__product_features__feature=instance))
+
+
+@receiver(post_save, sender=Attribute)
+def attribute_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(products_final_attr__attribute=instance))
+
+
+@receiver(post_save, sender=FeatureSpecial)
+def feature_special_loaded(sender, instance, raw=False, **kwargs):
+    if raw:
+        ProductFinal.objects.mark_price_stale(ProductFinal.objects.filter(product__feature_special=instance))
+
+
+# reglas de precio compiladas
+# post_save llega antes de que save() recalcule los productos finales, el recalculo ya usa la regla nueva
+@receiver(post_save, sender=Attribute)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_save, sender=Feature)
+@receiver(post_delete, sender=Feature)
+@receiver(post_save, sender=FeatureSpecial)
+@receiver(post_delete, sender=FeatureSpecial)
+def pricing_rule_changed(sender, instance, **kwargs):
+    PRICING_RULES.invalidate()
+
+
+# descripciones de las opciones (la opcion y sus textos en cada idioma)
+OPTION_DESCRIPTIONS_SENDERS = {}
+for model, table in OPTION_DESCRIPTIONS.items():
+    OPTION_DESCRIPTIONS_SENDERS[model] = table
+    for lang_code in settings.LANGUAGES_DATABASES:
+        OPTION_DESCRIPTIONS_SENDERS[models.get_text_model(model, lang_code)] = table
+
+
+def option_description_changed(sender, instance, **kwargs):
+    OPTION_DESCRIPTIONS_SENDERS[sender].invalidate()
+
+
+for sender in OPTION_DESCRIPTIONS_SENDERS:
+    post_save.connect(option_description_changed, sender=sender)
+    post_delete.connect(option_description_changed, sender=sender)
+
+
+# indices de autocompletado de los GenForeignKey, se actualizan solo los pks afectados
+AUTOCOMPLETE_SENDERS = {}
+for index in AUTOCOMPLETE_INDEXES:
+    for name, lookup in index.senders.items():
+        if name.endswith('Text'):
+            senders = [getattr(models, '{}{}'.format(name, lang_code)) for lang_code in settings.LANGUAGES_DATABASES]
+        else:
+            senders = [getattr(models, name)]
+        for sender in senders:
+            AUTOCOMPLETE_SENDERS.setdefault(sender, []).append((index, lookup))
+AUTOCOMPLETE_TEXT_SENDERS = set(models.TEXT_MODELS.values())
+
+
+def autocomplete_changed(sender, instance, **kwargs):
+    if sender in AUTOCOMPLETE_TEXT_SENDERS:
+        # los textos apuntan a su entidad
+        pk = getattr(instance, texts.get_text_field(sender).attname)
+    else:
+        pk = instance.pk
+    for index, lookup in AUTOCOMPLETE_SENDERS[sender]:
+        index.changed(lookup, pk, deleted=kwargs.get('signal') is post_delete)
+
+
+for sender in AUTOCOMPLETE_SENDERS:
+    post_save.connect(autocomplete_changed, sender=sender)
+    post_delete.connect(autocomplete_changed, sender=sender)
+
+
+# listado de la tienda (ProductFinalListing)
+# las cargas de fixtures (raw) se ignoran, después hay que ejecutar rebuild_listing
+def refresh_listing(product_finals):
+    ProductFinalListing.objects.schedule_refresh(product_finals)
+
+
+@receiver(post_save, sender=ProductFinal)
+def listing_product_final_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def listing_product_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing(ProductFinal.objects.filter(product=instance))
+
+
+@receiver(post_save, sender=ProductFinalImage)
+@receiver(post_delete, sender=ProductFinalImage)
+@receiver(post_save, sender=ProductUnique)
+@receiver(post_delete, sender=ProductUnique)
+def listing_product_final_related_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing([instance.product_final_id])
+
+
+@receiver(post_save, sender=ProductFinalAttribute)
+@receiver(post_delete, sender=ProductFinalAttribute)
+def listing_product_final_attribute_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def listing_product_related_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing(ProductFinal.objects.filter(product_id=instance.product_id))
+
+
+@receiver(post_save, sender=OptionValueAttribute)
+def listing_option_value_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing(ProductFinal.objects.filter(products_final_attr__attribute__list_value_id=instance.group_id))
+
+
+# textos en cada idioma: {modelo: funcion que devuelve los productos finales afectados}
+LISTING_TEXT_SENDERS = {}
+for lang_code in settings.LANGUAGES_DATABASES:
+    LISTING_TEXT_SENDERS[models.get_text_model('ProductFinal', lang_code)] = lambda instance: [instance.product_id]
+    LISTING_TEXT_SENDERS[models.get_text_model('Product', lang_code)] = lambda instance: ProductFinal.objects.filter(product_id=instance.product_id)
+    LISTING_TEXT_SENDERS[models.get_text_model('Family', lang_code)] = lambda instance: ProductFinal.objects.filter(product__family_id=instance.family_id)
+    LISTING_TEXT_SENDERS[models.get_text_model('Category', lang_code)] = lambda instance: ProductFinal.objects.filter(product__category_id=instance.category_id)
+    LISTING_TEXT_SENDERS[models.get_text_model('Subcategory', lang_code)] = lambda instance: ProductFinal.objects.filter(product__subcategory_id=instance.subcategory_id)
+    LISTING_TEXT_SENDERS[models.get_text_model('Brand', lang_code)] = lambda instance: ProductFinal.objects.filter(product__brand_id=instance.brand_id)
+    LISTING_TEXT_SENDERS[models.get_text_model('OptionValueAttribute', lang_code)] = lambda instance: ProductFinal.objects.filter(products_final_attr__attribute__list_value__options_value_attribute=instance.option_value_id)
+
+
+def listing_text_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing(LISTING_TEXT_SENDERS[sender](instance))
+
+
+for sender in LISTING_TEXT_SENDERS:
+    post_save.connect(listing_text_changed, sender=sender)
+    post_delete.connect(listing_text_changed, sender=sender)
+
+
+# indice de busqueda
+@receiver(listing_refreshed, sender=ProductFinalListing)
+def search_listing_refreshed(sender, pks=None, **kwargs):
+    if pks is None:
+        get_search_backend().invalidate()
+    else:
+        get_search_backend().update(pks)
+
+
+# helpers de la tienda cacheados (recomendados, destacados, producto estrella)
+STOREFRONT_SENDERS = [ProductFinal, Product, ProductImage, ProductFinalImage, FlagshipProduct]
+for lang_code in settings.LANGUAGES_DATABASES:
+    for name in ('ProductFinal', 'Product', 'FlagshipProduct', 'Brand', 'Category'):
+        STOREFRONT_SENDERS.append(models.get_text_model(name, lang_code))
+
+
+def storefront_changed(sender, instance, **kwargs):
+    STOREFRONT_CACHE.invalidate()
+
+
+for sender in STOREFRONT_SENDERS:
+    post_save.connect(storefront_changed, sender=sender)
+    post_delete.connect(storefront_changed, sender=sender)
+
+
+# arbol de familias, categorias y subcategorias (taxonomy.py)
+TAXONOMY_SENDERS = {}
+for model in (models.Family, models.Category, models.Subcategory):
+    TAXONOMY_SENDERS[model] = None
+    for lang_code in settings.LANGUAGES_DATABASES:
+        TAXONOMY_SENDERS[models.get_text_model(model, lang_code)] = lang_code
+
+
+def taxonomy_changed(sender, instance, **kwargs):
+    taxonomy.invalidate(TAXONOMY_SENDERS[sender])
+
+
+for sender in TAXONOMY_SENDERS:
+    post_save.connect(taxonomy_changed, sender=sender)
+    post_delete.connect(taxonomy_changed, sender=sender)
+
+
+# indice de facetas (facets.py), solo se recalculan los productos finales afectados
+@receiver(post_save, sender=ProductFinal)
+@receiver(post_delete, sender=ProductFinal)
+def facets_product_final_changed(sender, instance, **kwargs):
+    FACETS.update([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def facets_product_changed(sender, instance, **kwargs):
+    FACETS.update(ProductFinal.objects.filter(product=instance))
+
+
+@receiver(post_save, sender=ProductFinalAttribute)
+@receiver(post_delete, sender=ProductFinalAttribute)
+@receiver(post_save, sender=ProductFinalImage)
+@receiver(post_delete, sender=ProductFinalImage)
+def facets_product_final_related_changed(sender, instance, **kwargs):
+    if sender == ProductFinalImage:
+        FACETS.update([instance.product_final_id])
+    else:
+        FACETS.update([instance.product_id])
+
+
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def facets_product_related_changed(sender, instance, **kwargs):
+    FACETS.update(ProductFinal.objects.filter(product_id=instance.product_id))
+
+
+# proyeccion de stock de los productos finales (ProductFinalStock)
+# ProductUnique.save() la actualiza, aqui se crean las filas y se descuentan los borrados (tambien los de cascada)
+@receiver(post_save, sender=ProductFinal)
+def stock_product_final_created(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        ProductFinalStock.objects.get_or_create(product_final=instance)
+
+
+@receiver(post_delete, sender=ProductUnique)
+def stock_product_unique_deleted(sender, instance, **kwargs):
+    ProductFinalStock.objects.add_stock(instance.product_final_id, -instance.stock_original, -instance.stock_real, -instance.stock_locked)
+
+
+# cajas vendibles de cada TPV (ProductFinal.get_salable_boxes)
+# la relacion de los TPV con sus almacenes no se puede seguir desde aqui, la caducidad de la cache la cubre
+SALABLE_BOXES_SENDERS = []
+for model_name in ('StorageBox', 'StorageBoxStructure', 'StorageZone', 'Storage'):
+    try:
+        SALABLE_BOXES_SENDERS.append(apps.get_model('codenerix_storages', model_name))
+    except LookupError:
+        pass
+
+
+def salable_boxes_changed(sender, instance, **kwargs):
+    SALABLE_BOXES.invalidate()
+
+
+for sender in SALABLE_BOXES_SENDERS:
+    post_save.connect(salable_boxes_changed, sender=sender)
+    post_delete.connect(salable_boxes_changed, sender=sender)
+
+
+# copia de los textos de cada idioma en la columna texts de su entidad (texts.py)
+# las cargas de fixtures (raw) se ignoran, después hay que ejecutar sync_texts
+def text_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        texts.mirror_text(instance)
+
+
+def text_deleted(sender, instance, **kwargs):
+    texts.mirror_text(instance, deleted=True)
+
+
+for sender in models.TEXT_MODELS.values():
+    post_save.connect(text_saved, sender=sender)
+    post_delete.connect(text_deleted, sender=sender)
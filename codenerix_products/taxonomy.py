@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf import settings
+
+from codenerix_products.caches import LocalTable
+from codenerix_products.models import Family, Category, Subcategory
+
+
+# nodos del arbol: (tipo, modelo, campo del padre, campos propios)
+TAXONOMY_LEVELS = [
+    ('family', Family, None, ['code', 'order', 'show_menu', 'public', 'image', 'icon']),
+    ('category', Category, 'family', ['code', 'order', 'show_menu', 'public', 'image', 'icon']),
+    ('subcategory', Subcategory, 'category', ['code', 'order', 'show_menu', 'public', 'image', 'icon']),
+]
+
+
+def node_order(node):
+    return (node['order'] is None, node['order'], node['pk'])
+
+
+def build_tree(lang):
+    """
+    Taxonomy of the language, one query per level
+    families: families sorted by order, each node has pk, code, slug, name, order, show_menu, public, image, icon, parent and children
+    family/category/subcategory: {pk: node}
+    slugs: {'family'|'category'|'subcategory': {slug: node}}
+    """
+    tree = {'families': [], 'slugs': {}}
+    parents = None
+    for kind, model, parent_field, fields in TAXONOMY_LEVELS:
+        lookups = ['pk', '{}__slug'.format(lang), '{}__name'.format(lang)] + fields
+        if parent_field:
+            lookups.append('{}_id'.format(parent_field))
+
+        nodes = {}
+        for info in model.objects.values_list(*lookups):
+            node = dict(zip(['pk', 'slug', 'name'] + fields, info))
+            node['parent'] = info[-1] if parent_field else None
+            node['children'] = []
+            nodes[node['pk']] = node
+
+        for node in sorted(nodes.values(), key=node_order):
+            if parents is None:
+                tree['families'].append(node)
+            elif node['parent'] in parents:
+                parents[node['parent']]['children'].append(node)
+
+        tree[kind] = nodes
+        tree['slugs'][kind] = {node['slug']: node for node in nodes.values() if node['slug']}
+        parents = nodes
+    return tree
+
+
+TAXONOMY = {}
+for lang_code in settings.LANGUAGES_DATABASES:
+    TAXONOMY[lang_code.lower()] = LocalTable('taxonomy_{}'.format(lang_code.lower()), lambda lang=lang_code.lower(): build_tree(lang))
+
+
+def get_tree(lang):
+    """
+    Taxonomy tree of the language (see build_tree), shared by the whole process: it must not be modified
+    """
+    return TAXONOMY[lang.lower()].get()
+
+
+def get_node(lang, kind, pk):
+    """
+    Node of a family, category or subcategory by pk, None if it doesn't exist
+    """
+    return get_tree(lang)[kind].get(pk)
+
+
+def get_node_by_slug(lang, kind, slug):
+    """
+    Node of a family, category or subcategory by the slug of the language, None if it doesn't exist
+    """
+    return get_tree(lang)['slugs'][kind].get(slug)
+
+
+def invalidate(lang=None):
+    """
+    Rebuild the tree of the language (all of them by default)
+    """
+    if lang is None:
+        tables = TAXONOMY.values()
+    else:
+        tables = [TAXONOMY[lang.lower()]]
+    for table in tables:
+        table.invalidate()
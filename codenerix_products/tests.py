@@ -18,4 +18,490 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# Create your tests here.
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Exists
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from codenerix_storages.models import Storage, StorageZone, StorageBoxStructure, StorageBoxKind, StorageBox
+
+from codenerix_products.models import TypeTax, Family, Category, Subcategory, Product, ProductFinal, ProductFinalListing, ProductUnique, ProductFinalStock, FeatureSpecial
+from codenerix_products.models import Attribute, Feature, ProductFinalAttribute, ProductFeature
+from codenerix_products.models import TYPE_PRICE_PERCENTAGE, TYPE_PRICE_INCREASE, TYPE_PRICE_FINAL
+from codenerix_products.models import compile_price_rule, apply_price_modifiers
+from codenerix_products.exceptions import ProductUniqueStockUnavailable
+from codenerix_products import pricing
+from codenerix_products.caches import CACHE_ALIAS, LocalTable, GenerationCache
+from codenerix_products import views
+
+
+class CatalogueMixin(object):
+    """
+    Minimal catalogue: one tax, family, category and subcategory, the products are created by each test
+    """
+
+    def setUp(self):
+        super(CatalogueMixin, self).setUp()
+        self.tax = TypeTax.objects.create(tax=21, name='IVA 21', recargo_equivalencia=5.2)
+        self.family = Family.objects.create(code='FAM')
+        self.category = Category.objects.create(code='CAT', family=self.family)
+        self.subcategory = Subcategory.objects.create(code='SUB', category=self.category)
+
+    def create_product(self, code, price_base='10.00', **kwargs):
+        kwargs.setdefault('tax', self.tax)
+        return Product.objects.create(
+            code=code,
+            price_base=Decimal(price_base),
+            family=self.family,
+            category=self.category,
+            subcategory=self.subcategory,
+            **kwargs
+        )
+
+    def create_product_final(self, product, **kwargs):
+        return ProductFinal.objects.create(product=product, **kwargs)
+
+
+def get_subset_filters(queryset):
+    """
+    {field: value} of the filters of a queryset, 'with_options' for the Exists over the options
+    """
+    filters = {}
+    for child in queryset.query.where.children:
+        lhs = getattr(child, 'lhs', child)
+        if isinstance(lhs, Exists):
+            filters['with_options'] = not getattr(lhs, 'negated', False)
+        elif isinstance(getattr(lhs, 'expression', None), Exists):
+            # ~Exists de las versiones que lo envuelven en NegatedExpression
+            filters['with_options'] = False
+        else:
+            filters[lhs.target.name] = child.rhs
+    return filters
+
+
+class ProductFinalForeignSubsetTest(SimpleTestCase):
+    # filtros de cada variante del selector de productos finales
+    expected = {
+        views.ProductFinalForeign: {},
+        views.ProductFinalForeignSubset: {},
+        views.ProductFinalForeignSales: {'of_sales': True, 'with_options': False},
+        views.ProductFinalForeignPackSales: {'of_sales': True, 'with_options': True},
+        views.ProductFinalForeignAllSales: {'of_sales': True},
+        views.ProductFinalForeignPurchases: {'of_purchase': True, 'with_options': False},
+        views.ProductFinalForeignPackPurchases: {'of_purchase': True, 'with_options': True},
+        views.ProductFinalForeignAllPurchases: {'of_purchase': True},
+    }
+
+    def get_variants(self, view):
+        variants = [view]
+        for subclass in view.__subclasses__():
+            variants += self.get_variants(subclass)
+        return variants
+
+    def test_every_variant_is_checked(self):
+        self.assertEqual(set(self.get_variants(views.ProductFinalForeign)), set(self.expected))
+
+    def test_subset(self):
+        for view, filters in self.expected.items():
+            with self.subTest(view=view.__name__):
+                queryset = view().get_subset(ProductFinal.objects.all())
+                self.assertEqual(get_subset_filters(queryset), filters)
+
+
+class ProductSubsetIndexTest(TestCase):
+
+    def test_indexes(self):
+        # indices de of_sales y of_purchase (migracion 0017), SQLite no los usa para un filtro booleano sin mas condiciones
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Product._meta.db_table)
+        indexed = [info['columns'] for info in constraints.values() if info['index'] and not info['primary_key']]
+        self.assertIn(['of_sales'], indexed)
+        self.assertIn(['of_purchase'], indexed)
+
+
+class ProductFinalCreateTest(CatalogueMixin, TestCase):
+
+    def test_create(self):
+        # save() calcula el precio antes de que el producto final tenga pk
+        product_final = self.create_product_final(self.create_product('P1', '10.00'))
+        self.assertIsNotNone(product_final.pk)
+        self.assertEqual(product_final.price_base, Decimal('10.00'))
+        self.assertEqual(product_final.price, Decimal('12.10'))
+
+
+class ProductFinalListingRefreshTest(CatalogueMixin, TestCase):
+
+    def setUp(self):
+        super(ProductFinalListingRefreshTest, self).setUp()
+        self.product_final = self.create_product_final(self.create_product('P1', '10.00'))
+
+    def check_refresh(self):
+        langs = sorted(lang_code.lower() for lang_code in settings.LANGUAGES_DATABASES)
+        # el segundo refresco sobrescribe las filas del primero
+        for price in (Decimal('12.10'), Decimal('24.20')):
+            ProductFinal.objects.filter(pk=self.product_final.pk).update(price=price)
+            self.assertEqual(ProductFinalListing.objects.refresh([self.product_final.pk]), len(langs))
+            rows = ProductFinalListing.objects.filter(product_final=self.product_final).order_by('lang')
+            self.assertEqual([row.lang for row in rows], langs)
+            self.assertEqual({row.price for row in rows}, {price})
+
+    def test_refresh_upsert(self):
+        self.check_refresh()
+
+    def test_refresh_without_upsert(self):
+        # Django < 4.1 no tiene los indicadores de upsert
+        with mock.patch.object(connection.features, 'supports_update_conflicts', False, create=True), mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False, create=True):
+            self.check_refresh()
+
+
+class StockMixin(CatalogueMixin):
+    """
+    Catalogue with one storage box to receive the products unique
+    """
+
+    def setUp(self):
+        super(StockMixin, self).setUp()
+        self.storage = Storage.objects.create(name='Storage')
+        zone = StorageZone.objects.create(storage=self.storage, name='Zone')
+        structure = StorageBoxStructure.objects.create(zone=zone, name='Structure')
+        self.box = StorageBox.objects.create(box_structure=structure, box_kind=StorageBoxKind.objects.create(name='Kind'), name='Box')
+
+    def create_unique(self, product_final, quantity, caducity=None, value=None):
+        return ProductUnique.objects.create(product_final=product_final, box=self.box, value=value, caducity=caducity, stock_original=quantity)
+
+    def stock(self, product_final):
+        return ProductFinalStock.objects.filter(product_final=product_final).values_list('stock_original', 'stock_real', 'stock_locked', 'stock_available').get()
+
+    def assertStockRebuilt(self, *product_finals):
+        # la proyeccion mantenida en cada operacion coincide con la recalculada desde los productos unicos
+        stocks = [self.stock(product_final) for product_final in product_finals]
+        ProductFinalStock.objects.rebuild([product_final.pk for product_final in product_finals])
+        self.assertEqual(stocks, [self.stock(product_final) for product_final in product_finals])
+
+
+class ProductUniqueStockTest(StockMixin, TestCase):
+
+    def setUp(self):
+        super(ProductUniqueStockTest, self).setUp()
+        self.product_final1 = self.create_product_final(self.create_product('P1'))
+        self.product_final2 = self.create_product_final(self.create_product('P2'))
+        self.unique1 = self.create_unique(self.product_final1, 5)
+        self.unique2 = self.create_unique(self.product_final2, 2)
+
+    def test_reserve_rollback(self):
+        # la segunda linea no tiene stock: no se aplica ninguna
+        failed = ProductUnique.objects.reserve([(self.unique1.pk, 3), (self.unique2.pk, 4)])
+        self.assertEqual(failed, [(self.unique2.pk, 4)])
+        self.unique1.refresh_from_db()
+        self.unique2.refresh_from_db()
+        self.assertEqual((self.unique1.stock_real, self.unique1.stock_locked), (5, 0))
+        self.assertEqual((self.unique2.stock_real, self.unique2.stock_locked), (2, 0))
+        self.assertEqual(self.stock(self.product_final1), (5, 5, 0, 5))
+        self.assertStockRebuilt(self.product_final1, self.product_final2)
+
+    def test_reserve_partial(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            failed = ProductUnique.objects.reserve([(self.unique1.pk, 3), (self.unique2.pk, 4)], partial=True)
+        self.assertEqual(failed, [(self.unique2.pk, 4)])
+        self.unique1.refresh_from_db()
+        self.unique2.refresh_from_db()
+        self.assertEqual((self.unique1.stock_real, self.unique1.stock_locked), (5, 3))
+        self.assertEqual((self.unique2.stock_real, self.unique2.stock_locked), (2, 0))
+        self.assertEqual(self.stock(self.product_final1), (5, 5, 3, 2))
+        self.assertStockRebuilt(self.product_final1, self.product_final2)
+        # el listado de la tienda se refresca al confirmar
+        self.assertTrue(callbacks)
+        self.assertTrue(ProductFinalListing.objects.filter(product_final=self.product_final1).exists())
+
+    def test_reserve_release_consume(self):
+        self.assertEqual(ProductUnique.objects.reserve([(self.unique1.pk, 3), (self.unique2.pk, 2)]), [])
+        self.assertEqual(ProductUnique.objects.release([(self.unique1.pk, 1)]), [])
+        self.assertEqual(ProductUnique.objects.consume([(self.unique1.pk, 2), (self.unique2.pk, 2)]), [])
+        self.assertEqual(ProductUnique.objects.consume([(self.unique1.pk, 1)], locked=False), [])
+        self.assertEqual(self.stock(self.product_final1), (5, 2, 0, 2))
+        self.assertEqual(self.stock(self.product_final2), (2, 0, 0, 0))
+        self.assertStockRebuilt(self.product_final1, self.product_final2)
+
+    def test_change_stock_unavailable(self):
+        self.unique2.reserve(2)
+        with self.assertRaises(ProductUniqueStockUnavailable):
+            self.unique2.reserve(1)
+        self.assertEqual(self.stock(self.product_final2), (2, 2, 2, 0))
+
+    def test_split(self):
+        self.unique1.reserve(2)
+        before = self.stock(self.product_final1)
+        new_line = self.unique1.split(2, locked=True)
+        self.assertEqual((self.unique1.stock_real, self.unique1.stock_locked), (3, 0))
+        self.assertEqual((new_line.stock_real, new_line.stock_locked), (2, 2))
+        new_line = self.unique1.split(1)
+        self.assertEqual((new_line.stock_real, new_line.stock_locked), (1, 0))
+        # el stock total del producto final no cambia
+        self.assertEqual(before, self.stock(self.product_final1))
+        self.assertStockRebuilt(self.product_final1)
+        with self.assertRaises(ProductUniqueStockUnavailable):
+            self.unique1.split(2)
+
+
+class ProductUniqueBulkReceiveTest(StockMixin, TestCase):
+
+    def setUp(self):
+        super(ProductUniqueBulkReceiveTest, self).setUp()
+        # imei: valor unico por producto
+        self.product_final_unique = self.create_product_final(self.create_product('IMEI', feature_special=FeatureSpecial.objects.create(unique=True)))
+        self.product_final = self.create_product_final(self.create_product('P1'))
+        self.create_unique(self.product_final_unique, 1, value='111')
+
+    def test_bulk_receive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            created, errors = ProductUnique.objects.bulk_receive([
+                (self.product_final_unique, self.box, '222', None, 1),
+                # repetido en el lote
+                (self.product_final_unique.pk, self.box.pk, '222', None, 1),
+                # repetido en la base de datos
+                (self.product_final_unique, self.box, '111', None, 1),
+                # mas de una unidad con valor unico
+                (self.product_final_unique, self.box, '333', None, 2),
+                # producto final que no existe
+                (self.product_final.pk + 1000, self.box, None, None, 1),
+                (self.product_final, self.box, None, None, 7),
+            ])
+        self.assertEqual(sorted(errors), [1, 2, 3, 4])
+        self.assertEqual([(line.product_final_id, line.value, line.stock_real) for line in created], [
+            (self.product_final_unique.pk, '222', 1),
+            (self.product_final.pk, None, 7),
+        ])
+        self.assertEqual(self.stock(self.product_final_unique), (2, 2, 0, 2))
+        self.assertEqual(self.stock(self.product_final), (7, 7, 0, 7))
+        self.assertStockRebuilt(self.product_final_unique, self.product_final)
+        self.assertEqual(ProductFinalListing.objects.filter(product_final=self.product_final).get(lang='es').with_stock, True)
+
+
+class ProductUniqueFEFOTest(StockMixin, TestCase):
+
+    def setUp(self):
+        super(ProductUniqueFEFOTest, self).setUp()
+        self.today = timezone.now().date()
+        self.product_final = self.create_product_final(self.create_product('P1'))
+        self.late = self.create_unique(self.product_final, 4, caducity=self.today + datetime.timedelta(days=60))
+        self.empty = self.create_unique(self.product_final, 3, caducity=self.today + datetime.timedelta(days=1))
+        self.empty.consume(3, locked=False)
+        self.early = self.create_unique(self.product_final, 2, caducity=self.today + datetime.timedelta(days=10))
+        self.early.reserve(1)
+        self.expired = self.create_unique(self.product_final, 2, caducity=self.today - datetime.timedelta(days=5))
+        self.undated = self.create_unique(self.product_final, 5)
+        # otro producto final, no se mezcla
+        self.create_unique(self.create_product_final(self.create_product('P2')), 9, caducity=self.today)
+
+    def test_allocate_fefo(self):
+        lots, pending = ProductUnique.objects.allocate_fefo(self.product_final, 6)
+        # primero la caducidad mas temprana, sin los lotes sin stock disponible
+        self.assertEqual([(lot.pk, take) for lot, take in lots], [(self.expired.pk, 2), (self.early.pk, 1), (self.late.pk, 3)])
+        self.assertEqual(pending, 0)
+
+    def test_allocate_fefo_shortfall(self):
+        lots, pending = ProductUnique.objects.allocate_fefo(self.product_final, 20)
+        # los lotes sin caducidad al final
+        self.assertEqual([(lot.pk, take) for lot, take in lots], [(self.expired.pk, 2), (self.early.pk, 1), (self.late.pk, 4), (self.undated.pk, 5)])
+        self.assertEqual(pending, 8)
+        self.assertEqual(ProductUnique.objects.consume([(lot.pk, take) for lot, take in lots], locked=False), [])
+        self.assertEqual(self.stock(self.product_final)[3], 0)
+
+    def test_allocate_fefo_storages(self):
+        self.assertEqual(ProductUnique.objects.allocate_fefo(self.product_final, 1, storages=[self.storage.pk + 1]), ([], 1))
+
+    def test_near_expiry(self):
+        queryset = ProductUnique.objects.near_expiry(days=30).filter(product_final=self.product_final)
+        self.assertEqual(list(queryset), [self.early])
+        queryset = ProductUnique.objects.near_expiry(days=90, expired=True).filter(product_final=self.product_final)
+        self.assertEqual(list(queryset), [self.expired, self.early, self.late])
+
+
+class PricingMixin(CatalogueMixin):
+    """
+    Small catalogue with every kind of price modifier, every implementation of the price calculation must agree with
+    ProductFinal.calculate_price() and with the prices calculated by hand
+    """
+
+    def setUp(self):
+        super(PricingMixin, self).setUp()
+        percentage = Attribute.objects.create(type_price=TYPE_PRICE_PERCENTAGE, price=10)
+        increase = Attribute.objects.create(type_price=TYPE_PRICE_INCREASE, price=1.5)
+        final = Attribute.objects.create(type_price=TYPE_PRICE_FINAL, price=15)
+        feature = Feature.objects.create(type_price=TYPE_PRICE_INCREASE, price=2)
+        feature_special = FeatureSpecial.objects.create(type_price=TYPE_PRICE_PERCENTAGE, price=50, unique=False)
+        tax4 = TypeTax.objects.create(tax=4, name='IVA 4', recargo_equivalencia=0.5)
+
+        self.expected = {}
+        # sin modificadores
+        self.add('P1', '10.00', '12.10')
+        # porcentaje y incremento sobre el precio base del producto final
+        product_final = self.add('P2', '10.00', '16.46', price_base_local=Decimal('11.00'))
+        ProductFinalAttribute.objects.create(product=product_final, attribute=percentage, value='10%')
+        ProductFinalAttribute.objects.create(product=product_final, attribute=increase, value='+1.5')
+        # caracteristica del producto y caracteristica especial
+        product_final = self.add('P3', '20.00', '38.72', feature_special=feature_special)
+        ProductFeature.objects.create(product=product_final.product, feature=feature, value='XL')
+        # el precio final anula el resto de modificadores
+        product_final = self.add('P4', '30.00', '15.60', tax=tax4)
+        ProductFinalAttribute.objects.create(product=product_final, attribute=final, value='15')
+        ProductFinalAttribute.objects.create(product=product_final, attribute=increase, value='+1.5')
+        ProductFeature.objects.create(product=product_final.product, feature=feature, value='XL')
+
+    def add(self, code, price_base, price, price_base_local=None, **kwargs):
+        product_final = self.create_product_final(self.create_product(code, price_base, **kwargs), price_base_local=price_base_local)
+        self.expected[product_final.pk] = Decimal(price)
+        return product_final
+
+    def reference(self):
+        # calculo fila a fila
+        result = {}
+        for product_final in ProductFinal.objects.filter(pk__in=self.expected):
+            result[product_final.pk] = product_final.calculate_price()
+        self.assertEqual(dict((pk, info['price_total'].quantize(Decimal('0.01'))) for pk, info in result.items()), self.expected)
+        return result
+
+
+class ProductFinalPricesTest(PricingMixin, TestCase):
+
+    def test_calculate_prices(self):
+        reference = self.reference()
+        self.assertEqual(ProductFinal.objects.calculate_prices(list(self.expected)), reference)
+
+    def test_recalculate_many(self):
+        reference = self.reference()
+        ProductFinal.objects.mark_price_stale()
+        ProductFinal.objects.recalculate_many()
+        for pk, price, price_base, price_stale in ProductFinal.objects.filter(pk__in=self.expected).values_list('pk', 'price', 'price_base', 'price_stale'):
+            self.assertEqual((price, price_base, price_stale), (reference[pk]['price_total'].quantize(Decimal('0.01')), reference[pk]['price_base'].quantize(Decimal('0.01')), False))
+
+
+class PriceRulesTest(PricingMixin, TestCase):
+
+    def test_compiled_rules(self):
+        reference = self.reference()
+        for product_final in ProductFinal.objects.filter(pk__in=self.expected):
+            # reglas compiladas directamente desde los objetos, sin la tabla en memoria
+            modifiers = [compile_price_rule(attr.attribute.type_price, attr.attribute.price) for attr in product_final.products_final_attr.order_by('-updated')]
+            modifiers += [compile_price_rule(feature.feature.type_price, feature.feature.price) for feature in product_final.product.product_features.order_by('-updated')]
+            if product_final.product.feature_special:
+                modifiers.append(compile_price_rule(product_final.product.feature_special.type_price, product_final.product.feature_special.price))
+            if product_final.price_base_local is None:
+                price_base = product_final.product.price_base
+            else:
+                price_base = product_final.price_base_local
+            self.assertEqual(apply_price_modifiers(price_base, product_final.product.tax.tax, modifiers), reference[product_final.pk])
+
+    def test_invalidate_rules(self):
+        self.reference()
+        feature = Feature.objects.get()
+        feature.price = 4
+        # la tabla compilada se invalida al confirmar el guardado
+        with self.captureOnCommitCallbacks(execute=True):
+            feature.save()
+        product_final = ProductFinal.objects.get(product__code='P3')
+        self.assertEqual(product_final.calculate_price()['price_total'].quantize(Decimal('0.01')), Decimal('41.14'))
+
+
+@skipIf(pricing.numpy is None, "numpy is not installed")
+class VectorizedPricesTest(PricingMixin, TestCase):
+
+    def test_calculate_prices_vectorized(self):
+        reference = self.reference()
+        result = pricing.calculate_prices_vectorized(ProductFinal.objects.filter(pk__in=self.expected), verify=True)
+        self.assertEqual(sorted(result['pk'].tolist()), sorted(reference))
+        for row, pk in enumerate(result['pk'].tolist()):
+            for field in pricing.PRICE_FIELDS:
+                self.assertEqual(pricing.to_cents(Decimal(str(result[field][row]))), pricing.to_cents(reference[pk][field]))
+
+
+class CachesTest(TestCase):
+
+    def setUp(self):
+        super(CachesTest, self).setUp()
+        caches[CACHE_ALIAS].clear()
+        self.builds = 0
+
+    def builder(self):
+        self.builds += 1
+        return self.builds
+
+    def test_local_table(self):
+        table = LocalTable('test', self.builder, check_interval=0)
+        # otro proceso con la misma tabla
+        other = LocalTable('test', self.builder, check_interval=0)
+        self.assertEqual((table.get(), table.get()), (1, 1))
+        self.assertEqual(other.get(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            table.invalidate()
+            # se olvida en este proceso antes de confirmar
+            self.assertEqual(table.get(), 3)
+            self.assertEqual(other.get(), 2)
+        # el resto de procesos la reconstruyen con la nueva generacion
+        self.assertEqual(other.get(), 4)
+        self.assertEqual(table.get(), 5)
+        self.assertEqual(table.get(refresh=True), 6)
+
+    def test_generation_cache(self):
+        cache = GenerationCache('test', 60, 60, lock_wait=0)
+        self.assertEqual((cache.get(('key', 1), self.builder), cache.get(('key', 1), self.builder)), (1, 1))
+        self.assertEqual(cache.get(('key', 2), self.builder), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidate()
+        # nueva generacion, se reconstruye
+        self.assertEqual(cache.get(('key', 1), self.builder), 3)
+        self.assertEqual(cache.get(('key', 1), self.builder), 3)
+        # sin cache
+        cache = GenerationCache('test', 0, 60)
+        self.assertEqual((cache.get(('key', 1), self.builder), cache.get(('key', 1), self.builder)), (4, 5))
+
+    def check_rebuilding(self, stale_timeout):
+        cache = GenerationCache('test', 60, stale_timeout, lock_wait=0)
+        self.assertEqual(cache.get(('key', ), self.builder), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidate()
+        # otro proceso la esta reconstruyendo
+        caches[CACHE_ALIAS].add('cdnx_products:test:key:lock', 1, 30)
+        return cache.get(('key', ), self.builder)
+
+    def test_generation_cache_stale(self):
+        self.assertEqual(self.check_rebuilding(60), 1)
+
+    def test_generation_cache_never_stale(self):
+        self.assertEqual(self.check_rebuilding(0), 2)
+
+
+class SalableBoxesTest(StockMixin, TestCase):
+
+    def setUp(self):
+        super(SalableBoxesTest, self).setUp()
+        caches[CACHE_ALIAS].clear()
+        # get_salable_boxes() solo usa el pk del TPV y sus almacenes
+        self.pos = SimpleNamespace(pk=1, storage_stock=Storage.objects.filter(pk=self.storage.pk))
+
+    def test_salable_boxes(self):
+        self.assertEqual(ProductFinal.get_salable_boxes(self.pos), [self.box.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(ProductFinal.get_salable_boxes(self.pos), [self.box.pk])
+
+        # los cambios de las cajas y zonas invalidan la cache al confirmar
+        with self.captureOnCommitCallbacks(execute=True):
+            box = StorageBox.objects.create(box_structure=self.box.box_structure, box_kind=self.box.box_kind, name='Box 2')
+        self.assertEqual(sorted(ProductFinal.get_salable_boxes(self.pos)), sorted([self.box.pk, box.pk]))
+        zone = self.box.box_structure.zone
+        zone.salable = False
+        with self.captureOnCommitCallbacks(execute=True):
+            zone.save()
+        self.assertEqual(ProductFinal.get_salable_boxes(self.pos), [])
+
+    def test_salable_stock(self):
+        product_final = self.create_product_final(self.create_product('P1'))
+        self.create_unique(product_final, 5).reserve(2)
+        self.assertEqual(ProductFinal.get_salable_stock(self.pos, [product_final, product_final.pk + 1000]), {product_final.pk: 3, product_final.pk + 1000: 0})
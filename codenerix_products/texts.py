@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-products
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.fields.json import KeyTransform
+
+from codenerix_products.models import TEXT_MODELS, TEXT_STORAGE, TEXT_STORAGE_JSON, RECALCULATE_BATCH_SIZE
+from codenerix_products.models import MODELS, MODELS_SLUG, MODELS_BRANDS, MODELS_PRODUCTS, MODELS_PRODUCTS_FINAL, MODELS_SLIDERS
+
+
+# entidades con textos en cada idioma: (modelo, prefijo del nombre de sus modelos de texto)
+TEXT_ENTITIES = [(info[-1], info[1]) for info in MODELS_SLUG + MODELS + MODELS_PRODUCTS + MODELS_BRANDS + MODELS_PRODUCTS_FINAL + MODELS_SLIDERS]
+
+# indices de expresion sobre la columna texts: (modelo, prefijo del nombre de los indices), con el slug y el nombre de cada idioma
+TEXTS_INDEXES = [
+    ('Family', 'prod_family'),
+    ('Category', 'prod_category'),
+    ('Subcategory', 'prod_subcat'),
+    ('ProductFinalOption', 'prod_pfoption'),
+    ('Brand', 'prod_brand'),
+    ('Product', 'prod_product'),
+    ('ProductFinal', 'prod_pfinal'),
+]
+TEXTS_INDEXES_KEYS = ('slug', 'name')
+# MySQL can't index an expression returning JSON, there the lookups over the texts column are not indexed
+TEXTS_INDEXES_VENDORS = ('postgresql', 'sqlite')
+
+# valores de los textos que se guardan en la columna, el resto (fechas) se leen de la tabla si se usan
+TEXTS_VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+def get_text_field(text_model):
+    """
+    OneToOneField of a text model pointing to its entity (its related_name is the language)
+    """
+    for field in text_model._meta.local_fields:
+        if field.one_to_one:
+            return field
+
+
+def get_text_values(text):
+    """
+    Values of a text kept in the texts column of its entity: {attname: value}
+    """
+    values = {}
+    for field in text._meta.concrete_fields:
+        # los campos diferidos no han cambiado, se quedan como estaban en la columna
+        if field.attname in text.__dict__:
+            value = text.__dict__[field.attname]
+            if isinstance(value, TEXTS_VALUE_TYPES):
+                values[field.attname] = value
+    return values
+
+
+def mirror_text(text, deleted=False):
+    """
+    Copy a text (or its removal) to the texts column of its entity, under the language of the text
+    """
+    field = get_text_field(type(text))
+    model = field.related_model
+    lang = field.remote_field.related_name
+    pk = getattr(text, field.attname)
+    with transaction.atomic():
+        # los textos de cada idioma se guardan por separado, la fila se bloquea para no perder ninguno
+        texts = model.objects.select_for_update().filter(pk=pk).values_list('texts', flat=True).first()
+        if texts is None:
+            return
+        if deleted:
+            texts.pop(lang, None)
+        else:
+            texts.setdefault(lang, {}).update(get_text_values(text))
+        model.objects.filter(pk=pk).update(texts=texts)
+
+    # la entidad cargada junto al texto (formularios, pass_to_productfinal) se guarda despues con la columna al dia
+    if field.is_cached(text):
+        field.get_cached_value(text).texts = texts
+
+
+def rebuild_texts(model, text_models, pks=None, batch_size=RECALCULATE_BATCH_SIZE):
+    """
+    Rebuild the texts column of the entities of a model from its text models, returns the number of entities written
+    Works with the historical models of the migrations too
+    """
+    queryset = model.objects.order_by('pk')
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    pks = list(queryset.values_list('pk', flat=True))
+
+    written = 0
+    for position in range(0, len(pks), batch_size):
+        batch = pks[position:position + batch_size]
+        texts = {pk: {} for pk in batch}
+        for text_model in text_models:
+            field = get_text_field(text_model)
+            lang = field.remote_field.related_name
+            for text in text_model.objects.filter(**{'{}__in'.format(field.attname): batch}).iterator():
+                texts[getattr(text, field.attname)][lang] = get_text_values(text)
+        written += model.objects.bulk_update([model(pk=pk, texts=value) for pk, value in texts.items()], ['texts'])
+    return written
+
+
+def get_texts_indexes():
+    """
+    (model, index) of the expression indexes over the texts column: slug and name of each language
+    """
+    indexes = []
+    for model, prefix in TEXTS_INDEXES:
+        for lang_code in settings.LANGUAGES_DATABASES:
+            for key in TEXTS_INDEXES_KEYS:
+                expression = KeyTransform(key, KeyTransform(lang_code.lower(), 'texts'))
+                indexes.append((model, models.Index(expression, name='{}_{}_{}'.format(prefix, lang_code.lower(), key))))
+    return indexes
+
+
+def create_texts_indexes(apps, schema_editor, missing=False):
+    """
+    Create the expression indexes over the texts column (all of them, or only the missing ones after adding a language)
+    """
+    connection = schema_editor.connection
+    if connection.vendor not in TEXTS_INDEXES_VENDORS:
+        return []
+
+    created = []
+    for model_name, index in get_texts_indexes():
+        model = apps.get_model('codenerix_products', model_name)
+        if missing:
+            with connection.cursor() as cursor:
+                if index.name in connection.introspection.get_constraints(cursor, model._meta.db_table):
+                    continue
+        schema_editor.add_index(model, index)
+        created.append(index.name)
+    return created
+
+
+def drop_texts_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor in TEXTS_INDEXES_VENDORS:
+        for model_name, index in get_texts_indexes():
+            schema_editor.remove_index(apps.get_model('codenerix_products', model_name), index)
+
+
+class TextsAccessor(object):
+    """
+    Reverse accessor of a text (product.es) reading the texts column of the entity instead of the table of the language
+    It returns a real instance of the text model (it can be edited and saved), the fields missing in the column are read from the table when used
+    Texts not copied yet to the column and the assignments go to the original accessor
+    """
+
+    def __init__(self, descriptor, text_model):
+        self.descriptor = descriptor
+        self.related = descriptor.related
+        self.text_model = text_model
+        self.lang = self.related.get_accessor_name()
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            # Product.es.RelatedObjectDoesNotExist, Product.es.related...
+            return self.descriptor
+        if self.related.is_cached(instance):
+            return self.descriptor.__get__(instance, cls)
+
+        # texts puede estar diferido (only/defer), en ese caso no se consulta
+        values = (instance.__dict__.get('texts') or {}).get(self.lang)
+        if not values:
+            return self.descriptor.__get__(instance, cls)
+
+        fields = [field.attname for field in self.text_model._meta.concrete_fields if field.attname in values]
+        text = self.text_model.from_db(instance._state.db, fields, [values[field] for field in fields])
+        self.related.field.set_cached_value(text, instance)
+        self.related.set_cached_value(instance, text)
+        return text
+
+    def __set__(self, instance, value):
+        self.descriptor.__set__(instance, value)
+
+
+def install_texts_accessors():
+    """
+    With the json storage (CDNX_PRODUCTS_TEXT_STORAGE) the reverse accessors of the texts read the texts column
+    """
+    if TEXT_STORAGE != TEXT_STORAGE_JSON:
+        return
+    for text_model in TEXT_MODELS.values():
+        field = get_text_field(text_model)
+        model = field.related_model
+        name = field.remote_field.get_accessor_name()
+        descriptor = model.__dict__[name]
+        if not isinstance(descriptor, TextsAccessor):
+            setattr(model, name, TextsAccessor(descriptor, text_model))
@@ -18,6 +18,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from django.conf import settings
 from django.urls import re_path as url
 from .views import FeatureList, AttributeList, FeatureSpecialList, FamilyList, CategoryList, SubcategoryList, ProductList, ProductRelationSoldList, ProductImageList, ProductDocumentList, ProductFinalList, ProductFeatureList, ProductUniqueList
 from .views import FeatureCreate, AttributeCreate, FeatureSpecialCreate, FamilyCreate, CategoryCreate, SubcategoryCreate, ProductCreate, ProductRelationSoldCreate, ProductFinalCreate
@@ -43,7 +44,7 @@ from .views import SubcategorySubList, SubcategoryDetailModal
 from .views import BrandList, BrandCreate, BrandCreateModal, BrandUpdate, BrandUpdateModal, BrandDelete
 from .views import FlagshipProductList, FlagshipProductCreate, FlagshipProductCreateModal, FlagshipProductUpdate, FlagshipProductUpdateModal, FlagshipProductDelete
 from .views import CategorySubListPro, CategoryDetailModalPro, CategoryUpdateModalPro
-from .views import ListProducts, ListProductsBase, TypeTaxDetails
+from .views import ListProducts, ListProductsBase, ListProductsListing, TypeTaxDetails
 from .views import ProductFinalSubList, ProductFinalDetailsModal
 from .views import GroupValueFeatureList, GroupValueFeatureCreate, GroupValueFeatureCreateModal, GroupValueFeatureDetails, GroupValueFeatureUpdate, GroupValueFeatureUpdateModal, GroupValueFeatureDelete
 from .views import GroupValueAttributeList, GroupValueAttributeCreate, GroupValueAttributeCreateModal, GroupValueAttributeDetails, GroupValueAttributeUpdate, GroupValueAttributeUpdateModal, GroupValueAttributeDelete
@@ -279,7 +280,7 @@ urlpatterns = [
     url(r'^flagshipproducts/(?P<pk>\w+)/editmodal$', FlagshipProductUpdateModal.as_view(), name='CDNX_products_flagshipproducts_editmodal'),
     url(r'^flagshipproducts/(?P<pk>\w+)/delete$', FlagshipProductDelete.as_view(), name='CDNX_products_flagshipproducts_delete'),
 
-    url(r'^listproducts/(?P<type>\w+)/(?P<pk>[0-9]+)$', ListProducts.as_view(), name='CDNX_products_list_products'),
+    url(r'^listproducts/(?P<type>\w+)/(?P<pk>[0-9]+)$', (ListProductsListing if getattr(settings, 'CDNX_PRODUCTS_LISTING_READ_MODEL', False) else ListProducts).as_view(), name='CDNX_products_list_products'),
     url(r'^listproductsbase/(?P<type>\w+)/(?P<pk>[0-9]+)$', ListProductsBase.as_view(), name='CDNX_products_list_products_base'),
 
     url(r'^groupvaluefeatures$', GroupValueFeatureList.as_view(), name='CDNX_products_GroupValueFeatures_list'),
@@ -21,20 +21,19 @@
 import ast
 import datetime
 import json
-import operator
-import time
-from functools import reduce
 
 from django.db import IntegrityError, transaction
-from django.db.models import Q, F, Value, Sum
-from django.db.models.functions import Concat
+from django.db.models import Q, F, Value, Sum, Case, When, Exists, OuterRef, Subquery, IntegerField, Prefetch
+from django.db.models.functions import Coalesce, Concat
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.forms.utils import ErrorList
 from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
+from django.utils.encoding import smart_str
 from django.utils.http import urlsafe_base64_encode
 from django.utils.translation import gettext as _
 from django.views.generic import View
@@ -47,8 +46,11 @@ from codenerix_extensions.helpers import get_language_database
 
 from .models import TypeTax, Feature, Attribute, FeatureSpecial, Family, Category, Subcategory, Product, ProductRelationSold, ProductImage, ProductFinalImage
 from .models import ProductDocument, ProductFinal, ProductFeature, ProductUnique, ProductFinalAttribute, Brand, FlagshipProduct
+from .models import ProductFinalListing, LISTING_FACET_ATTRIBUTE, LISTING_FACET_FEATURE, get_slug_pk
 from .models import GroupValueFeature, GroupValueAttribute, GroupValueFeatureSpecial, OptionValueFeature, OptionValueAttribute, OptionValueFeatureSpecial
 from .models import MODELS, MODELS_SLUG, MODELS_BRANDS, MODELS_PRODUCTS, MODELS_PRODUCTS_FINAL, MODELS_SLIDERS, TYPE_VALUE_LIST, TYPE_VALUE_BOOLEAN, TYPE_VALUE_FREE
+from .search import rank_order, search_product_finals
+from . import autocomplete, facets
 from .forms import TypeTaxForm, FeatureForm, AttributeForm, FeatureSpecialForm, FamilyForm, CategoryForm, SubcategoryForm, SubcategoryOwnForm, ProductFormCreate
 from .forms import ProductForm, ProductRelationSoldForm, ProductImageForm, ProductFinalImageForm, ProductDocumentForm, ProductFinalFormCreate, ProductFinalFormCreateModal, ProductFinalForm, ProductFeatureForm, ProductUniqueForm
 from .forms import ProductFinalAttributeForm, ProductFinalRelatedSubForm, BrandForm, FlagshipProductForm
@@ -56,11 +58,10 @@ from .forms import GroupValueFeatureForm, GroupValueAttributeForm, GroupValueFea
 from .forms import ProductFinalOption
 from .forms import ProductFinalOptionForm, ProductFinalOptionFormWithoutProduct
 from .forms import ProductFormCreateCustom
+from .forms import get_text_form
 
 
 # ###########################################
-# import dynamic
-query = ""
 # forms for multiforms
 formsfull = {}
 
@@ -69,11 +70,7 @@ for info in MODELS + MODELS_BRANDS + MODELS_PRODUCTS + MODELS_SLIDERS + MODELS_S
     model = info[1]
     formsfull[model] = [(None, None, None)]
     for lang_code in settings.LANGUAGES_DATABASES:
-        query = "from codenerix_products.models import {}Text{}\n".format(model, lang_code)
-        query += "from codenerix_products.forms import {}TextForm{}".format(model, lang_code)
-        exec(query)
-
-        formsfull[model].append((eval("{}TextForm{}".format(model, lang_code.upper())), field, None))
+        formsfull[model].append((get_text_form(info[-1], lang_code), field, None))
 
 
 # Mixins
@@ -194,17 +191,7 @@ class FeatureForeign(GenFeatureUrl, GenForeignKey):
         return info
 
     def get_foreign(self, queryset, search, filters):
-        # Filter with search string
-        qsobject = Q(family__code__icontains=search)
-        qsobject |= Q(category__code__icontains=search)
-
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject |= Q(**{"{}__description__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"family__{}__name__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"category__{}__name__icontains".format(lang.lower()): search})
-
-        qs = queryset.filter(qsobject)
-
+        qs = queryset
         product_pk = filters.get('product_pk', None)
 
         if product_pk:
@@ -215,7 +202,10 @@ class FeatureForeign(GenFeatureUrl, GenForeignKey):
 
         qsobject = Q(**{"family__isnull": True})
         qsobject |= Q(**{"category__isnull": True})
-        qs = queryset.filter(qsobject)
+        qs = qs.filter(qsobject)
+
+        # Filter with search string, the best candidates that passed the filters
+        qs = autocomplete.FEATURES.filter(qs, search)
 
         return qs[:settings.LIMIT_FOREIGNKEY]
 
@@ -479,14 +469,7 @@ class CategoryForeign(GenCategoryUrl, GenForeignKey):
     label = "{<LANGUAGE_CODE>__name} ({code})"
 
     def get_foreign(self, queryset, search, filters):
-        # Filter with search string
-        query = [Q(code__icontains=search), ]
-        for lang in settings.LANGUAGES_DATABASES:
-            query.append(Q(**{"{}__name__icontains".format(lang.lower()): search}))
-
-        qs = queryset.filter(
-            reduce(operator.or_, query)
-        )
+        qs = queryset
         family = filters.get('FeatureForm_family', None)
         if family is None:
             family = filters.get('AttributeForm_family', None)
@@ -502,6 +485,9 @@ class CategoryForeign(GenCategoryUrl, GenForeignKey):
         if family:
             qs = qs.filter(family__pk=family)
 
+        # Filter with search string, the best candidates that passed the filters
+        qs = autocomplete.CATEGORIES.filter(qs, search)
+
         return qs[:settings.LIMIT_FOREIGNKEY]
 
 
@@ -566,14 +552,7 @@ class SubcategoryForeign(GenSubcategoryUrl, GenForeignKey):
     label = "{<LANGUAGE_CODE>__name} ({code})"
 
     def get_foreign(self, queryset, search, filters):
-        # Filter with search string
-        query = [Q(code__icontains=search), ]
-        for lang in settings.LANGUAGES_DATABASES:
-            query.append(Q(**{"{}__name__icontains".format(lang.lower()): search}))
-
-        qs = queryset.filter(
-            reduce(operator.or_, query)
-        )
+        qs = queryset
         category = filters.get('ProductForm_category', None)
         if category is None:
             category = filters.get('ProductFormCreate_category', None)
@@ -583,6 +562,9 @@ class SubcategoryForeign(GenSubcategoryUrl, GenForeignKey):
         if category:
             qs = qs.filter(category__pk=category)
 
+        # Filter with search string, the best candidates that passed the filters
+        qs = autocomplete.SUBCATEGORIES.filter(qs, search)
+
         return qs[:settings.LIMIT_FOREIGNKEY]
 
 
@@ -622,9 +604,9 @@ class ProductList(TranslatedMixin, GenProductUrl, GenList):
         'AddProductAndProductFinal': _("Add product & product final"),
     }
     annotations = {
-        'stock_original': Sum("products_final__products_unique__stock_original"),
-        'stock_real': Sum("products_final__products_unique__stock_real"),
-        'stock_locked': Sum("products_final__products_unique__stock_locked"),
+        'stock_original': Sum("products_final__stock__stock_original"),
+        'stock_real': Sum("products_final__stock__stock_real"),
+        'stock_locked': Sum("products_final__stock__stock_locked"),
     }
 
     def __fields__(self, info):
@@ -706,16 +688,7 @@ class ProductForeign(GenForeignKey):
 
     def get_foreign(self, queryset, search, filters):
         # Filter with search string
-        qsobject = Q(model__icontains=search)
-
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject |= Q(**{"{}__name__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"{}__description_short__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"family__{}__name__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"category__{}__name__icontains".format(lang.lower()): search})
-            qsobject |= Q(**{"subcategory__{}__name__icontains".format(lang.lower()): search})
-
-        queryset = queryset.filter(qsobject)
+        queryset = autocomplete.PRODUCTS.filter(queryset, search)
 
         return queryset[:settings.LIMIT_FOREIGNKEY]
 
@@ -972,9 +945,9 @@ class ProductFinalList(GenProductFinalUrl, GenList):
         'AddProductAndProductFinal': _("Add product & product final"),
     }
     annotations = {
-        'stock_original': Sum("products_unique__stock_original"),
-        'stock_real': Sum("products_unique__stock_real"),
-        'stock_locked': Sum("products_unique__stock_locked"),
+        'stock_original': F("stock__stock_original"),
+        'stock_real': F("stock__stock_real"),
+        'stock_locked': F("stock__stock_locked"),
     }
 
     def __fields__(self, info):
@@ -1127,36 +1100,40 @@ class ProductFinalEAN13Foreign(GenForeignKey):
         return info
 
     def get_foreign(self, queryset, search, filters):
-        qs = queryset.filter(
-            Q(ean13__icontains=search) | Q(code__icontains=search) | Q(product__code__icontains=search)
-        ).all()
+        qs = queryset
         box = filters.get('box', None)
         if box:
             qs = qs.filter(products_unique__box__pk=box)
+        qs = autocomplete.PRODUCTS_FINAL_EAN13.filter(qs, search)
         return qs.distinct()[:settings.LIMIT_FOREIGNKEY]
 
 
 class ProductFinalForeign(GenProductFinalUrl, GenForeignKey):
     model = ProductFinal
     label = "{product}"
+    # subconjunto de cada variante (venta/compra, con o sin opciones de pack), None no filtra
+    of_sales = None
+    of_purchase = None
+    with_options = None
+
+    def get_subset(self, queryset):
+        if self.of_sales is not None:
+            queryset = queryset.filter(product__of_sales=self.of_sales)
+        if self.of_purchase is not None:
+            queryset = queryset.filter(product__of_purchase=self.of_purchase)
+        if self.with_options is not None:
+            options = Exists(ProductFinalOption.objects.filter(product_final=OuterRef('pk')))
+            queryset = queryset.filter(options if self.with_options else ~options)
+        return queryset
 
     def __filter_product__(self, search, conditional=None):
-        queryset = ProductFinal.objects.filter(sample=False)
+        queryset = self.get_subset(ProductFinal.objects.filter(sample=False))
+        if conditional:
+            queryset = queryset.filter(**conditional)
         if search != '*':
-            qsobject = Q(product__code__icontains=search)
-            qsobject |= Q(product__family__code__icontains=search)
-            qsobject |= Q(product__category__code__icontains=search)
-
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject |= Q(**{"product__{}__description_short__icontains".format(lang.lower()): search})
-                qsobject |= Q(**{"product__family__{}__name__icontains".format(lang.lower()): search})
-                qsobject |= Q(**{"product__category__{}__name__icontains".format(lang.lower()): search})
-
-            qs = queryset.filter(qsobject)
-            if conditional:
-                qs.filter(**conditional)
-        elif conditional:
-            qs = queryset.filter(**conditional)
+            qs = autocomplete.PRODUCTS_FINAL.filter(queryset, search)
+        else:
+            qs = queryset
 
         answer = {}
         answer['rows'] = []
@@ -1173,24 +1150,34 @@ class ProductFinalForeign(GenProductFinalUrl, GenForeignKey):
                 'id': None,
                 # 'options': None,
             })
-        for product in qs.distinct()[:settings.LIMIT_FOREIGNKEY]:
+        # producto, impuesto, traduccion y opciones activas con sus productos en consultas fijas
+        lang = get_language_database()
+        qs = qs.distinct().select_related('product__tax', lang).prefetch_related(
+            Prefetch(
+                'productfinals_option',
+                queryset=ProductFinalOption.objects.filter(active=True).select_related(lang).prefetch_related(
+                    Prefetch('products_pack', queryset=ProductFinal.objects.annotate(pack_name=F('{}__name'.format(lang))).only('pk'))
+                )
+            )
+        )
+        for product in qs[:settings.LIMIT_FOREIGNKEY]:
             pack = []
-            lang = get_language_database()
-            if product.productfinals_option.filter(active=True).exists():
-                for option in product.productfinals_option.filter(active=True):
-                    pack.append({
-                        'id': option.pk,
-                        'label': getattr(option, lang).name,
-                        'products': list(option.products_pack.all().values('pk').annotate(name=F('{}__name'.format(lang))))
-                    })
+            for option in product.productfinals_option.all():
+                pack.append({
+                    'id': option.pk,
+                    'label': getattr(option, lang).name,
+                    'products': [{'pk': product_pack.pk, 'name': product_pack.pack_name} for product_pack in option.products_pack.all()]
+                })
+            tax = product.product.tax
+            description = product.__unicode__()
             answer['rows'].append({
                 'price': str(product.price),
                 'price_base': str(product.product.price_base),
-                'description': product.__unicode__(),
-                'type_tax': product.product.tax.pk,
-                'type_tax__pk': product.product.tax.pk,
-                'tax': product.product.tax.tax,
-                'label': u"{}".format(product.__unicode__()),
+                'description': description,
+                'type_tax': tax.pk,
+                'type_tax__pk': tax.pk,
+                'tax': tax.tax,
+                'label': u"{}".format(description),
                 'id': product.pk,
                 'packs:__JSON_DATA__': json.dumps(pack),
             })
@@ -1203,46 +1190,39 @@ class ProductFinalForeign(GenProductFinalUrl, GenForeignKey):
         return HttpResponse(json_answer, content_type='application/json')
 
 
-class ProductFinalForeignSales(ProductFinalForeign):
+class ProductFinalForeignSubset(ProductFinalForeign):
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
         search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_sales': True, 'productfinals_option__isnull': True})
+        return self.__filter_product__(search)
 
 
-class ProductFinalForeignPackSales(ProductFinalForeign):
-    @method_decorator(login_required)
-    def get(self, request, *args, **kwargs):
-        search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_sales': True, 'productfinals_option__isnull': False})
+class ProductFinalForeignSales(ProductFinalForeignSubset):
+    of_sales = True
+    with_options = False
 
 
-class ProductFinalForeignAllSales(ProductFinalForeign):
-    @method_decorator(login_required)
-    def get(self, request, *args, **kwargs):
-        search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_sales': True})
+class ProductFinalForeignPackSales(ProductFinalForeignSubset):
+    of_sales = True
+    with_options = True
 
 
-class ProductFinalForeignPurchases(ProductFinalForeign):
-    @method_decorator(login_required)
-    def get(self, request, *args, **kwargs):
-        search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_purchase': True, 'productfinals_option__isnull': True})
+class ProductFinalForeignAllSales(ProductFinalForeignSubset):
+    of_sales = True
 
 
-class ProductFinalForeignPackPurchases(ProductFinalForeign):
-    @method_decorator(login_required)
-    def get(self, request, *args, **kwargs):
-        search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_purchase': True, 'productfinals_option__isnull': False})
+class ProductFinalForeignPurchases(ProductFinalForeignSubset):
+    of_purchase = True
+    with_options = False
 
 
-class ProductFinalForeignAllPurchases(ProductFinalForeign):
-    @method_decorator(login_required)
-    def get(self, request, *args, **kwargs):
-        search = kwargs.get('search', None)
-        return self.__filter_product__(search, {'product__of_purchase': True})
+class ProductFinalForeignPackPurchases(ProductFinalForeignSubset):
+    of_purchase = True
+    with_options = True
+
+
+class ProductFinalForeignAllPurchases(ProductFinalForeignSubset):
+    of_purchase = True
 
 
 # ------- sublista de productos relacionados -------
@@ -2359,6 +2339,16 @@ class FlagshipProductDelete(GenFlagshipProductUrl, GenDelete):
     model = FlagshipProduct
 
 
+def slug_limit(lookup, kind, lang, slug):
+    """
+    Filter of a foreign key by the slug of the related object, resolved to its pk with the slug index (models.get_slug_pk)
+    """
+    pk = get_slug_pk(kind, lang, slug)
+    if pk is None:
+        return Q(pk__in=[])
+    return Q(**{lookup: pk})
+
+
 class ListProducts(GenList):
     public = True
     model = ProductFinal
@@ -2373,18 +2363,51 @@ class ListProducts(GenList):
         fields = []
         fields.append(('name:es__name', _("Name")))
         fields.append(('slug:es__slug', _("Slug")))
-        fields.append(('product__products_image__image', _("Image")))
-        fields.append(('product__products_image__principal', _("Principal")))
-        fields.append(('productfinals_image__image', _("Image")))
-        fields.append(('productfinals_image__principal', _("Principal")))
+        fields.append(('image', _("Image")))
         fields.append(('price', _("Price")))
         # fields.append(('price_old:price', _("Price")))
         fields.append(('offer', _("Offer")))
-        fields.append(('created', _("Created")))
+        fields.append(('new', _("New")))
         fields.append(('reviews_value', _("Reviews")))
         fields.append(('reviews_count', _("Reviews count")))
         return fields
 
+    @property
+    def annotations(self):
+        novelty = timezone.now() - datetime.timedelta(days=settings.CDNX_PRODUCTS_NOVELTY_DAYS)
+        annotations = {
+            # imagen principal del producto final y si no tiene la del producto
+            'image': Coalesce(
+                Subquery(ProductFinalImage.objects.filter(product_final=OuterRef('pk'), principal=True).values('image')[:1]),
+                Subquery(ProductImage.objects.filter(product=OuterRef('product'), principal=True).values('image')[:1]),
+            ),
+            'new': Case(When(created__gte=novelty, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        }
+        pks = self.get_search_pks()
+        if pks is not None:
+            # posicion de cada producto final en el resultado de la busqueda
+            annotations['search_rank'] = rank_order('pk', pks)
+        return annotations
+
+    @property
+    def default_ordering(self):
+        # con busqueda los mas relevantes primero
+        if self.get_search_pks() is not None:
+            return ['search_rank', 'pk']
+        return getattr(super(ListProducts, self), 'default_ordering', [])
+
+    def get_search_pks(self):
+        """
+        Pks of the products final matching the query of the listing, best ranked first, None without query (resolved once per request)
+        """
+        if not hasattr(self, '_search_pks'):
+            self._search_pks = None
+            if self.kwargs.get('pk', None) and self.kwargs.get('type', None) and self.request.GET.get("json"):
+                filters = ast.literal_eval(self.request.GET.get("json")).get('filters') or {}
+                if filters.get('query'):
+                    self._search_pks = search_product_finals(filters['query'], get_language_database())
+        return self._search_pks
+
     def __limitQ__(self, info):
         limits = {}
         pk = self.kwargs.get('pk', None)
@@ -2401,6 +2424,7 @@ class ListProducts(GenList):
         if pk and type_list:
             # aplicamos los filtros recibidos
             params = ast.literal_eval(info.request.GET.get("json"))
+            self.facets_query = self.get_facets_query(type_list, pk, lang, params)
 
             slug_subcategory = None
             if "subcategory" in params and params["subcategory"]:
@@ -2439,13 +2463,13 @@ class ListProducts(GenList):
                 raise Exception("Pendiente de definir")
 
             if slug_subcategory:
-                limits['by_sucategory'] = Q(**{"product__subcategory__{}__slug".format(lang): slug_subcategory})
+                limits['by_sucategory'] = slug_limit('product__subcategory_id', 'subcategory', lang, slug_subcategory)
 
             if slug_type:
-                limits['by_brand'] = Q(**{"product__brand__{}__slug".format(lang): slug_type})
+                limits['by_brand'] = slug_limit('product__brand_id', 'brand', lang, slug_type)
 
             if slug_family:
-                limits['by_family'] = Q(**{"product__family__{}__slug".format(lang): slug_family})
+                limits['by_family'] = slug_limit('product__family_id', 'family', lang, slug_family)
 
             # aplicamos los filtros recibidos
             params = ast.literal_eval(info.request.GET.get("json"))
@@ -2453,17 +2477,23 @@ class ListProducts(GenList):
                 filters = params["filters"]
                 if 'brand' in filters and filters['brand']:
                     limits["product__brand"] = Q(product__brand__in=filters['brand'])
+                # un Exists por faceta, cada una con su propia fila de la relacion
                 if 'feature' in filters and filters['feature']:
                     for feature in filters['feature']:
                         if feature and filters['feature'][feature]:
-                            limits['product__product_features__feature'] = Q(product__product_features__feature__pk=feature, product__product_features__value__in=filters['feature'][feature])
+                            limits['product__product_features__feature_{}'.format(feature)] = Exists(ProductFeature.objects.filter(
+                                product=OuterRef('product'),
+                                feature__pk=feature,
+                                value__in=filters['feature'][feature]
+                            ))
                 if 'attribute' in filters and filters['attribute']:
                     for attribute in filters['attribute']:
                         if attribute and filters['attribute'][attribute]:
-                            limits['products_final_attr__attribute'] = Q(
-                                products_final_attr__attribute__pk=attribute,
-                                products_final_attr__value__in=filters['attribute'][attribute]
-                            )
+                            limits['products_final_attr__attribute_{}'.format(attribute)] = Exists(ProductFinalAttribute.objects.filter(
+                                product=OuterRef('pk'),
+                                attribute__pk=attribute,
+                                value__in=filters['attribute'][attribute]
+                            ))
 
                 if 'subcategory' in filters and filters['subcategory']:
                     for subcategory in filters['subcategory']:
@@ -2471,36 +2501,9 @@ class ListProducts(GenList):
                             product__subcategory__pk__in=[int(x) for x in filters['subcategory']]
                         )
 
-                if 'query' in filters and filters['query']:
-                    filters_txt = [
-                        "{}__name__icontains".format(lang),
-                        "{}__slug__icontains".format(lang),
-                        "code__icontains",
-                        "product__code__icontains",
-                        "product__model__icontains",
-                        "product__{}__name__icontains".format(lang),
-                        "product__{}__slug__icontains".format(lang),
-                        "product__brand__{}__name__icontains".format(lang),
-                        "product__brand__{}__slug__icontains".format(lang),
-                        "product__category__{}__name__icontains".format(lang),
-                        "product__category__{}__slug__icontains".format(lang),
-                        "product__subcategory__{}__name__icontains".format(lang),
-                        "product__subcategory__{}__slug__icontains".format(lang),
-                    ]
-                    queryset_custom = None
-                    for filter_txt in filters_txt:
-                        queryset_custom_and = None
-                        for word in filters['query'].split():
-                            if queryset_custom_and:
-                                queryset_custom_and &= Q(**{filter_txt: word})
-                            else:
-                                queryset_custom_and = Q(**{filter_txt: word})
-                        if queryset_custom:
-                            queryset_custom |= queryset_custom_and
-                        else:
-                            queryset_custom = queryset_custom_and
-
-                    limits['query'] = queryset_custom
+                if self.facets_query['product_finals'] is not None:
+                    # resultados del motor de busqueda (search.py) sobre el listado de la tienda
+                    limits['query'] = Q(pk__in=self.facets_query['product_finals'])
 
                 if 'price_from' in filters and filters['price_from']:
                     try:
@@ -2518,72 +2521,193 @@ class ListProducts(GenList):
                     except ValueError:
                         pass
 
-                if ('force_image' not in filters):
-                    limits['image'] = (Q(product__products_image__principal=True) | Q(productfinals_image__principal=True))
-                elif ('force_image' in filters and filters['force_image'] == 1):
-                    limits['image'] = (Q(product__products_image__principal=True) | Q(productfinals_image__principal=True))
+                if ('force_image' not in filters) or (filters['force_image'] == 1):
+                    limits['image'] = (
+                        Exists(ProductImage.objects.filter(product=OuterRef('product'), principal=True)) | Exists(ProductFinalImage.objects.filter(product_final=OuterRef('pk'), principal=True))
+                    )
 
             if only_with_stock is None:
                 only_with_stock = settings.CDNX_PRODUCTS_SHOW_ONLY_STOCK
 
-            if only_with_stock and hasattr(self.model, 'product_stocks'):
-                limits['force_stock'] = reduce(operator.or_, (
-                    Q(product__force_stock=True, product_stocks__quantity__gt=0),
-                    Q(product__force_stock=False)
-                ))
+            if only_with_stock:
+                # proyeccion de stock (ProductFinalStock), una fila por producto final
+                limits['force_stock'] = Q(product__force_stock=False) | Q(stock__stock_available__gt=0)
 
         return limits
 
-    def render_to_response(self, context, **response_kwargs):
-        context = super(ListProducts, self).render_to_response(context, **response_kwargs)
-
-        datas = context._container[0]
-        if type(datas) == bytes:
-            datas = datas.decode('utf-8')
-        answer = json.loads(datas)
-        products = []
-        for product in answer['table']['body']:
-            temp = product.copy()
-            # image principal
-            pos_image_ppal = [i for i, x in enumerate(product['productfinals_image__principal']) if x == 'True']
-            if len(pos_image_ppal) == 0:
-                pos_image_ppal = [i for i, x in enumerate(product['product__products_image__principal']) if x == 'True']
-                if pos_image_ppal:
-                    image = temp['product__products_image__image'][pos_image_ppal[0]]
-                else:
-                    image = None
-            else:
-                image = temp['productfinals_image__image'][pos_image_ppal[0]]
-            temp['image'] = image
-            # is new?
-            created = None
-            for date_format in getattr(settings, 'DATETIME_INPUT_FORMATS', []):
+    def get_facets_query(self, type_list, pk, lang, params):
+        """
+        Scope, selection and price range of the listing for the facet counts (facets.py), the search is resolved here once
+        """
+        scope = []
+        kinds = {'SUB': 'subcategory', 'CAT': 'category', 'FAM': 'family', 'BRAND': 'brand'}
+        if type_list in kinds:
+            scope.append((kinds[type_list], int(pk)))
+        for kind in ('subcategory', 'brand', 'family'):
+            if params.get(kind) and params[kind] != '*':
+                scope.append((kind, get_slug_pk(kind, lang, params[kind])))
+
+        filters = params.get('filters') or {}
+        query = {'scope': scope, 'selection': filters, 'price_from': None, 'price_to': None, 'product_finals': None}
+        if filters.get('query'):
+            query['product_finals'] = self.get_search_pks()
+        for key in ('price_from', 'price_to'):
+            if filters.get(key):
                 try:
-                    created = datetime.datetime.strptime(temp['created'], date_format)
-                    break
+                    query[key] = float(filters[key])
                 except ValueError:
                     pass
-            if created and (abs(int(time.time() - time.mktime(created.timetuple())))) / (3600 * 24) <= settings.CDNX_PRODUCTS_NOVELTY_DAYS:
-                temp['new'] = 1
+        if filters and (('force_image' not in filters) or (filters['force_image'] == 1)):
+            scope.append(('image', ))
+        return query
+
+    def json_builder(self, answer, context):
+        # recuentos de cada valor de las facetas con el resto de filtros aplicados
+        if getattr(self, 'facets_query', None) is not None:
+            answer['facets'] = facets.get_counts(**self.facets_query)
+
+        # nombre con los valores de sus atributos, los de toda la pagina en 1 consulta (las descripciones de las opciones salen de OPTION_DESCRIPTIONS)
+        attrs = {}
+        queryset = ProductFinalAttribute.objects.filter(
+            product__pk__in=[product['pk'] for product in answer['table']['body']]
+        ).select_related('attribute')
+        for pfa, value in ProductFinalAttribute.get_values(queryset):
+            attrs.setdefault(pfa.product_id, []).append(smart_str(value))
+
+        for product in answer['table']['body']:
+            if attrs.get(product['pk']):
+                product['name'] += ' '
+                product['name'] += ' '.join(attrs[product['pk']])
+
+        return answer
+
+
+class ListProductsListing(ListProducts):
+    """
+    ListProducts served from the storefront listing (ProductFinalListing), without joins
+    """
+    model = ProductFinalListing
+
+    def __fields__(self, info):
+        fields = []
+        fields.append(('product_final__pk', _("Product final")))
+        fields.append(('name', _("Name")))
+        fields.append(('slug', _("Slug")))
+        fields.append(('image', _("Image")))
+        fields.append(('price', _("Price")))
+        fields.append(('offer', _("Offer")))
+        fields.append(('new', _("New")))
+        fields.append(('reviews_value', _("Reviews")))
+        fields.append(('reviews_count', _("Reviews count")))
+        return fields
+
+    @property
+    def annotations(self):
+        novelty = timezone.now() - datetime.timedelta(days=settings.CDNX_PRODUCTS_NOVELTY_DAYS)
+        annotations = {
+            'new': Case(When(product_created__gte=novelty, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        }
+        pks = self.get_search_pks()
+        if pks is not None:
+            annotations['search_rank'] = rank_order('product_final_id', pks)
+        return annotations
+
+    @property
+    def default_ordering(self):
+        if self.get_search_pks() is not None:
+            return ['search_rank', 'product_final_id']
+        return getattr(super(ListProducts, self), 'default_ordering', [])
+
+    def __limitQ__(self, info):
+        limits = {}
+        pk = self.kwargs.get('pk', None)
+        type_list = self.kwargs.get('type', None)
+        lang = get_language_database()
+
+        if pk and type_list:
+            limits['lang'] = Q(lang=lang)
+
+            # aplicamos los filtros recibidos
+            params = ast.literal_eval(info.request.GET.get("json"))
+            self.facets_query = self.get_facets_query(type_list, pk, lang, params)
+
+            only_with_stock = None
+            # filtramos dependiendo de la url original que estemos visitando
+            if type_list == 'SUB':
+                only_with_stock = Category.objects.filter(subcategory__pk=pk, show_only_product_stock=True).exists()
+                limits['type_list'] = Q(subcategory_id=pk)
+
+            elif type_list == 'CAT':
+                limits['type_list'] = Q(category_id=pk)
+
+            elif type_list == 'FAM':
+                limits['type_list'] = Q(family_id=pk)
+
+            elif type_list == 'BRAND':
+                limits['type_list'] = Q(brand_id=pk)
+
+            elif type_list == 'SEARCH':
+                only_with_stock = settings.CDNX_PRODUCTS_SHOW_ONLY_STOCK
+
             else:
-                temp['new'] = 0
+                raise Exception("Pendiente de definir")
+
+            if params.get("subcategory") and params["subcategory"] != '*':
+                limits['by_sucategory'] = Q(subcategory_slug=params["subcategory"])
+
+            if params.get("brand") and params["brand"] != '*':
+                limits['by_brand'] = Q(brand_slug=params["brand"])
+
+            if params.get("family") and params["family"] != '*':
+                limits['by_family'] = Q(family_slug=params["family"])
+
+            if "filters" in params and params["filters"]:
+                filters = params["filters"]
+                if 'brand' in filters and filters['brand']:
+                    limits["brand"] = Q(brand__in=filters['brand'])
+                if 'feature' in filters and filters['feature']:
+                    for feature in filters['feature']:
+                        if feature and filters['feature'][feature]:
+                            key = LISTING_FACET_FEATURE.format(feature)
+                            limits['facets_{}'.format(key)] = Q(**{'facets__{}__in'.format(key): [str(x) for x in filters['feature'][feature]]})
+                if 'attribute' in filters and filters['attribute']:
+                    for attribute in filters['attribute']:
+                        if attribute and filters['attribute'][attribute]:
+                            key = LISTING_FACET_ATTRIBUTE.format(attribute)
+                            limits['facets_{}'.format(key)] = Q(**{'facets__{}__in'.format(key): [str(x) for x in filters['attribute'][attribute]]})
+
+                if 'subcategory' in filters and filters['subcategory']:
+                    limits['subcategory'] = Q(subcategory_id__in=[int(x) for x in filters['subcategory']])
+
+                if self.facets_query['product_finals'] is not None:
+                    limits['query'] = Q(product_final_id__in=self.facets_query['product_finals'])
+
+                for key, lookup in (('price_from', 'price__gte'), ('price_to', 'price__lte')):
+                    if key in filters and filters[key]:
+                        try:
+                            limits[key] = Q(**{lookup: float(filters[key])})
+                        except ValueError:
+                            pass
 
-            attrs = []
-            for attr in ProductFinalAttribute.objects.filter(product__pk=product['pk']):
-                attrs.append(attr.__unicode__(show_attribute=False))
-            if attrs:
-                temp['name'] += ' '
-                temp['name'] += ' '.join(attrs)
-            # clean info
-            temp.pop('product__products_image__image')
-            temp.pop('product__products_image__principal')
-            temp.pop('created')
+                if ('force_image' not in filters) or (filters['force_image'] == 1):
+                    limits['image'] = Q(image__isnull=False)
+
+            if only_with_stock is None:
+                only_with_stock = settings.CDNX_PRODUCTS_SHOW_ONLY_STOCK
 
-            products.append(temp)
+            if only_with_stock:
+                limits['force_stock'] = Q(with_stock=True)
+
+        return limits
+
+    def json_builder(self, answer, context):
+        # el nombre ya incluye los valores de sus atributos
+        for product in answer['table']['body']:
+            product['pk'] = product.pop('product_final__pk')
 
-        answer['table']['body'] = products
-        context._container[0] = json.dumps(answer).encode()
-        return context
+        if getattr(self, 'facets_query', None) is not None:
+            answer['facets'] = facets.get_counts(**self.facets_query)
+        return answer
 
 
 class ListProductsBase(GenList):
@@ -2602,18 +2726,25 @@ class ListProductsBase(GenList):
         fields = []
         fields.append(('name:{}__name'.format(lang), _("Name")))
         fields.append(('slug:{}__slug'.format(lang), _("Slug")))
-        fields.append(('products_image__image', _("Image")))
-        fields.append(('products_image__principal', _("Principal")))
+        fields.append(('image', _("Image")))
         # fields.append(('productfinals_image__image', _("Image")))
         # fields.append(('productfinals_image__principal', _("Principal")))
         # fields.append(('price', _("Price")))
         # fields.append(('price_old:price', _("Price")))
         # fields.append(('offer', _("Offer")))
-        fields.append(('created', _("Created")))
+        fields.append(('new', _("New")))
         # fields.append(('reviews_value', _("reviews_value")))
         # fields.append(('reviews_count', _("reviews_count")))
         return fields
 
+    @property
+    def annotations(self):
+        novelty = timezone.now() - datetime.timedelta(days=settings.CDNX_PRODUCTS_NOVELTY_DAYS)
+        return {
+            'image': Subquery(ProductImage.objects.filter(product=OuterRef('pk'), principal=True).values('image')[:1]),
+            'new': Case(When(created__gte=novelty, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        }
+
     def __limitQ__(self, info):
         limits = {}
         pk = self.kwargs.get('pk', None)
@@ -2662,13 +2793,13 @@ class ListProductsBase(GenList):
                 raise Exception("Pendiente de definir")
 
             if slug_subcategory:
-                limits['by_sucategory'] = Q(**{"subcategory__{}__slug".format(lang): slug_subcategory})
+                limits['by_sucategory'] = slug_limit('subcategory_id', 'subcategory', lang, slug_subcategory)
 
             if slug_type:
-                limits['by_brand'] = Q(**{"brand__{}__slug".format(lang): slug_type})
+                limits['by_brand'] = slug_limit('brand_id', 'brand', lang, slug_type)
 
             if slug_family:
-                limits['by_family'] = Q(**{"family__{}__slug".format(lang): slug_type})
+                limits['by_family'] = slug_limit('family_id', 'family', lang, slug_family)
 
             # aplicamos los filtros recibidos
             params = ast.literal_eval(info.request.GET.get("json"))
@@ -2679,12 +2810,16 @@ class ListProductsBase(GenList):
                 if 'feature' in filters and filters['feature']:
                     for feature in filters['feature']:
                         if feature and filters['feature'][feature]:
-                            limits['product_features__feature'] = Q(product_features__feature__pk=feature, product_features__value__in=filters['feature'][feature])
+                            limits['product_features__feature_{}'.format(feature)] = Exists(ProductFeature.objects.filter(
+                                product=OuterRef('pk'),
+                                feature__pk=feature,
+                                value__in=filters['feature'][feature]
+                            ))
                 """
                 if 'attribute' in filters and filters['attribute']:
                     for attribute in filters['attribute']:
                         if attribute and filters['attribute'][attribute]:
-                            limits['products_final_attr__attribute'] = Q(
+                            limits['products_final_attr__attribute_{}'.format(attribute)] = Q(
                                 products_final_attr__attribute__pk=attribute,
                                 products_final_attr__value__in=filters['attribute'][attribute]
                             )
@@ -2745,10 +2880,8 @@ class ListProductsBase(GenList):
                     except ValueError:
                         pass
                 """
-                if ('force_image' not in filters):
-                    limits['image'] = Q(products_image__principal=True)
-                elif ('force_image' in filters and filters['force_image'] == 1):
-                    limits['image'] = Q(products_image__principal=True)
+                if ('force_image' not in filters) or (filters['force_image'] == 1):
+                    limits['image'] = Q(Exists(ProductImage.objects.filter(product=OuterRef('pk'), principal=True)))
 
             if only_with_stock is None:
                 only_with_stock = settings.CDNX_PRODUCTS_SHOW_ONLY_STOCK
@@ -2765,74 +2898,22 @@ class ListProductsBase(GenList):
 
         return limits
 
-    def render_to_response(self, context, **response_kwargs):
-        context = super(ListProductsBase, self).render_to_response(context, **response_kwargs)
-        datas = context._container[0]
-        if type(datas) == bytes:
-            datas = datas.decode('utf-8')
-        answer = json.loads(datas)
-        products = []
+    def json_builder(self, answer, context):
+        # valores de los atributos de cada producto final {product pk: {product final pk: [values]}}
+        # los de toda la pagina en 1 consulta (las descripciones de las opciones salen de OPTION_DESCRIPTIONS)
+        attrs = {}
+        queryset = ProductFinalAttribute.objects.filter(
+            product__product__pk__in=[product['pk'] for product in answer['table']['body']]
+        ).select_related('attribute', 'product').order_by('attribute__order')
+        for pfa, value in ProductFinalAttribute.get_values(queryset):
+            values = attrs.setdefault(pfa.product.product_id, {}).setdefault(pfa.product_id, [])
+            if value:
+                values.append(smart_str(value))
+
         for product in answer['table']['body']:
-            temp = product.copy()
-            # image principal
-            pos_image_ppal = [i for i, x in enumerate(product['products_image__principal']) if x == 'True']
+            product['attrs'] = attrs.get(product['pk'], {})
 
-            if len(pos_image_ppal) == 0:
-                image = None
-            else:
-                image = temp['products_image__image'][pos_image_ppal[0]]
-            temp['image'] = image
-            # is new?
-            created = None
-            for date_format in getattr(settings, 'DATETIME_INPUT_FORMATS', []):
-                try:
-                    created = datetime.datetime.strptime(temp['created'], date_format)
-                    break
-                except ValueError:
-                    pass
-            if created and (abs(int(time.time() - time.mktime(created.timetuple())))) / (3600 * 24) <= settings.CDNX_PRODUCTS_NOVELTY_DAYS:
-                temp['new'] = 1
-            else:
-                temp['new'] = 0
-
-            attrs = {}
-            for pfa in ProductFinalAttribute.objects.filter(product__product__pk=product['pk']).order_by(
-                'attribute__order'
-            ):
-                if pfa.product not in attrs:
-                    attrs[pfa.product.pk] = []
-
-                if pfa.attribute.type_value == TYPE_VALUE_BOOLEAN:
-                    value = bool(pfa.value) and _('True') or _('False')
-                elif pfa.attribute.type_value == TYPE_VALUE_FREE:
-                    value = pfa.value
-                elif pfa.attribute.type_value == TYPE_VALUE_LIST:
-                    lang = get_language_database()
-                    field = '{}__description'.format(lang)
-                    ov = OptionValueAttribute.objects.filter(
-                        group=pfa.attribute.list_value,
-                        pk=int(pfa.value)
-                    ).values(
-                        field
-                    ).first()
-                    if ov:
-                        value = ov[field]
-                    else:
-                        value = None
-                if value:
-                    attrs[pfa.product.pk].append(value)
-
-            temp['attrs'] = attrs
-            # clean info
-            temp.pop('products_image__image')
-            temp.pop('products_image__principal')
-            temp.pop('created')
-
-            products.append(temp)
-
-        answer['table']['body'] = products
-        context._container[0] = json.dumps(answer).encode()
-        return context
+        return answer
 
 
 # ###########################################
@@ -45,4 +45,8 @@ setup(
         "django-codenerix",
         "django-codenerix-extensions",
     ],
+    extras_require={
+        # vectorised pricing kernel (audit_prices)
+        "numpy": ["numpy"],
+    },
 )